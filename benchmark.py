@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for PdfSplitter.
+
+Generates reproducible synthetic books with PyMuPDF (varying page count, TOC
+shape, image weight and font reuse) and times split_smart, split_by_pages,
+split_manually and _save_ranges end to end. Reports pages/sec, MB/sec, peak
+RSS and output-size amplification, and writes the results to a JSON file
+that can be compared against a saved baseline.
+
+Startup is checked too: `pdf-split-by-contents.py --help` is timed in fresh
+interpreters, and loading the script must not import heavy modules
+(STARTUP_HEAVY_MODULES); one that appears is reported as a regression.
+
+Metadata lookups are measured against a local google_books_stub.py server
+with injected latency: the same synthetic ISBNs are resolved over kept-alive
+connections and with a new connection per request, reporting requests/sec
+and p50/p95/p99 latency.
+
+Usage:
+    python benchmark.py                                  # Run all scenarios
+    python benchmark.py --scenario l2l3-images           # Run one scenario
+    python benchmark.py --scale 0.2 --repeat 1           # Quick smoke run
+    python benchmark.py --metadata-isbns 0               # Skip the metadata lookups
+    python benchmark.py --baseline bench_baseline.json   # Compare with a baseline
+    cp bench_results.json bench_baseline.json            # Save a new baseline
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import subprocess
+import platform
+import tempfile
+import datetime
+import statistics
+import importlib.util
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+SPLITTER_SCRIPT = Path(__file__).with_name("pdf-split-by-contents.py")
+RESULTS_FILE = "bench_results.json"
+RESULTS_VERSION = 1
+GENERATOR_VERSION = 1  # Bump when make_book() output changes
+
+# Synthetic books: page count, TOC shape, image weight, font reuse
+SCENARIOS = {
+    'l1-text': {'pages': 300, 'toc': 'l1', 'images': 'none', 'fonts': 'shared'},
+    'l2l3-images': {'pages': 300, 'toc': 'l2l3', 'images': 'light', 'fonts': 'shared'},
+    'deep-heavy': {'pages': 200, 'toc': 'deep', 'images': 'heavy', 'fonts': 'per-chapter'},
+    'l2l3-large': {'pages': 1500, 'toc': 'l2l3', 'images': 'light', 'fonts': 'per-chapter'},
+}
+
+OPERATIONS = ('split_smart', 'split_by_pages', 'split_manually', 'save_ranges')
+PAGES_PER_CHUNK = 20    # split_by_pages chunk size
+MANUAL_RANGE_SIZE = 50  # split_manually range size
+
+# Modules that loading pdf-split-by-contents.py must not import
+STARTUP_HEAVY_MODULES = ('pymupdf', 'tkinter', 'urllib.request', 'http.client',
+                         'concurrent.futures.process')
+
+# Loads the script in a fresh interpreter and prints the heavy modules it imported
+STARTUP_PROBE = """
+import importlib.util, json, sys
+spec = importlib.util.spec_from_file_location("pdf_split_by_contents", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+sys.path.insert(0, sys.argv[2])
+spec.loader.exec_module(module)
+print(json.dumps([name for name in sys.argv[3:] if name in sys.modules]))
+"""
+
+# (pixel size, every n-th page) of incompressible noise images
+IMAGE_WEIGHTS = {
+    'none': None,
+    'light': (200, 10),
+    'heavy': (600, 1),
+}
+
+WORDS = ("pdf split chapter section page bookmark metadata isbn range chunk "
+         "document source output index table figure note").split()
+
+
+def load_splitter_module():
+    """Import pdf-split-by-contents.py (not importable by name because of the hyphens)."""
+    spec = importlib.util.spec_from_file_location("pdf_split_by_contents", SPLITTER_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    # Registered so chunk worker processes can unpickle its functions by name
+    sys.modules[spec.name] = module
+    sys.path.insert(0, str(SPLITTER_SCRIPT.parent))
+    spec.loader.exec_module(module)
+    return module
+
+
+def _toc_levels(shape, chapter_index, section_index):
+    """TOC entries (levels) to add at the start of a section for a TOC shape."""
+    if shape == 'l1':
+        return [1] if section_index == 0 else []
+    if shape == 'l2l3':
+        return [2, 3] if section_index == 0 else [3]
+    # deep: parts (L1) > chapters (L2) > sections (L3) > L4 > L5
+    levels = []
+    if section_index == 0:
+        if chapter_index % 4 == 0:
+            levels.append(1)
+        levels.append(2)
+    levels.append(3)
+    if section_index % 2 == 0:
+        levels += [4, 5]
+    return levels
+
+
+def make_book(path, pages, toc='l2l3', images='light', fonts='shared', seed=0):
+    """
+    Generate a reproducible synthetic book.
+
+    Args:
+        path: Output PDF path
+        pages: Number of pages
+        toc: TOC shape: 'l1' (chapters only), 'l2l3' (chapters and sections)
+             or 'deep' (five levels)
+        images: Image weight: 'none', 'light' or 'heavy' (see IMAGE_WEIGHTS)
+        fonts: 'shared' (one embedded font) or 'per-chapter' (a distinct
+               embedded font program per chapter, so nothing is reused)
+        seed: Random seed
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    font_buffer = fitz.Font("tiro").buffer
+    image_spec = IMAGE_WEIGHTS[images]
+
+    toc_entries = [[1, "Synthetic Book", 1]] if toc != 'l1' else []
+    front_matter = 4
+    chapter_index = -1
+    section_index = 0
+    section_left = 0
+    font_name = "F0"
+
+    for pno in range(pages):
+        page = doc.new_page()
+
+        if pno >= front_matter and section_left == 0:
+            section_left = rng.randint(2, 8)
+            if chapter_index < 0 or section_index >= rng.randint(3, 6):
+                chapter_index += 1
+                section_index = 0
+                if fonts == 'per-chapter':
+                    font_name = f"F{chapter_index}"
+            for level in _toc_levels(toc, chapter_index, section_index):
+                title = f"{chapter_index + 1}.{section_index + 1} " + " ".join(rng.sample(WORDS, 3))
+                if level <= 2 and section_index == 0:
+                    title = f"Chapter {chapter_index + 1} " + " ".join(rng.sample(WORDS, 2))
+                toc_entries.append([level, title, pno + 1])
+            section_index += 1
+        section_left = max(0, section_left - 1)
+
+        # Distinct trailing bytes give a distinct font program per chapter
+        suffix = bytes(int(font_name[1:]) + 1) if fonts == 'per-chapter' else b""
+        page.insert_font(fontname=font_name, fontbuffer=font_buffer + suffix)
+        text = "\n".join(" ".join(rng.choices(WORDS, k=12)) for _ in range(30))
+        page.insert_text((50, 60), text, fontname=font_name, fontsize=9)
+
+        if image_spec and pno % image_spec[1] == 0:
+            size = image_spec[0]
+            pix = fitz.Pixmap(fitz.csRGB, size, size, rng.randbytes(size * size * 3), False)
+            page.insert_image(fitz.Rect(50, 400, 250, 600), pixmap=pix)
+
+    doc.set_toc(toc_entries)
+    doc.save(path, garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+
+
+def scenario_book(work_dir, name, scale=1.0):
+    """Return the path of a scenario's book, generating it if it is not cached."""
+    params = dict(SCENARIOS[name])
+    params['pages'] = max(10, int(params['pages'] * scale))
+    path = Path(work_dir) / (f"{name}_p{params['pages']}_g{GENERATOR_VERSION}.pdf")
+    if not path.exists():
+        print(f"Generating {path.name} ...", flush=True)
+        tmp_path = path.with_suffix('.tmp')
+        make_book(tmp_path, **params)
+        os.replace(tmp_path, path)
+    return path, params
+
+
+def _measure(book_path, op, out_dir, splitter_options):
+    """
+    Run one operation in a fresh process and return its measurements.
+
+    Runs in a pool worker so peak RSS covers only this operation. Peak RSS
+    is measured as for the metrics output (common.peak_rss_bytes()), taking
+    the larger of this process and its --chunk-workers processes.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        # Spawned processes start their own pools with spawn, whose workers
+        # could not import the splitter module by name; fork as a real run does
+        multiprocessing.set_start_method('fork', force=True)
+    module = load_splitter_module()
+    from common import peak_rss_bytes
+    splitter = module.PdfSplitter(book_path, {}, **splitter_options)
+    page_count = splitter.page_count
+
+    if op == 'save_ranges':
+        # Planning happens outside the timed region
+        plan = splitter.plan_smart()
+        start = time.perf_counter()
+        files = splitter._save_ranges(plan, out_dir)
+    else:
+        start = time.perf_counter()
+        if op == 'split_smart':
+            files = splitter.split_smart(out_dir)
+        elif op == 'split_by_pages':
+            files = splitter.split_by_pages(PAGES_PER_CHUNK, out_dir)
+        else:
+            range_str = ", ".join(f"{s}-{min(s + MANUAL_RANGE_SIZE - 1, page_count)}"
+                                  for s in range(1, page_count + 1, MANUAL_RANGE_SIZE))
+            files = splitter.split_manually(range_str, out_dir)
+    seconds = time.perf_counter() - start
+    splitter.close()
+    peak = max(peak_rss_bytes() or 0, splitter.metrics.worker_peak_rss_bytes or 0) or None
+
+    return {
+        'seconds': seconds,
+        'peak_rss_bytes': peak,
+        'output_bytes': sum(f.stat().st_size for f in files or []),
+        'chunks': len(files or []),
+    }
+
+
+def measure_startup(repeat):
+    """Time `--help` in fresh interpreters and list heavy modules imported at load time."""
+    runs = []
+    for _ in range(max(repeat, 5)):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(SPLITTER_SCRIPT), "--help"],
+                       check=True, capture_output=True)
+        runs.append(time.perf_counter() - start)
+    probe = subprocess.run([sys.executable, "-c", STARTUP_PROBE, str(SPLITTER_SCRIPT),
+                            str(SPLITTER_SCRIPT.parent), *STARTUP_HEAVY_MODULES],
+                           check=True, capture_output=True, text=True)
+    heavy = json.loads(probe.stdout)
+
+    record = {
+        'scenario': 'startup',
+        'op': '--help',
+        'pages': 0,
+        'seconds': statistics.median(runs),
+        'runs': runs,
+        'heavy_imports': heavy,
+    }
+    print(f"{'startup':<14} {'--help':<15} {record['seconds']:8.3f}s  "
+          f"heavy imports: {', '.join(heavy) or 'none'}", flush=True)
+    return record
+
+
+def measure_metadata(isbns, latency, workers):
+    """
+    Resolve synthetic ISBNs through a local Google Books stub, once over
+    kept-alive connections and once reconnecting per request.
+    """
+    sys.path.insert(0, str(SPLITTER_SCRIPT.parent))
+    import google_books_stub
+    from common import GoogleBooksClient, MetadataPrefetcher
+
+    # A fixed random jitter of half the base latency gives the tail something to show
+    config = google_books_stub.StubConfig(latency=latency, jitter=latency / 2, seed=0)
+    server, url = google_books_stub.start_in_thread(config)
+    records = []
+    try:
+        for op, keep_alive in (('keep-alive', True), ('reconnect', False)):
+            client = GoogleBooksClient(url, keep_alive=keep_alive)
+            prefetcher = MetadataPrefetcher(None, max_workers=workers, rate=0, retries=0,
+                                            client=client)
+            batch = [f"978{op == 'reconnect':d}{i:09d}" for i in range(isbns)]
+            start = time.perf_counter()
+            for isbn in batch:
+                prefetcher.submit(isbn)
+            found = sum(1 for isbn in batch if prefetcher.get(isbn))
+            seconds = time.perf_counter() - start
+            stats = client.stats()
+            prefetcher.shutdown()
+
+            record = {
+                'scenario': 'metadata',
+                'op': op,
+                'pages': 0,
+                'isbns': isbns,
+                'found': found,
+                'seconds': seconds,
+                'requests': stats['requests'],
+                'errors': stats['errors'],
+                'requests_per_sec': isbns / seconds if seconds else None,
+                'p50_ms': stats['p50_ms'],
+                'p95_ms': stats['p95_ms'],
+                'p99_ms': stats['p99_ms'],
+            }
+            records.append(record)
+            print(f"{'metadata':<14} {op:<15} {seconds:8.3f}s  "
+                  f"{record['requests_per_sec']:9.1f} req/s  "
+                  f"p50 {record['p50_ms']:.1f} ms  p95 {record['p95_ms']:.1f} ms  "
+                  f"p99 {record['p99_ms']:.1f} ms  ({found}/{isbns} found)", flush=True)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return records
+
+
+def run_benchmarks(scenarios, work_dir, repeat, splitter_options, scale=1.0):
+    """Run every operation on every scenario and return the result records."""
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    for name in scenarios:
+        book_path, params = scenario_book(work_dir, name, scale)
+        source_bytes = book_path.stat().st_size
+        for op in OPERATIONS:
+            runs = []
+            for _ in range(repeat):
+                out_dir = Path(tempfile.mkdtemp(prefix="out_", dir=work_dir))
+                try:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+                        runs.append(executor.submit(_measure, str(book_path), op, str(out_dir),
+                                                    splitter_options).result())
+                finally:
+                    shutil.rmtree(out_dir, ignore_errors=True)
+
+            seconds = statistics.median(r['seconds'] for r in runs)
+            peaks = [r['peak_rss_bytes'] for r in runs if r['peak_rss_bytes']]
+            record = {
+                'scenario': name,
+                'op': op,
+                'pages': params['pages'],
+                'source_bytes': source_bytes,
+                'seconds': seconds,
+                'runs': [r['seconds'] for r in runs],
+                'pages_per_sec': params['pages'] / seconds if seconds else None,
+                'mb_per_sec': source_bytes / 1024 / 1024 / seconds if seconds else None,
+                'peak_rss_mb': max(peaks) / 1024 / 1024 if peaks else None,
+                'output_bytes': runs[0]['output_bytes'],
+                'amplification': runs[0]['output_bytes'] / source_bytes,
+                'chunks': runs[0]['chunks'],
+            }
+            results.append(record)
+            print(f"{name:<14} {op:<15} {seconds:8.3f}s  {record['pages_per_sec']:9.1f} pages/s  "
+                  f"{record['mb_per_sec']:7.2f} MB/s  "
+                  f"RSS {record['peak_rss_mb'] or 0:7.1f} MB  "
+                  f"amp {record['amplification']:5.2f}x  ({record['chunks']} chunks)", flush=True)
+    return results
+
+
+def compare(results, baseline, max_regression=None):
+    """
+    Print per-case deltas against a baseline.
+
+    Returns False if any case got slower by more than max_regression percent,
+    or if loading the script imports a heavy module the baseline did not.
+    """
+    base = {(r['scenario'], r['op']): r for r in baseline.get('results', [])}
+    ok = True
+    print(f"\n{'scenario':<14} {'op':<15} {'time':>9} {'peak RSS':>9} {'amplif.':>9} {'p99':>9}")
+    for r in results:
+        b = base.get((r['scenario'], r['op']))
+        if b is None or b['pages'] != r['pages']:
+            print(f"{r['scenario']:<14} {r['op']:<15} (no comparable baseline)")
+            continue
+
+        def delta(key):
+            if not r.get(key) or not b.get(key):
+                return None
+            return (r[key] - b[key]) / b[key] * 100
+
+        time_delta = delta('seconds')
+        cells = [f"{d:+8.1f}%" if d is not None else f"{'n/a':>9}"
+                 for d in (time_delta, delta('peak_rss_mb'), delta('amplification'),
+                           delta('p99_ms'))]
+        flag = ""
+        if max_regression is not None and time_delta is not None and time_delta > max_regression:
+            flag = "  REGRESSION"
+            ok = False
+        new_imports = set(r.get('heavy_imports', ())) - set(b.get('heavy_imports', ()))
+        if new_imports:
+            flag += f"  EAGER IMPORT: {', '.join(sorted(new_imports))}"
+            ok = False
+        print(f"{r['scenario']:<14} {r['op']:<15} {' '.join(cells)}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark PdfSplitter on reproducible synthetic books.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Scenarios:\n" + "\n".join(f"  {name:<14} {params}"
+                                           for name, params in SCENARIOS.items())
+    )
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable; default: all)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiply every scenario's page count (default: 1.0)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per case; the median time is reported (default: 3)")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "pdf-split-bench"),
+                        help="Directory for generated books and temporary output")
+    parser.add_argument("-o", "--output", default=RESULTS_FILE,
+                        help=f"Results file (default: {RESULTS_FILE})")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--max-regression", type=float,
+                        help="With --baseline: exit with status 1 if any case is slower "
+                             "by more than this many percent")
+    parser.add_argument("--optimize", default="none",
+                        help="PdfSplitter output optimization profile (default: none)")
+    parser.add_argument("--chunk-workers", type=int, default=1,
+                        help="PdfSplitter chunk-writing processes (default: 1)")
+    parser.add_argument("--metadata-isbns", type=int, default=200,
+                        help="ISBNs resolved through the local Google Books stub "
+                             "(default: 200; 0 skips the metadata lookups)")
+    parser.add_argument("--metadata-latency", type=float, default=20,
+                        help="Stub response latency in milliseconds (default: 20)")
+    parser.add_argument("--metadata-workers", type=int, default=4,
+                        help="Concurrent metadata lookups (default: 4)")
+    args = parser.parse_args()
+
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    scenarios = args.scenario or list(SCENARIOS)
+    splitter_options = {'optimize': args.optimize, 'workers': args.chunk_workers}
+
+    results = [measure_startup(args.repeat)]
+    if args.metadata_isbns > 0:
+        results += measure_metadata(args.metadata_isbns, args.metadata_latency,
+                                    args.metadata_workers)
+    results += run_benchmarks(scenarios, work_dir, args.repeat, splitter_options, args.scale)
+
+    report = {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'pymupdf': fitz.VersionBind,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'options': dict(splitter_options, scale=args.scale, repeat=args.repeat),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
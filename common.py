@@ -1,19 +1,61 @@
+import io
 import os
 import sys
 import re
 import logging
+import math
 import time
 import datetime
-import urllib.request
-import urllib.error
+import importlib.util
 import json
+import hashlib
+import random
+import sqlite3
+import threading
+import tarfile
+import fnmatch
+import zipfile
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
 
 # Configuration
 INPUT_DIR = "input_pdf"
 OUTPUT_DIR = "split_pdf"
 LOG_FILE = "pdf-split.log"
 LARGE_FILE_THRESHOLD = 45 * 1024 * 1024  # 45MB
-GOOGLE_BOOKS_API_URL = "https://www.googleapis.com/books/v1/volumes?q=isbn:{isbn}"
+# Volumes query URL template; override (e.g. with google_books_stub.py) via the
+# environment or --metadata-url
+GOOGLE_BOOKS_API_URL = os.environ.get(
+    "GOOGLE_BOOKS_API_URL", "https://www.googleapis.com/books/v1/volumes?q=isbn:{isbn}")
+MANIFEST_FILE = "manifest.json"  # Written in each book's output directory
+PAGE_INDEX_FILE = "page_index.json"  # Page-to-chunk lookup, next to the manifest
+PLAN_CACHE_DIR = ".plan_cache"   # Range plans keyed by source hash, under the output directory
+ARCHIVE_FORMATS = ('zip', 'tar')
+ARCHIVE_INDEX = "index.json"     # First member of every output archive
+METADATA_CACHE_FILE = ".metadata_cache.sqlite3"  # Created under the output directory
+METADATA_CACHE_TTL = 30 * 24 * 3600           # 30 days
+METADATA_NEGATIVE_CACHE_TTL = 7 * 24 * 3600   # "No book found" results: 7 days
+
+
+def lazy_import(name):
+    """
+    Return module `name`, deferring its actual import until first attribute access.
+
+    Keeps heavy dependencies such as PyMuPDF off the startup path of runs
+    that never use them (--help, --refresh-metadata, small files).
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
 
 
 def setup_logging(background_mode, log_file=LOG_FILE):
@@ -29,22 +71,747 @@ def setup_logging(background_mode, log_file=LOG_FILE):
     )
 
 
-def estimate_time(start_wall_time, processed_count, total_count):
-    """Log estimated completion time."""
+class _BufferingHandler(logging.Handler):
+    """Collect log records in memory so a worker can hand them to the parent."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # Freeze the message so the record survives pickling; records replayed
+        # from a nested pool's worker are frozen already and keep its name
+        if not getattr(record, 'buffered', False):
+            record.msg = f"[{record.processName}] {record.getMessage()}"
+            record.args = None
+            record.exc_info = None
+            record.exc_text = None
+            record.buffered = True
+        self.records.append(record)
+
+
+_worker_log_handler = None
+
+
+def init_worker_logging():
+    """
+    Pool initializer: replace inherited handlers with an in-memory buffer.
+
+    Workers never write to the log file or stdout directly; their records are
+    returned with the result and replayed by the parent in one block per book.
+    Pools started inside a worker (chunk, image and text workers) use this
+    initializer too and return their records to that worker, which replays
+    them into its own buffer, so they reach the main process as well.
+    """
+    global _worker_log_handler
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    _worker_log_handler = _BufferingHandler()
+    root.addHandler(_worker_log_handler)
+    root.setLevel(logging.INFO)
+
+
+def start_worker_log_capture():
+    """Discard any records left over from a previous task."""
+    if _worker_log_handler is not None:
+        _worker_log_handler.records = []
+
+
+def finish_worker_log_capture():
+    """Return the records captured since start_worker_log_capture()."""
+    if _worker_log_handler is None:
+        return []
+    records = _worker_log_handler.records
+    _worker_log_handler.records = []
+    return records
+
+
+def replay_log_records(records):
+    """Emit log records captured in a worker through the parent's handlers."""
+    root = logging.getLogger()
+    for record in records:
+        root.handle(record)
+
+
+def estimate_time(start_wall_time, processed_bytes, total_bytes, processed_count, total_count,
+                  workers=1):
+    """
+    Log progress and estimated completion time.
+
+    The estimate is weighted by size: remaining input bytes divided by the
+    observed throughput (bytes per wall-clock second, for the whole pool when
+    workers > 1), so a 900 MB book is not counted like a 46 MB one. Callers
+    leave books that took no work (already split, below the threshold) out
+    of both byte counts.
+    """
     if processed_count == 0:
         return
 
     elapsed = time.time() - start_wall_time
-    avg_per_item = elapsed / processed_count
-    remaining = total_count - processed_count
-    est_seconds = remaining * avg_per_item
+    remaining_bytes = max(0, total_bytes - processed_bytes)
+    throughput = processed_bytes / elapsed if elapsed > 0 else 0
+    if throughput > 0:
+        est_seconds = remaining_bytes / throughput
+    else:
+        est_seconds = elapsed / processed_count * (total_count - processed_count)
 
     est_finish = datetime.datetime.now() + datetime.timedelta(seconds=est_seconds)
-    logging.info(f"Progress: {processed_count}/{total_count}. "
-                 f"Avg: {avg_per_item:.1f}s/item. "
+    rate_label = f"Throughput: {throughput / 1024 / 1024:.2f} MB/s"
+    if workers > 1:
+        rate_label += f" ({workers} workers)"
+    logging.info(f"Progress: {processed_count}/{total_count} "
+                 f"({processed_bytes / 1024 / 1024:.1f}/{total_bytes / 1024 / 1024:.1f} MB). "
+                 f"{rate_label}. "
                  f"Est. Finish: {est_finish.strftime('%Y-%m-%d %H:%M:%S')}")
 
 
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process in bytes since the last
+    reset_peak_rss() (the process lifetime peak where that is not supported),
+    or None if unavailable.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    """
+    Restart this process's peak_rss_bytes() from its current RSS (Linux), so
+    a long-lived process can measure one book at a time. Returns False if the
+    peak cannot be reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def current_rss_bytes():
+    """Current resident set size of this process in bytes (Linux /proc), or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class BookMetrics:
+    """
+    Per-book stage timings, byte counts and per-chunk stats.
+
+    Created by the parent for each input PDF; when the book is split in a
+    pool worker the object is pickled there and back, so all stages end up
+    in one record. peak_rss_bytes is the peak of the process that split the
+    book, measured from the start of the book where the platform allows
+    (see reset_peak_rss()); worker_peak_rss_bytes is the largest peak of the
+    book's chunk, image and text worker processes.
+    """
+
+    def __init__(self, name, bytes_in=0):
+        self.name = name
+        self.bytes_in = bytes_in
+        self.status = None
+        self.pages = None
+        self.stages = {}
+        self.chunks = []
+        self.peak_rss_bytes = None
+        self.worker_peak_rss_bytes = None
+
+    @contextmanager
+    def stage(self, name):
+        """Add the wall-clock time of the with-block to stage `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_chunk(self, name, pages, size, insert_seconds, save_seconds):
+        """Record one written chunk; its insert/save times also go to the stage totals."""
+        self.chunks.append({'file': name, 'pages': pages, 'bytes': size,
+                            'insert_seconds': round(insert_seconds, 6),
+                            'save_seconds': round(save_seconds, 6)})
+        self.add_stage('insert', insert_seconds)
+        self.add_stage('save', save_seconds)
+
+    def add_worker_peak(self, peak):
+        """Record the peak RSS reported by one of the book's worker processes."""
+        if peak is not None:
+            self.worker_peak_rss_bytes = max(self.worker_peak_rss_bytes or 0, peak)
+
+    @property
+    def bytes_out(self):
+        return sum(chunk['bytes'] for chunk in self.chunks)
+
+    def summary(self):
+        """One-line stage breakdown for the log."""
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stages.items())
+
+    def to_dict(self):
+        return {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'file': self.name,
+            'status': self.status,
+            'pages': self.pages,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'chunk_count': len(self.chunks),
+            'seconds': round(sum(self.stages.values()), 6),
+            'stages': {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'worker_peak_rss_bytes': self.worker_peak_rss_bytes,
+            'chunks': self.chunks,
+        }
+
+
+class MetricsWriter:
+    """
+    Emit BookMetrics as JSON lines and, optionally, a Prometheus textfile.
+
+    JSON lines are appended (one object per book) and flushed immediately.
+    The Prometheus file holds run totals in the text exposition format and is
+    rewritten atomically after every book, for node_exporter's textfile
+    collector.
+    """
+
+    def __init__(self, jsonl_path=None, prometheus_path=None):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.started = time.time()
+        self.books = {}
+        self.totals = {'bytes_in': 0, 'bytes_out': 0, 'chunks': 0, 'pages': 0}
+        self.stages = {}
+        self.peak_rss_bytes = 0
+        self._file = open(jsonl_path, 'a', encoding='utf-8') if jsonl_path else None
+
+    def record(self, metrics):
+        """Write one book's metrics and add them to the run totals."""
+        data = metrics.to_dict()
+        if self._file is not None:
+            self._file.write(json.dumps(data, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+        self.books[metrics.status] = self.books.get(metrics.status, 0) + 1
+        self.totals['bytes_in'] += metrics.bytes_in
+        self.totals['bytes_out'] += metrics.bytes_out
+        self.totals['chunks'] += len(metrics.chunks)
+        self.totals['pages'] += metrics.pages or 0
+        for name, seconds in metrics.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.peak_rss_bytes = max(self.peak_rss_bytes, metrics.peak_rss_bytes or 0,
+                                  metrics.worker_peak_rss_bytes or 0)
+        self._write_prometheus()
+
+    def _write_prometheus(self):
+        if not self.prometheus_path:
+            return
+        lines = [
+            "# HELP pdf_split_books_total Books processed, by outcome.",
+            "# TYPE pdf_split_books_total counter",
+        ]
+        lines += [f'pdf_split_books_total{{status="{status}"}} {count}'
+                  for status, count in sorted(self.books.items(), key=lambda kv: str(kv[0]))]
+        for key, help_text in (('bytes_in', "Input PDF bytes processed."),
+                               ('bytes_out', "Chunk PDF bytes written."),
+                               ('chunks', "Chunk PDFs written."),
+                               ('pages', "Pages in processed books.")):
+            lines += [f"# HELP pdf_split_{key}_total {help_text}",
+                      f"# TYPE pdf_split_{key}_total counter",
+                      f"pdf_split_{key}_total {self.totals[key]}"]
+        lines += ["# HELP pdf_split_stage_seconds_total Time spent per processing stage.",
+                  "# TYPE pdf_split_stage_seconds_total counter"]
+        lines += [f'pdf_split_stage_seconds_total{{stage="{name}"}} {seconds:.6f}'
+                  for name, seconds in self.stages.items()]
+        lines += ["# HELP pdf_split_peak_rss_bytes Largest peak RSS of a splitting process.",
+                  "# TYPE pdf_split_peak_rss_bytes gauge",
+                  f"pdf_split_peak_rss_bytes {self.peak_rss_bytes}",
+                  "# HELP pdf_split_run_seconds Wall-clock time since the run started.",
+                  "# TYPE pdf_split_run_seconds gauge",
+                  f"pdf_split_run_seconds {time.time() - self.started:.3f}",
+                  "# HELP pdf_split_last_update_timestamp_seconds Time of the last update.",
+                  "# TYPE pdf_split_last_update_timestamp_seconds gauge",
+                  f"pdf_split_last_update_timestamp_seconds {time.time():.3f}"]
+
+        path = str(self.prometheus_path)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    def close(self):
+        self._write_prometheus()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def parse_size(text):
+    """
+    Parse a byte size such as '45MB', '500KB', '1.5GB' or '1048576'.
+
+    Units are binary (1KB = 1024 bytes), matching LARGE_FILE_THRESHOLD.
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)I?B?\s*', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {text}")
+    number, unit = match.groups()
+    power = ' KMGT'.index(unit.upper() or ' ')
+    return int(float(number) * 1024 ** power)
+
+
+def parse_since(text):
+    """
+    Parse a point in time: an ISO date or datetime such as '2024-04-01' or
+    '2024-04-01T09:00', or an age such as '7d', '12h' or '30m' (that long ago).
+
+    Returns a POSIX timestamp.
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([DHM])\s*', str(text), re.IGNORECASE)
+    if match:
+        number, unit = match.groups()
+        return time.time() - float(number) * {'D': 86400, 'H': 3600, 'M': 60}[unit.upper()]
+    try:
+        return datetime.datetime.fromisoformat(str(text).strip()).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time: {text}") from None
+
+
+def _temp_file_for(path):
+    """
+    Create a uniquely named temp file next to path ("<name>.<random>.tmp").
+
+    Unlike a fixed "<name>.tmp", concurrent writers of the same path (workers
+    planning identical books) never share a temp file. The file is created
+    with mode 0666, so the process umask applies as for a plain open()
+    (mkstemp() would create it 0600). Returns (fd, temp path).
+    """
+    while True:
+        tmp_path = f"{path}.{os.urandom(6).hex()}.tmp"
+        try:
+            return os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), tmp_path
+        except FileExistsError:
+            continue
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file and rename it over path, so readers never see a partial file."""
+    fd, tmp_path = _temp_file_for(path)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_text_atomic(path, text):
+    """Write UTF-8 text to a temp file and rename it over path."""
+    fd, tmp_path = _temp_file_for(path)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_json(path):
+    """Load a JSON file, returning None if it is missing or unreadable."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ArchiveWriter:
+    """
+    Stream members into a single zip (stored, no compression) or tar archive.
+
+    The archive is written to a temp file and renamed into place by close(),
+    so readers never see a partial archive. Call abort() on failure.
+    """
+
+    def __init__(self, path, fmt):
+        if fmt not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format: {fmt}")
+        self.path = str(path)
+        self.tmp_path = self.path + '.tmp'
+        self.fmt = fmt
+        self.mtime = time.time()
+        if fmt == 'zip':
+            # PDF content is already compressed; storing avoids recompressing it
+            self._archive = zipfile.ZipFile(self.tmp_path, 'w', zipfile.ZIP_STORED)
+        else:
+            self._archive = tarfile.open(self.tmp_path, 'w', format=tarfile.PAX_FORMAT)
+
+    def add(self, name, data):
+        """Append a member with the given bytes."""
+        if self.fmt == 'zip':
+            info = zipfile.ZipInfo(name, time.localtime(self.mtime)[:6])
+            self._archive.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = self.mtime
+            self._archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self._archive.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Discard the partially written archive."""
+        self._archive.close()
+        os.remove(self.tmp_path)
+
+
+def iter_archive_members(path):
+    """Yield (name, bytes) for each member of a zip or tar archive, in order."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                yield info.filename, archive.read(info)
+    else:
+        with tarfile.open(path) as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, archive.extractfile(member).read()
+
+
+class FolderWatcher:
+    """
+    Report files arriving in a directory once they are complete.
+
+    New files are noticed through inotify when the optional inotify_simple
+    package is available (and polling is not forced), otherwise by rescanning
+    the directory every poll_interval seconds. A file is reported once its
+    size and mtime have not changed for settle_time seconds, so files still
+    being copied in are not picked up; with inotify, a file whose creation
+    was seen must also have been closed or moved in. Files present at startup
+    are reported too; each path is reported once until forget() is called.
+
+    inotify does not see writes made by other hosts on network filesystems;
+    use polling there.
+    """
+
+    def __init__(self, directory, suffix='.pdf', settle_time=5.0, poll_interval=2.0,
+                 polling=False):
+        self.directory = Path(directory)
+        self.suffix = suffix.lower()
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self._pending = {}  # path -> ((size, mtime_ns), unchanged since) or None if not yet seen
+        self._reported = set()
+        self._writing = set()  # Created (inotify) but not yet closed
+        self._inotify = None
+        if not polling:
+            self._start_inotify()
+        self._scan()
+
+    def _start_inotify(self):
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:  # Optional (Linux only); fall back to polling
+            return
+        self._flags = flags
+        try:
+            self._inotify = INotify()
+            self._inotify.add_watch(str(self.directory),
+                                    flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+        except OSError as e:
+            logging.warning(f"inotify unavailable ({e}); falling back to polling")
+            self._inotify = None
+
+    @property
+    def mode(self):
+        return 'inotify' if self._inotify is not None else 'polling'
+
+    def _scan(self):
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.lower().endswith(self.suffix):
+                self._track(Path(entry.path))
+
+    def _track(self, path):
+        if path not in self._reported and path not in self._pending:
+            self._pending[path] = None
+
+    def forget(self, path):
+        """Let path be reported again (call after moving a processed file away)."""
+        self._reported.discard(Path(path))
+
+    def poll(self):
+        """Wait up to poll_interval for new files and return those that have settled."""
+        if self._inotify is not None:
+            for event in self._inotify.read(timeout=int(self.poll_interval * 1000)):
+                if event.name.lower().endswith(self.suffix):
+                    path = self.directory / event.name
+                    if event.mask & self._flags.CREATE:
+                        self._writing.add(path)
+                    else:
+                        self._writing.discard(path)
+                    self._track(path)
+            if self._pending:
+                # Events return early; re-check sizes at most every second
+                time.sleep(min(1.0, self.poll_interval))
+        else:
+            time.sleep(self.poll_interval)
+            self._scan()
+        return self._settled()
+
+    def _settled(self):
+        now = time.monotonic()
+        ready = []
+        for path, seen in list(self._pending.items()):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                del self._pending[path]
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            if seen is None or seen[0] != key or path in self._writing:
+                self._pending[path] = (key, now)
+            elif now - seen[1] >= self.settle_time:
+                del self._pending[path]
+                self._reported.add(path)
+                ready.append(path)
+        return sorted(ready)
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+class FileFilter:
+    """
+    Select input files by glob and by size and modification time.
+
+    Patterns containing '/' are matched against the path relative to the
+    scanned directory (or as listed), others against the file name only;
+    '*' also matches '/'. A file must match one of `include` (if any) and
+    none of `exclude`. An `exclude` pattern matching a directory prunes it
+    from the scan. Sizes are in bytes, modified_since a POSIX timestamp.
+    """
+
+    def __init__(self, include=(), exclude=(), min_size=None, max_size=None,
+                 modified_since=None):
+        self.include = list(include or ())
+        self.exclude = list(exclude or ())
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_since = modified_since
+
+    @staticmethod
+    def _matches(rel_path, patterns):
+        name = rel_path.rsplit('/', 1)[-1]
+        return any(fnmatch.fnmatchcase(rel_path if '/' in pattern else name, pattern)
+                   for pattern in patterns)
+
+    def match_dir(self, rel_path):
+        return not self._matches(rel_path, self.exclude)
+
+    def match_name(self, rel_path):
+        if self.include and not self._matches(rel_path, self.include):
+            return False
+        return not self._matches(rel_path, self.exclude)
+
+    def match_stat(self, stat):
+        if self.min_size is not None and stat.st_size < self.min_size:
+            return False
+        if self.max_size is not None and stat.st_size > self.max_size:
+            return False
+        return self.modified_since is None or stat.st_mtime >= self.modified_since
+
+
+def scan_files(root, file_filter=None, suffix='.pdf', recursive=False, skip_dirs=()):
+    """
+    Find files under root in a single os.scandir walk.
+
+    Names are checked (suffix, case-insensitive, and globs) before a file is
+    stat'ed, so excluded files cost nothing beyond their directory entry.
+    Hidden files and directories, directory symlinks and skip_dirs are not
+    entered.
+
+    Yields:
+        (Path, size in bytes) of every matching file, in directory order
+    """
+    file_filter = file_filter or FileFilter()
+    suffix = suffix.lower()
+    skip = {os.path.realpath(d) for d in skip_dirs}
+    stack = [(str(root), '')]
+    while stack:
+        directory, rel_dir = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError as e:
+            logging.warning(f"Cannot scan {directory}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if (recursive and file_filter.match_dir(rel_path)
+                                and os.path.realpath(entry.path) not in skip):
+                            stack.append((entry.path, rel_path))
+                        continue
+                    if not (entry.name.lower().endswith(suffix)
+                            and file_filter.match_name(rel_path) and entry.is_file()):
+                        continue
+                    stat = entry.stat()
+                except OSError as e:  # Vanished or unreadable while scanning
+                    logging.warning(f"Cannot read {entry.path}: {e}")
+                    continue
+                if file_filter.match_stat(stat):
+                    yield Path(entry.path), stat.st_size
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    """Return the hex SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BackgroundHasher:
+    """
+    SHA-256 files or byte strings in a background thread.
+
+    hashlib releases the GIL while it hashes, so on a multi-core host the
+    hashing overlaps with whatever the caller does next (such as writing the
+    next file) instead of adding to it.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hasher')
+        self._futures = {}
+
+    def add(self, key, path=None, data=None):
+        """Queue the file at path, or data (bytes), to be hashed under key."""
+        if data is not None:
+            self._futures[key] = self._executor.submit(
+                lambda: hashlib.sha256(data).hexdigest())
+        else:
+            self._futures[key] = self._executor.submit(sha256_file, path)
+
+    def results(self):
+        """Wait for every queued hash and return dict key -> hex digest."""
+        try:
+            return {key: future.result() for key, future in self._futures.items()}
+        finally:
+            self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _partial_hash(path, block_size=64 * 1024):
+    """SHA-256 of a file's first and last block_size bytes (a cheap prefilter)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        digest.update(f.read(block_size))
+        size = os.fstat(f.fileno()).st_size
+        if size > block_size:
+            f.seek(max(block_size, size - block_size))
+            digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+def find_duplicate_files(paths, sizes=None):
+    """
+    Find files with identical content.
+
+    Files are grouped by size, then by a hash of their first and last 64 KB;
+    only files still colliding are hashed in full, so unique files are
+    usually never read.
+
+    Args:
+        paths: Files to compare
+        sizes: Optional dict path -> size in bytes, to save stat() calls
+
+    Returns:
+        dict: duplicate path -> the earlier path (in `paths` order) it duplicates
+    """
+    by_size = {}
+    for path in paths:
+        size = sizes[path] if sizes is not None else os.path.getsize(path)
+        by_size.setdefault(size, []).append(path)
+
+    duplicates = {}
+    for same_size in by_size.values():
+        if len(same_size) < 2:
+            continue
+        by_partial = {}
+        for path in same_size:
+            by_partial.setdefault(_partial_hash(path), []).append(path)
+        for candidates in by_partial.values():
+            if len(candidates) < 2:
+                continue
+            first_by_hash = {}
+            for path in candidates:
+                digest = sha256_file(path)
+                if digest in first_by_hash:
+                    duplicates[path] = first_by_hash[digest]
+                else:
+                    first_by_hash[digest] = path
+    return duplicates
+
+
+def hardlink_replace(source, target):
+    """Replace target with a hard link to source (atomically, via a unique temp name)."""
+    # Reserve a unique name, then put the link in its place
+    fd, tmp_path = _temp_file_for(target)
+    os.close(fd)
+    os.remove(tmp_path)
+    os.link(source, tmp_path)
+    try:
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+# Rough token count for Japanese and English text: every run of ASCII letters
+# and digits is one token, and so is every other non-space character (kana,
+# kanji, punctuation), which is close to what subword tokenizers produce.
+TOKEN_PATTERN = re.compile(r'[A-Za-z0-9]+|[^\sA-Za-z0-9]')
+
+
+def count_tokens(text):
+    """Approximate number of tokens in text (see TOKEN_PATTERN)."""
+    return len(TOKEN_PATTERN.findall(text))
+
+
 def clean_filename(name):
     """Sanitize filename."""
     return re.sub(r'[\\/*?:"<>|]', "", name)
@@ -91,33 +858,329 @@ def extract_isbn_from_filename(filename):
     return isbn
 
 
-def fetch_metadata_from_google_books(isbn):
+class MetadataCache:
     """
-    Fetch book metadata from Google Books API.
+    Persistent ISBN-keyed cache of Google Books metadata (SQLite).
+
+    Empty results ("No book found") are cached too, with a shorter TTL.
+    Request failures are never cached. Safe to share between processes;
+    each process must open its own instance.
+    """
+
+    def __init__(self, path, ttl=METADATA_CACHE_TTL, negative_ttl=METADATA_NEGATIVE_CACHE_TTL):
+        self.path = str(path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "isbn TEXT PRIMARY KEY, data TEXT NOT NULL, fetched_at REAL NOT NULL)"
+            )
+
+    def get(self, isbn, allow_stale=False):
+        """
+        Look up cached metadata.
+
+        Returns:
+            tuple: (hit, metadata). metadata is {} for a cached negative result.
+            Expired entries count as misses unless allow_stale is True.
+        """
+        row = self.conn.execute(
+            "SELECT data, fetched_at FROM metadata WHERE isbn = ?", (isbn,)
+        ).fetchone()
+        if row is not None:
+            metadata = json.loads(row[0])
+            ttl = self.ttl if metadata else self.negative_ttl
+            if allow_stale or time.time() - row[1] < ttl:
+                self.hits += 1
+                return True, metadata
+        self.misses += 1
+        return False, None
+
+    def put(self, isbn, metadata):
+        """Store metadata ({} for "No book found")."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO metadata (isbn, data, fetched_at) VALUES (?, ?, ?)",
+                (isbn, json.dumps(metadata, ensure_ascii=False), time.time())
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Rank ceil(pct% of n), 1-based; multiplied first so 7 * 100 / 100 stays exact
+    rank = math.ceil(pct * len(ordered) / 100)
+    return ordered[max(0, min(len(ordered) - 1, rank - 1))]
+
+
+class HTTPStatusError(OSError):
+    """A request that completed with an HTTP status other than 200."""
+
+    def __init__(self, status, reason=''):
+        super().__init__(f"HTTP {status} {reason}".rstrip())
+        self.status = status
+
+    @property
+    def transient(self):
+        """True for statuses worth retrying: rate limiting and server errors."""
+        return self.status == 429 or self.status >= 500
+
+
+class GoogleBooksClient:
+    """
+    Google Books volumes API client with persistent connections.
+
+    Every thread keeps one HTTP/1.1 connection to the API host and reuses it
+    for all its requests, so resolving many ISBNs does not pay for a TCP and
+    TLS handshake each time; a connection the server has closed is reopened
+    once transparently. api_url is a URL template with an {isbn} placeholder
+    (see GOOGLE_BOOKS_API_URL). Request latencies and failures are recorded
+    for stats().
+
+    Like urllib, connections go through the proxy configured in the
+    environment (http_proxy / https_proxy, honoring no_proxy): HTTPS requests
+    through a CONNECT tunnel, plain HTTP requests with absolute URLs.
+
+    With keep_alive=False every request uses a new connection (for comparison
+    in benchmarks).
+    """
+
+    def __init__(self, api_url=None, timeout=10, keep_alive=True):
+        from urllib.parse import urlsplit
+        self.api_url = api_url or GOOGLE_BOOKS_API_URL
+        parts = urlsplit(self.api_url)
+        if parts.scheme not in ('http', 'https') or not parts.netloc:
+            raise ValueError(f"Unsupported metadata URL: {self.api_url}")
+        if '{isbn}' not in self.api_url:
+            raise ValueError(f"Metadata URL has no {{isbn}} placeholder: {self.api_url}")
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.hostname = parts.hostname
+        self.port = parts.port
+        self.path_template = parts.path + (f"?{parts.query}" if parts.query else "")
+        self._proxy = None   # (host, headers) once looked up, see _proxy_settings()
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self.latencies = []   # seconds, one per request
+        self.errors = 0
+        self._first_start = None
+        self._last_end = None
+
+    def _proxy_settings(self):
+        """
+        The proxy for the API host as (proxy host[:port], headers), with a
+        Proxy-Authorization header if the proxy URL has credentials, or
+        (None, {}) without a proxy. Looked up once, as urllib does.
+        """
+        if self._proxy is None:
+            # Imported here: urllib.request is slow to load
+            import base64
+            from urllib.parse import urlsplit, unquote
+            from urllib.request import getproxies, proxy_bypass
+            proxy_url = getproxies().get(self.scheme)
+            if not proxy_url or proxy_bypass(self.hostname):
+                self._proxy = (None, {})
+            else:
+                if '://' not in proxy_url:
+                    proxy_url = f"http://{proxy_url}"
+                proxy = urlsplit(proxy_url)
+                headers = {}
+                if proxy.username is not None:
+                    credentials = f"{unquote(proxy.username)}:{unquote(proxy.password or '')}"
+                    headers['Proxy-Authorization'] = \
+                        f"Basic {base64.b64encode(credentials.encode()).decode('ascii')}"
+                host = proxy.hostname + (f":{proxy.port}" if proxy.port else "")
+                self._proxy = (host, headers)
+        return self._proxy
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Imported here: http.client (and ssl) is slow to load
+            import http.client
+            cls = (http.client.HTTPSConnection if self.scheme == 'https'
+                   else http.client.HTTPConnection)
+            proxy_host, proxy_headers = self._proxy_settings()
+            if proxy_host is None:
+                connection = cls(self.host, timeout=self.timeout)
+            else:
+                connection = cls(proxy_host, timeout=self.timeout)
+                if self.scheme == 'https':
+                    connection.set_tunnel(self.hostname, self.port, headers=proxy_headers)
+            self._local.connection = connection
+            self._local.used = False
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+            with self._lock:
+                self._connections.remove(connection)
+
+    def request(self, isbn):
+        """
+        Run the volumes query for an ISBN and return the decoded JSON.
+
+        Raises OSError (including HTTP error statuses), http.client.HTTPException
+        or ValueError (invalid JSON).
+        """
+        import http.client
+        path = self.path_template.format(isbn=isbn)
+        headers = {'Accept': 'application/json'}
+        proxy_host, proxy_headers = self._proxy_settings()
+        if proxy_host is not None and self.scheme == 'http':
+            # Plain HTTP through a proxy: absolute URL, credentials on every request
+            path = f"http://{self.host}{path}"
+            headers.update(proxy_headers)
+        started = time.perf_counter()
+        try:
+            while True:
+                connection = self._connection()
+                reused = self._local.used
+                try:
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    body = response.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    self._drop_connection()
+                    if reused:
+                        continue  # Closed by the server while idle: retry on a new connection
+                    raise
+                except (OSError, http.client.HTTPException):
+                    self._drop_connection()
+                    raise
+                self._local.used = True
+                if not self.keep_alive or response.will_close:
+                    self._drop_connection()
+                break
+            if response.status != 200:
+                raise HTTPStatusError(response.status, response.reason)
+            return json.loads(body.decode('utf-8'))
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            ended = time.perf_counter()
+            with self._lock:
+                self.latencies.append(ended - started)
+                if self._first_start is None or started < self._first_start:
+                    self._first_start = started
+                self._last_end = max(self._last_end or ended, ended)
+
+    def stats(self):
+        """Request count, failures, requests/sec and p50/p95/p99 latency (ms)."""
+        with self._lock:
+            latencies = list(self.latencies)
+            span = (self._last_end - self._first_start) if latencies else 0
+            errors = self.errors
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'seconds': span,
+            'requests_per_sec': len(latencies) / span if span else None,
+            'p50_ms': _ms(percentile(latencies, 50)),
+            'p95_ms': _ms(percentile(latencies, 95)),
+            'p99_ms': _ms(percentile(latencies, 99)),
+        }
+
+    def log_stats(self):
+        """Log stats() if any request was made."""
+        stats = self.stats()
+        if stats['requests']:
+            logging.info(f"Metadata requests: {stats['requests']} ({stats['errors']} failed), "
+                         f"{stats['requests_per_sec'] or 0:.1f} req/s, latency p50 "
+                         f"{stats['p50_ms']:.0f} ms / p95 {stats['p95_ms']:.0f} ms / "
+                         f"p99 {stats['p99_ms']:.0f} ms")
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+
+_default_client = None  # Shared GoogleBooksClient for lookups without their own
+
+
+def _query_google_books(isbn, client=None):
+    """
+    Query the Google Books API for a single ISBN.
 
     Args:
         isbn: 13-digit ISBN string
+        client: GoogleBooksClient to use (default: a shared client for GOOGLE_BOOKS_API_URL)
 
     Returns:
-        dict: Metadata with keys: parent_document, author, publisher,
-              published_date, description, language
-              Returns empty dict on API failure
+        dict: Metadata, {} if no book was found, or None if the request failed
+    """
+    data, error = _request_google_books(isbn, client)
+    if error is not None:
+        return None
+    return _volume_metadata(isbn, data)
+
+
+def _request_google_books(isbn, client=None):
     """
-    url = GOOGLE_BOOKS_API_URL.format(isbn=isbn)
+    Run the Google Books query for an ISBN, logging any failure.
+
+    Returns (decoded JSON, None), or (None, the exception) if the request failed.
+    """
+    global _default_client
+    if client is None:
+        if _default_client is None:
+            _default_client = GoogleBooksClient()
+        client = _default_client
+    # Already loaded by the client; imported here to keep startup fast
+    import http.client
 
     try:
-        with urllib.request.urlopen(url, timeout=10) as response:
-            data = json.loads(response.read().decode('utf-8'))
-    except urllib.error.URLError as e:
+        return client.request(isbn), None
+    except (OSError, http.client.HTTPException) as e:
         logging.error(f"Google Books API request failed: {e}")
-        return {}
+        return None, e
     except json.JSONDecodeError as e:
         logging.error(f"Failed to parse Google Books API response: {e}")
-        return {}
+        return None, e
     except Exception as e:
         logging.error(f"Unexpected error fetching metadata: {e}")
-        return {}
+        return None, e
+
+
+def _is_transient_error(error):
+    """
+    True if a failed request is worth retrying: timeouts, connection errors
+    and HTTP 429 or 5xx. Other HTTP errors (400, 403, 404, ...) and invalid
+    responses would fail the same way again.
+    """
+    import http.client
+    if isinstance(error, HTTPStatusError):
+        return error.transient
+    return isinstance(error, (OSError, http.client.HTTPException))
+
 
+def _volume_metadata(isbn, data):
+    """Metadata from a Google Books volumes response ({} if no book was found)."""
     if data.get('totalItems', 0) == 0:
         logging.warning(f"No book found for ISBN: {isbn}")
         return {}
@@ -157,3 +1220,142 @@ def fetch_metadata_from_google_books(isbn):
     logging.info(f"Fetched metadata for ISBN {isbn}: {metadata.get('parent_document', 'Unknown')}")
 
     return metadata
+
+
+def fetch_metadata_from_google_books(isbn, cache=None, offline=False, client=None):
+    """
+    Fetch book metadata from Google Books API.
+
+    Args:
+        isbn: 13-digit ISBN string
+        cache: Optional MetadataCache consulted before (and updated after) the request
+        offline: If True, never make a request; only use the cache (stale entries allowed)
+        client: Optional GoogleBooksClient (e.g. for a different endpoint)
+
+    Returns:
+        dict: Metadata with keys: parent_document, author, publisher,
+              published_date, description, language
+              Returns empty dict on API failure
+    """
+    if cache is not None:
+        hit, metadata = cache.get(isbn, allow_stale=offline)
+        if hit:
+            logging.info(f"Using cached metadata for ISBN {isbn}: "
+                         f"{metadata.get('parent_document', 'Not found')}")
+            return metadata
+
+    if offline:
+        logging.warning(f"Offline mode: no cached metadata for ISBN {isbn}")
+        return {}
+
+    metadata = _query_google_books(isbn, client)
+    if metadata is None:
+        return {}
+
+    if cache is not None:
+        cache.put(isbn, metadata)
+    return metadata
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls at least 1/rate seconds apart."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class MetadataPrefetcher:
+    """
+    Resolve ISBNs concurrently in the background.
+
+    submit() returns immediately. Cache hits resolve at once and misses go to
+    a bounded thread pool, which applies a rate limit and retries requests
+    that failed transiently (timeouts, connection errors, HTTP 429 and 5xx)
+    with exponential backoff. get() blocks until the ISBN resolves.
+    The cache is only touched from the thread calling submit()/get().
+    Requests go through one GoogleBooksClient, so every pool thread reuses
+    its connection for all the ISBNs it resolves.
+    """
+
+    def __init__(self, cache=None, offline=False, max_workers=4, rate=5.0,
+                 retries=3, backoff=1.0, client=None):
+        self.cache = cache
+        self.client = client or GoogleBooksClient()
+        self.offline = offline
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = RateLimiter(rate)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='metadata')
+        self.futures = {}
+
+    def submit(self, isbn):
+        """Start resolving an ISBN (no-op if already submitted)."""
+        if isbn in self.futures:
+            return
+
+        if self.cache is not None:
+            hit, metadata = self.cache.get(isbn, allow_stale=self.offline)
+            if hit:
+                logging.info(f"Using cached metadata for ISBN {isbn}: "
+                             f"{metadata.get('parent_document', 'Not found')}")
+                self.futures[isbn] = (self._resolved(metadata), False)
+                return
+
+        if self.offline:
+            logging.warning(f"Offline mode: no cached metadata for ISBN {isbn}")
+            self.futures[isbn] = (self._resolved({}), False)
+            return
+
+        self.futures[isbn] = (self.executor.submit(self._fetch, isbn), True)
+
+    def get(self, isbn):
+        """Return metadata for an ISBN ({} if not found or all retries failed)."""
+        self.submit(isbn)
+        future, fetched = self.futures[isbn]
+        metadata = future.result()
+        if fetched:
+            # Store once, from the caller's thread
+            self.futures[isbn] = (self._resolved(metadata or {}), False)
+            if metadata is not None and self.cache is not None:
+                self.cache.put(isbn, metadata)
+        return metadata or {}
+
+    def _fetch(self, isbn):
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            data, error = _request_google_books(isbn, self.client)
+            if error is None:
+                return _volume_metadata(isbn, data)
+            if not _is_transient_error(error):
+                logging.error(f"Not retrying ISBN {isbn}: the request would fail the same way")
+                return None
+            if attempt < self.retries:
+                delay = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+                logging.warning(f"Retrying ISBN {isbn} in {delay:.1f}s "
+                                f"(attempt {attempt + 2}/{self.retries + 1})")
+                time.sleep(delay)
+        logging.error(f"Giving up on ISBN {isbn} after {self.retries + 1} attempt(s)")
+        return None
+
+    @staticmethod
+    def _resolved(value):
+        future = Future()
+        future.set_result(value)
+        return future
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.client.close()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Google Books Stub - A local stand-in for the Google Books volumes API.
+
+Serves /books/v1/volumes?q=isbn:<ISBN> like the real API, from fixture
+responses or synthesized ones, with injectable latency and errors, so
+metadata lookups can be tested and benchmarked without network access.
+Connections are kept alive (HTTP/1.1) as the real API does.
+
+Usage:
+    python google_books_stub.py                                    # Port 8765, synthesized books
+    python google_books_stub.py --fixtures google_books_fixtures.json
+    python google_books_stub.py --latency 80 --jitter 40 --error-rate 0.05
+
+    python pdf-split-by-contents.py --metadata-url \\
+        "http://127.0.0.1:8765/books/v1/volumes?q=isbn:{isbn}"
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+DEFAULT_PORT = 8765
+VOLUMES_PATH = "/books/v1/volumes"
+URL_TEMPLATE = "http://{host}:{port}" + VOLUMES_PATH + "?q=isbn:{{isbn}}"
+
+
+def load_fixtures(path):
+    """
+    Load fixture responses: a JSON object mapping ISBN to the volumeInfo
+    object to return, or to null for "no book found".
+    """
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def synthesize_volume(isbn):
+    """
+    A plausible volumeInfo for any ISBN (used when there are no fixtures).
+    Any query string works: an ISBN-10 ending in X, or one without digits.
+    """
+    digits = ''.join(c for c in isbn if c.isdigit())
+    return {
+        'title': f"Stub Book {isbn}",
+        'authors': ["Stub Author"],
+        'publisher': "Stub Publisher",
+        'publishedDate': f"20{int(digits[-2:] or 0) % 25:02d}-04-01",
+        'description': f"Synthesized by google_books_stub.py for ISBN {isbn}.",
+        'language': "ja",
+    }
+
+
+class StubConfig:
+    """
+    Behavior of a stub server.
+
+    Args:
+        fixtures: dict ISBN -> volumeInfo or None, or None to synthesize every book
+        latency: Base response delay in milliseconds
+        jitter: Extra uniformly random delay, 0..jitter milliseconds
+        error_rate: Fraction of requests answered with error_status
+        error_status: HTTP status of injected errors (default: 503)
+        drop_rate: Fraction of requests whose connection is closed without a response
+        not_found_rate: Fraction of synthesized books reported as not found
+        seed: Random seed for the injected delays and failures
+    """
+
+    def __init__(self, fixtures=None, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=503, drop_rate=0.0, not_found_rate=0.0, seed=None):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.drop_rate = drop_rate
+        self.not_found_rate = not_found_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def volume(self, isbn):
+        """volumeInfo for an ISBN, or None if the book is not found."""
+        if self.fixtures is not None:
+            return self.fixtures.get(isbn)
+        # Stable per ISBN, independent of request order
+        if random.Random(isbn).random() < self.not_found_rate:
+            return None
+        return synthesize_volume(isbn)
+
+    def draw(self):
+        """Decide one request's fate: (delay seconds, 'drop' | 'error' | 'ok')."""
+        with self.lock:
+            self.requests += 1
+            delay = (self.latency + self.random.uniform(0, self.jitter)) / 1000
+            roll = self.random.random()
+        if roll < self.drop_rate:
+            return delay, 'drop'
+        if roll < self.drop_rate + self.error_rate:
+            return delay, 'error'
+        return delay, 'ok'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+    # Headers and body go out in separate writes; without TCP_NODELAY a kept-alive
+    # connection stalls on delayed ACKs and looks slower than reconnecting
+    disable_nagle_algorithm = True
+    config = None
+    verbose = False
+
+    def setup(self):
+        super().setup()
+        with self.config.lock:
+            self.config.connections += 1
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query).get('q', [''])[0]
+        if url.path != VOLUMES_PATH or not query.startswith('isbn:'):
+            self._send(404, {'error': {'code': 404, 'message': "Not Found"}})
+            return
+
+        delay, outcome = self.config.draw()
+        if delay:
+            time.sleep(delay)
+        if outcome == 'drop':
+            self.close_connection = True
+            return
+        if outcome == 'error':
+            status = self.config.error_status
+            self._send(status, {'error': {'code': status, 'message': "Injected error"}})
+            return
+
+        isbn = query[len('isbn:'):].replace('-', '')
+        volume = self.config.volume(isbn)
+        if volume is None:
+            self._send(200, {'kind': 'books#volumes', 'totalItems': 0})
+        else:
+            self._send(200, {'kind': 'books#volumes', 'totalItems': 1,
+                             'items': [{'kind': 'books#volume', 'volumeInfo': volume}]})
+
+    def _send(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(config, host='127.0.0.1', port=DEFAULT_PORT, verbose=False):
+    """Create a threading stub server (port 0 picks a free port)."""
+    handler = type('ConfiguredStubHandler', (StubHandler,),
+                   {'config': config, 'verbose': verbose})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(config, host='127.0.0.1', port=0):
+    """
+    Start a stub server in a background thread.
+
+    Returns (server, URL template for --metadata-url); stop it with
+    server.shutdown().
+    """
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, name='google-books-stub', daemon=True).start()
+    return server, URL_TEMPLATE.format(host=host, port=server.server_address[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Google Books volumes API, with injectable "
+                    "latency and errors.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"Port (default: {DEFAULT_PORT}; 0 picks a free port)")
+    parser.add_argument("--fixtures",
+                        help="JSON file mapping ISBN to volumeInfo (null: not found); "
+                             "without it every ISBN gets a synthesized book")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="Base response delay in milliseconds (default: 0)")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="Extra random delay of up to this many milliseconds (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="Fraction of requests answered with --error-status (default: 0)")
+    parser.add_argument("--error-status", type=int, default=503,
+                        help="HTTP status of injected errors (default: 503)")
+    parser.add_argument("--drop-rate", type=float, default=0,
+                        help="Fraction of requests whose connection is closed without "
+                             "a response (default: 0)")
+    parser.add_argument("--not-found-rate", type=float, default=0,
+                        help="Fraction of synthesized books reported as not found (default: 0)")
+    parser.add_argument("--seed", type=int, help="Random seed for injected delays and failures")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    config = StubConfig(load_fixtures(args.fixtures) if args.fixtures else None,
+                        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        error_status=args.error_status, drop_rate=args.drop_rate,
+                        not_found_rate=args.not_found_rate, seed=args.seed)
+    server = make_server(config, args.host, args.port, args.verbose)
+    port = server.server_address[1]
+    print(f"Serving Google Books stub on http://{args.host}:{port}{VOLUMES_PATH}", flush=True)
+    print(f"  --metadata-url \"{URL_TEMPLATE.format(host=args.host, port=port)}\"", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{config.requests} request(s) on {config.connections} connection(s)",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
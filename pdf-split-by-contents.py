@@ -9,121 +9,1353 @@ Usage:
     python pdf-split-by-contents.py 978-xxx_book.pdf   # Process single PDF (ISBN auto-extracted)
     python pdf-split-by-contents.py -o custom_output   # Specify output directory
     python pdf-split-by-contents.py --background       # Run without GUI prompts
+    python pdf-split-by-contents.py --workers 8        # Process 8 PDFs in parallel
     python pdf-split-by-contents.py --genre "法律"     # Override/add metadata
 """
 
 import os
+import re
 import sys
+import csv
+import json
+import hashlib
 import argparse
+import bisect
 import logging
 import time
-import tkinter as tk
-from tkinter import simpledialog
+import shutil
+import signal
+import tempfile
+from collections import deque, namedtuple
+from concurrent.futures import as_completed
 from pathlib import Path
-import fitz  # PyMuPDF
 
 from common import (
     INPUT_DIR, OUTPUT_DIR, LARGE_FILE_THRESHOLD,
-    setup_logging, estimate_time, clean_filename,
-    extract_isbn_from_filename, fetch_metadata_from_google_books
+    setup_logging, estimate_time, clean_filename, parse_size, parse_since,
+    extract_isbn_from_filename,
+    MetadataCache, MetadataPrefetcher, METADATA_CACHE_FILE, GOOGLE_BOOKS_API_URL,
+    GoogleBooksClient,
+    MANIFEST_FILE, PAGE_INDEX_FILE, PLAN_CACHE_DIR, write_json_atomic, write_text_atomic,
+    load_json, sha256_file,
+    find_duplicate_files, hardlink_replace, count_tokens, FileFilter, scan_files,
+    BackgroundHasher,
+    ARCHIVE_FORMATS, ARCHIVE_INDEX, ArchiveWriter, iter_archive_members, FolderWatcher,
+    init_worker_logging, start_worker_log_capture, finish_worker_log_capture,
+    replay_log_records, BookMetrics, MetricsWriter, peak_rss_bytes, reset_peak_rss,
+    current_rss_bytes, lazy_import
 )
 
+# Heavy or optional modules are loaded on first use so that startup stays
+# fast (--help, --refresh-metadata, small files). tkinter is only imported
+# for the GUI prompt and concurrent.futures.process only when a pool starts.
+fitz = lazy_import('fitz')  # PyMuPDF
+
+
+# Chunks are saved without a fresh /ID so output is reproducible and does not
+# depend on which process or source handle wrote it.
+CHUNK_SAVE_OPTIONS = {'no_new_id': True}
+
+# Output optimization profiles (extra fitz.Document.save() options).
+# insert_pdf() copies every referenced font and image into each chunk, so
+# garbage collection and duplicate-object elimination matter a lot here.
+OPTIMIZE_PROFILES = {
+    'none': {},
+    # Drop unused objects, merge duplicate objects, compress streams
+    'compact': {'garbage': 3, 'deflate': True},
+    # Also merge duplicate streams, compress images/fonts, clean content streams
+    'max': {'garbage': 4, 'deflate': True, 'deflate_images': True,
+            'deflate_fonts': True, 'clean': True},
+}
+
+
+# Image rewriting (--image-dpi, --image-quality, --grayscale-images). Images are
+# only downsampled when placed at more than 1.5x the target resolution (as
+# Ghostscript does), and a re-encoded image is kept only if it got smaller.
+IMAGE_DOWNSAMPLE_THRESHOLD = 1.5
+DEFAULT_JPEG_QUALITY = 75
+
+
+# A planned output chunk (0-based, inclusive page range). `sections` lists the
+# titles of neighbouring sections merged into this chunk (empty if not merged).
+SplitRange = namedtuple('SplitRange',
+                        ['start', 'end', 'title', 'chapter_num', 'chapter_title', 'sections'],
+                        defaults=((),))
+
+
+def _normalize_ranges(ranges):
+    """Convert (start, end, title[, chapter_num, chapter_title]) tuples to SplitRange."""
+    result = []
+    for i, range_data in enumerate(ranges):
+        if isinstance(range_data, SplitRange):
+            result.append(range_data)
+        elif len(range_data) == 3:
+            # Backward compatible: chapter info defaults to the split index/title
+            start, end, title = range_data
+            result.append(SplitRange(start, end, title, i + 1, title))
+        else:
+            result.append(SplitRange(*range_data))
+    return result
 
-class PdfSplitter:
-    """Handles splitting large PDFs by bookmarks or page ranges."""
 
-    def __init__(self, pdf_path, metadata=None):
-        self.pdf_path = Path(pdf_path)
-        self.doc = fitz.open(self.pdf_path)
-        self.metadata = metadata or {}
+class RangePlan:
+    """
+    The planned output chunks of a document: an ordered list of SplitRanges.
 
-    @property
-    def page_count(self):
-        return self.doc.page_count
+    Serializes to a compact dict (ranges as [start, end, title, chapter_num,
+    chapter_title, sections] lists) for the manifest and the on-disk plan cache.
 
-    def split_smart(self, output_dir):
+    Plans made from a TOC also keep the bookmarks they were cut at, as
+    [start page, [chapter title, section title]] entries with the titles as
+    they appear in the PDF (chunk titles are file-name safe and may be
+    generated, e.g. '_Intro', '_part2' or merged 'a~b' names); None otherwise.
+    """
+
+    VERSION = 2
+    # Versions from_dict() still reads (version 1 plans have no bookmarks)
+    READABLE_VERSIONS = (1, 2)
+
+    def __init__(self, ranges, total_chapters, page_count, toc=None):
+        self.ranges = _normalize_ranges(ranges)
+        self.total_chapters = total_chapters
+        self.page_count = page_count
+        self.toc = toc
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __getitem__(self, index):
+        return self.ranges[index]
+
+    def replace_ranges(self, ranges):
+        """Return a plan with the same document facts and new ranges."""
+        return RangePlan(ranges, self.total_chapters, self.page_count, self.toc)
+
+    def range_problems(self):
+        """Ranges that are empty, reversed or reach past the document (1-based pages)."""
+        problems = []
+        for i, r in enumerate(self.ranges, 1):
+            if not 0 <= r.start <= r.end < self.page_count:
+                problems.append(f"chunk {i} '{r.title}' has pages {r.start + 1}-{r.end + 1} "
+                                f"of {self.page_count}")
+        if not self.ranges:
+            problems.append("no ranges")
+        return problems
+
+    def tiling_problems(self):
         """
-        Smart split based on document structure:
+        Gaps and overlaps between consecutive valid ranges, and pages left
+        uncovered at either end, so an empty list means the ranges tile
+        pages 0..page_count-1 exactly (1-based pages in the messages).
+        """
+        problems = []
+        next_page = 0
+        for i, r in enumerate(self.ranges, 1):
+            if not 0 <= r.start <= r.end < self.page_count:
+                continue
+            if r.start > next_page:
+                problems.append(f"pages {next_page + 1}-{r.start} are in no chunk "
+                                f"(before chunk {i} '{r.title}')")
+            elif r.start < next_page:
+                problems.append(f"pages {r.start + 1}-{min(next_page, r.end + 1)} are repeated "
+                                f"in chunk {i} '{r.title}'")
+            next_page = max(next_page, r.end + 1)
+        if next_page < self.page_count and self.ranges:
+            problems.append(f"pages {next_page + 1}-{self.page_count} are in no chunk")
+        return problems
+
+    def to_dict(self):
+        return {
+            'version': self.VERSION,
+            'page_count': self.page_count,
+            'total_chapters': self.total_chapters,
+            'ranges': [[r.start, r.end, r.title, r.chapter_num, r.chapter_title,
+                        list(r.sections)] for r in self.ranges],
+            'toc': self.toc,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a plan from to_dict() output, or return None if incompatible."""
+        if not data or data.get('version') not in cls.READABLE_VERSIONS:
+            return None
+        ranges = [SplitRange(s, e, t, cn, ct, tuple(sections))
+                  for s, e, t, cn, ct, sections in data['ranges']]
+        return cls(ranges, data['total_chapters'], data['page_count'], data.get('toc'))
+
+    @classmethod
+    def from_toc(cls, toc, page_count):
+        """
+        Plan a smart split from a TOC in a single linear pass:
         - L3 = Section (Primary split)
         - L2 = Chapter (Fallback if no sections exist)
+        - L1 entries are used as chapters if the TOC has no L2 entries
 
-        Returns list of (start, end, title, chapter_num, chapter_title) tuples
+        Returns None if the TOC has no usable entries.
         """
-        toc = self.doc.get_toc()
-        if not toc:
+        # One pass: collect L2 chapters with their L3 children, plus L1 entries
+        # in case there are no L2 entries at all.
+        l2_chapters = []  # [title, start, [(child_title, child_start), ...]]
+        l1_chapters = []
+        for entry in toc:
+            lvl, title, page = entry[:3]
+            if lvl == 2:
+                l2_chapters.append([title, page - 1, []])
+            elif lvl == 3 and l2_chapters:
+                l2_chapters[-1][2].append((title, page - 1))
+            elif lvl == 1:
+                l1_chapters.append([title, page - 1, []])
+
+        chapters = l2_chapters or l1_chapters
+        if not chapters:
             return None
 
-        l2_indices = [i for i, x in enumerate(toc) if x[0] == 2]
-        if not l2_indices:
-            l2_indices = [i for i, x in enumerate(toc) if x[0] == 1]
-            if not l2_indices:
-                return None
-
-        # ranges: (start, end, safe_title, chapter_num, chapter_title)
         ranges = []
-        total_chapters = len(l2_indices)
-
-        first_node_start = toc[l2_indices[0]][2] - 1
+        bookmarks = []  # [start, [chapter title, section title]] with the TOC's titles
+        first_node_start = chapters[0][1]
         if first_node_start > 0:
-            ranges.append((0, first_node_start - 1, "00_Contents", 0, "Contents"))
+            ranges.append(SplitRange(0, first_node_start - 1, "00_Contents", 0, "Contents"))
 
-        for i, idx in enumerate(l2_indices):
-            node = toc[idx]
-            lvl, title, _ = node[:3]
+        for i, (title, start_page, children) in enumerate(chapters):
             chapter_num = i + 1  # 1-based chapter number
-            chapter_title = title
-
-            next_l2_idx = l2_indices[i + 1] if i < len(l2_indices) - 1 else len(toc)
-
-            start_page = node[2] - 1
-
-            if next_l2_idx < len(toc):
-                end_page = toc[next_l2_idx][2] - 1 - 1
+            if i < len(chapters) - 1:
+                end_page = chapters[i + 1][1] - 1
             else:
-                end_page = self.doc.page_count - 1
+                end_page = page_count - 1
 
             safe_title = clean_filename(title)
-
-            # Find child sections (Level 3)
-            children = []
-            for k in range(idx + 1, next_l2_idx):
-                child = toc[k]
-                if child[0] == lvl + 1:
-                    children.append((k, child))
+            bookmarks.append([start_page, [title]])
+            bookmarks.extend([c_start, [title, c_title]] for c_title, c_start in children)
 
             if children:
                 # Split by sections
-                first_child_start = children[0][1][2] - 1
+                first_child_start = children[0][1]
                 if first_child_start > start_page:
-                    ranges.append((start_page, first_child_start - 1, f"{safe_title}_Intro",
-                                   chapter_num, chapter_title))
-
-                for j, (pidx, child_node) in enumerate(children):
-                    c_title = child_node[1]
-                    c_start = child_node[2] - 1
+                    ranges.append(SplitRange(start_page, first_child_start - 1,
+                                             f"{safe_title}_Intro", chapter_num, title))
 
+                for j, (c_title, c_start) in enumerate(children):
                     if j < len(children) - 1:
-                        c_end = children[j + 1][1][2] - 1 - 1
+                        c_end = children[j + 1][1] - 1
                     else:
                         c_end = end_page
-
-                    c_safe_title = clean_filename(c_title)
-                    ranges.append((c_start, c_end, c_safe_title, chapter_num, chapter_title))
+                    ranges.append(SplitRange(c_start, c_end, clean_filename(c_title),
+                                             chapter_num, title))
             else:
                 # No sections, keep as chapter
-                ranges.append((start_page, end_page, safe_title, chapter_num, chapter_title))
+                ranges.append(SplitRange(start_page, end_page, safe_title, chapter_num, title))
 
-        return self._save_ranges(ranges, output_dir, total_chapters)
+        bookmarks.sort(key=lambda bookmark: bookmark[0])
+        return cls(cls._fold_empty_ranges(ranges), len(chapters), page_count, bookmarks)
 
-    def _add_forced_splits(self, range_list, start, end, base_title, limit):
-        """Force split large sections into smaller chunks."""
-        current = start
-        part = 1
-        while current <= end:
-            next_split = min(current + limit - 1, end)
-            range_list.append((current, next_split, f"{base_title}_part{part}"))
-            current = next_split + 1
-            part += 1
+    @staticmethod
+    def _fold_empty_ranges(ranges):
+        """
+        Fold ranges that end right before they start (a bookmark on the same
+        page as the next one, e.g. two short sections on one page) into the
+        following range, named and listed as a merged chunk would be.
+
+        Other reversed ranges (bookmarks out of order) are kept as they are,
+        so plan verification still rejects them.
+        """
+        result = []
+        pending = []
+        for r in ranges:
+            if r.end == r.start - 1:
+                pending.append(r)
+                continue
+            if pending:
+                group = pending + [r]
+                logging.info(f"Bookmarks {', '.join(repr(g.title) for g in group)} start on "
+                             f"page {r.start + 1}; merged into one chunk")
+                r = SplitRange(r.start, r.end, f"{group[0].title}~{r.title}",
+                               r.chapter_num, r.chapter_title,
+                               tuple(t for g in group for t in (g.sections or (g.title,))))
+                pending = []
+            result.append(r)
+        # Trailing empty ranges start past the last page: left for verification
+        result.extend(pending)
+        return result
+
+
+class PageIndex:
+    """
+    Page-to-chunk lookup of a split book, stored as page_index.json in its
+    output folder.
+
+    Two sets of parallel arrays sorted by start page (1-based, inclusive):
+    the chunks, with their file (or archive member) names, and the bookmarks
+    the book was split at, with their TOC paths ([chapter title, section
+    title] as they appear in the PDF, the section omitted for chapter pages
+    before the first section). Pages before the first bookmark have an empty
+    TOC path. A page resolves to its chunk and TOC path with two binary
+    searches, without reading any sidecar.
+    """
+
+    VERSION = 2
+
+    def __init__(self, start_pages, end_pages, files, toc_start_pages, toc_paths, page_count,
+                 source=None, archive=None):
+        self.start_pages = start_pages
+        self.end_pages = end_pages
+        self.files = files
+        self.toc_start_pages = toc_start_pages
+        self.toc_paths = toc_paths
+        self.page_count = page_count
+        self.source = source
+        self.archive = archive
+
+    @classmethod
+    def from_plan(cls, plan, source=None, archive=None):
+        """
+        Build the index of a RangePlan (chunk names as _save_ranges() writes
+        them). Plans without bookmarks (manual or page-count splits, version 1
+        plans) use each chunk's chapter title as its TOC path.
+        """
+        entries = sorted((r.start + 1, r.end + 1, _chunk_filename(i + 1, r.title))
+                         for i, r in enumerate(plan))
+        start_pages, end_pages, files = (list(column) for column in zip(*entries)) \
+            if entries else ([], [], [])
+        if plan.toc is not None:
+            bookmarks = [(start + 1, path) for start, path in plan.toc]
+        else:
+            bookmarks = sorted(((r.start + 1, [r.chapter_title] if r.chapter_num else [])
+                                for r in plan), key=lambda bookmark: bookmark[0])
+        toc_start_pages = [start for start, _ in bookmarks]
+        toc_paths = [path for _, path in bookmarks]
+        return cls(start_pages, end_pages, files, toc_start_pages, toc_paths, plan.page_count,
+                   source, archive)
+
+    def lookup(self, page):
+        """Return (file name, TOC path) of the chunk holding 1-based page, or None."""
+        i = bisect.bisect_right(self.start_pages, page) - 1
+        if i < 0 or page > self.end_pages[i]:
+            return None
+        j = bisect.bisect_right(self.toc_start_pages, page) - 1
+        return self.files[i], self.toc_paths[j] if j >= 0 else []
+
+    def to_dict(self):
+        return {
+            'version': self.VERSION,
+            'source': self.source,
+            'archive': self.archive,
+            'page_count': self.page_count,
+            'start_pages': self.start_pages,
+            'end_pages': self.end_pages,
+            'files': self.files,
+            'toc_start_pages': self.toc_start_pages,
+            'toc_paths': self.toc_paths,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild an index from to_dict() output, or return None if incompatible."""
+        if not data or data.get('version') != cls.VERSION:
+            return None
+        return cls(data['start_pages'], data['end_pages'], data['files'],
+                   data['toc_start_pages'], data['toc_paths'], data['page_count'],
+                   data.get('source'), data.get('archive'))
+
+    @classmethod
+    def load(cls, book_dir):
+        """Load a book folder's page_index.json, or return None if missing or incompatible."""
+        return cls.from_dict(load_json(Path(book_dir) / PAGE_INDEX_FILE))
+
+    def save(self, book_dir):
+        write_json_atomic(Path(book_dir) / PAGE_INDEX_FILE, self.to_dict())
+
+
+# Size estimation constants for --max-chunk-bytes (unoptimized output)
+PAGE_OVERHEAD_BYTES = 1024   # page object, resources dict, xref entries
+CHUNK_OVERHEAD_BYTES = 4096  # header, catalog, page tree, trailer
+
+
+MANIFEST_VERSION = 2
+
+# Result of writing one chunk: bytes written, bytes an unoptimized save would
+# have written (None unless measured), seconds spent copying pages and saving,
+# the RSS (bytes) after which bounded-memory mode reopened the source (else None),
+# and with verification the chunk's SHA-256 (from chunk workers only; see
+# BackgroundHasher) and the seconds spent verifying it.
+ChunkStats = namedtuple('ChunkStats', ['size', 'baseline', 'insert_seconds', 'save_seconds',
+                                       'reopened_at', 'sha256', 'verify_seconds'],
+                        defaults=(None, None, 0.0))
+
+
+class SplitVerificationError(Exception):
+    """A range plan or written chunk does not match the source's pages."""
+
+# Files written into a book's output directory, and their temp files ("<name>.tmp",
+# or "<name>.<random>.tmp" from write_json_atomic() and hardlink_replace())
+CHUNK_FILE_PATTERN = re.compile(r'^\d{3}_.*\.(pdf|yaml|jsonl)(\.(\w+\.)?tmp)?$')
+ARCHIVE_FILE_PATTERN = re.compile(r'^.*\.(zip|tar)(\.tmp)?$')
+BOOK_INDEX_FILE_PATTERN = re.compile(
+    rf'^({re.escape(MANIFEST_FILE)}|{re.escape(PAGE_INDEX_FILE)})(\.(\w+\.)?tmp)?$')
+# Source with rewritten images, kept while a book is written (see _rewrite_images())
+REWRITTEN_SOURCE_PREFIX = '.rewritten-source.'
+REWRITTEN_SOURCE_PATTERN = re.compile(rf'^{re.escape(REWRITTEN_SOURCE_PREFIX)}\w+\.tmp$')
+ARCHIVE_INDEX_VERSION = 1
+
+
+def _chunk_filename(split_index, title):
+    """File name of a chunk: 1-based index and sanitized, truncated title."""
+    return f"{split_index:03d}_{clean_filename(title)[:50]}.pdf"
+
+
+def _open_source(source):
+    """Open a source PDF given as a path or as in-memory bytes."""
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype='pdf')
+    return fitz.open(source)
+
+
+def _build_chunk(src_doc, start, end, name, subset_fonts=False, measure_baseline=False):
+    """
+    Copy pages start..end (0-based, inclusive) of src_doc into a new document.
+
+    Returns (document, unoptimized size or None, seconds spent copying pages).
+    The caller serializes the document with CHUNK_SAVE_OPTIONS and closes it.
+    """
+    started = time.perf_counter()
+    new_doc = fitz.open()
+    new_doc.insert_pdf(src_doc, from_page=start, to_page=end)
+    insert_seconds = time.perf_counter() - started
+
+    baseline = None
+    if measure_baseline:
+        baseline = len(new_doc.tobytes(**CHUNK_SAVE_OPTIONS))
+
+    if subset_fonts:
+        try:
+            new_doc.subset_fonts()
+        except Exception as e:
+            logging.warning(f"Font subsetting failed for {name}: {e}")
+    return new_doc, baseline, insert_seconds
+
+
+STARTXREF_PATTERN = re.compile(rb'startxref\s+(\d+)\s+%%EOF\s*$')
+XREF_SUBSECTION_PATTERN = re.compile(rb'\s*(\d+) (\d+)[ \t]*\r?\n')
+OBJECT_HEADER_PATTERN = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj\b')
+
+
+def _xref_page_count(read, size):
+    """
+    Page count from the page tree root of a PDF with a classic cross-reference
+    table (as MuPDF writes chunks): startxref -> trailer /Root -> catalog
+    /Pages -> /Count, reading only the table and two small objects.
+
+    read(offset, length) returns bytes of the PDF. Returns None if the file
+    does not have that simple structure (xref streams, incremental updates,
+    objects in object streams).
+    """
+    tail = read(max(0, size - 1024), 1024)
+    match = STARTXREF_PATTERN.search(tail)
+    if not match:
+        return None
+    xref_offset = int(match.group(1))
+    table = read(xref_offset, size - xref_offset)
+    if not table.startswith(b'xref'):
+        return None
+    trailer_at = table.find(b'trailer')
+    trailer = table[trailer_at:]
+    root = re.search(rb'/Root\s*(\d+)\s+\d+\s+R', trailer)
+    if trailer_at < 0 or not root or b'/Prev' in trailer:
+        return None
+
+    def object_body(number):
+        pos = len(b'xref')
+        while True:  # Subsections: "first count" and count 20-byte entries
+            section = XREF_SUBSECTION_PATTERN.match(table, pos)
+            if not section:
+                return None
+            first, count = int(section.group(1)), int(section.group(2))
+            pos = section.end()
+            if first <= number < first + count:
+                entry = table[pos + 20 * (number - first):pos + 20 * (number - first + 1)]
+                if entry[17:18] != b'n':
+                    return None
+                # Catalog and page tree root are small: try a short read first
+                for length in (4096, 64 * 1024):
+                    data = read(int(entry[:10]), length)
+                    header = OBJECT_HEADER_PATTERN.match(data)
+                    if not header or int(header.group(1)) != number:
+                        return None
+                    end = data.find(b'endobj', header.end())
+                    if end >= 0:
+                        return data[header.end():end]
+                return None
+            pos += 20 * count
+
+    catalog = object_body(int(root.group(1)))
+    pages_ref = catalog and re.search(rb'/Pages\s*(\d+)\s+\d+\s+R', catalog)
+    pages = pages_ref and object_body(int(pages_ref.group(1)))
+    count = pages and re.search(rb'/Count\s*(\d+)', pages)
+    return int(count.group(1)) if count else None
+
+
+def _read_page_count(chunk):
+    """
+    Page count of a PDF given as a file path or bytes, without a full parse.
+
+    Uses _xref_page_count() and falls back to opening the PDF with MuPDF
+    (which reads the cross-reference data, not the pages). Raises
+    SplitVerificationError if the PDF cannot be read.
+    """
+    try:
+        if isinstance(chunk, bytes):
+            count = _xref_page_count(lambda offset, length: chunk[offset:offset + length],
+                                     len(chunk))
+        else:
+            with open(chunk, 'rb') as f:
+                def read(offset, length):
+                    f.seek(offset)
+                    return f.read(length)
+                count = _xref_page_count(read, os.fstat(f.fileno()).st_size)
+        if count is not None:
+            return count
+        doc = (fitz.open(stream=chunk, filetype='pdf') if isinstance(chunk, bytes)
+               else fitz.open(chunk))
+        try:
+            return doc.page_count
+        finally:
+            doc.close()
+    except Exception as e:
+        raise SplitVerificationError(f"cannot read page count: {e}") from e
+
+
+def _verify_chunk(chunk, start, end, name):
+    """
+    Check that a saved chunk (file path or PDF bytes) has as many pages as
+    its range (see _read_page_count()).
+
+    Returns the seconds spent; raises SplitVerificationError on a mismatch.
+    """
+    started = time.perf_counter()
+    try:
+        pages = _read_page_count(chunk)
+    except SplitVerificationError as e:
+        raise SplitVerificationError(f"{name}: {e}") from None
+    if pages != end - start + 1:
+        raise SplitVerificationError(f"{name} has {pages} page(s), expected {end - start + 1} "
+                                     f"(pages {start + 1}-{end + 1})")
+    return time.perf_counter() - started
+
+
+def _write_chunk(src_doc, start, end, fpath, optimize='none', subset_fonts=False,
+                 measure_baseline=False, verify=False):
+    """
+    Copy pages start..end (0-based, inclusive) of src_doc into a new PDF file.
+
+    The PDF is saved to a temp file and renamed into place, so a crash never
+    leaves a truncated chunk behind. With verify, the temp file is checked
+    first (see _verify_chunk()), so a chunk with the wrong pages never lands.
+
+    Returns ChunkStats. The baseline is only computed when measure_baseline
+    is True, else None.
+    """
+    started = time.perf_counter()
+    new_doc, baseline, insert_seconds = _build_chunk(src_doc, start, end, Path(fpath).name,
+                                                     subset_fonts, measure_baseline)
+    tmp_path = f"{fpath}.tmp"
+    new_doc.save(tmp_path, **CHUNK_SAVE_OPTIONS, **OPTIMIZE_PROFILES[optimize])
+    new_doc.close()
+    save_seconds = time.perf_counter() - started - insert_seconds
+    verify_seconds = _verify_chunk(tmp_path, start, end, Path(fpath).name) if verify else 0.0
+    os.replace(tmp_path, fpath)
+    return ChunkStats(os.path.getsize(fpath), baseline, insert_seconds, save_seconds,
+                      verify_seconds=verify_seconds)
+
+
+def _chunk_bytes(src_doc, start, end, name, optimize='none', subset_fonts=False,
+                 measure_baseline=False, verify=False):
+    """
+    Like _write_chunk(), but return (PDF bytes, ChunkStats) instead of writing a file.
+
+    The bytes are identical to the file _write_chunk() would write.
+    """
+    started = time.perf_counter()
+    new_doc, baseline, insert_seconds = _build_chunk(src_doc, start, end, name,
+                                                     subset_fonts, measure_baseline)
+    data = new_doc.tobytes(**CHUNK_SAVE_OPTIONS, **OPTIMIZE_PROFILES[optimize])
+    new_doc.close()
+    save_seconds = time.perf_counter() - started - insert_seconds
+    verify_seconds = _verify_chunk(data, start, end, name) if verify else 0.0
+    return data, ChunkStats(len(data), baseline, insert_seconds, save_seconds,
+                            verify_seconds=verify_seconds)
+
+
+def _over_memory_limit(max_memory):
+    """
+    Bounded-memory mode, called after each chunk: empty MuPDF's object store
+    and return the current RSS if it exceeds max_memory (else None).
+
+    The caller then closes and reopens the source, which drops the objects
+    MuPDF has parsed and cached on the source document's xref.
+    """
+    if not max_memory:
+        return None
+    fitz.TOOLS.store_shrink(100)
+    rss = current_rss_bytes()
+    return rss if rss is not None and rss > max_memory else None
+
+
+def _write_chunks_worker(source, jobs, write_options, max_memory=None, checksums=False):
+    """
+    Worker entry point: open a private handle on the source and write jobs.
+
+    With checksums, chunks are hashed while the next ones are written; the
+    time spent waiting for the last hashes counts as the last chunk's
+    verification time.
+
+    Returns (ChunkStats in job order, peak RSS of this worker, log records).
+    """
+    start_worker_log_capture()
+    reset_peak_rss()
+    src_doc = _open_source(source)
+    hasher = BackgroundHasher() if checksums else None
+    try:
+        results = []
+        for start, end, fpath in jobs:
+            stats = _write_chunk(src_doc, start, end, fpath, **write_options)
+            rss = _over_memory_limit(max_memory)
+            if rss is not None:
+                src_doc.close()
+                src_doc = _open_source(source)
+                stats = stats._replace(reopened_at=rss)
+            if hasher is not None:
+                hasher.add(len(results), path=fpath)
+            results.append(stats)
+        if hasher is not None and results:
+            started = time.perf_counter()
+            digests = hasher.results()
+            results = [stats._replace(sha256=digests[i]) for i, stats in enumerate(results)]
+            results[-1] = results[-1]._replace(
+                verify_seconds=results[-1].verify_seconds + time.perf_counter() - started)
+        return results, peak_rss_bytes(), finish_worker_log_capture()
+    finally:
+        if hasher is not None:
+            hasher.close()
+        src_doc.close()
+
+
+def _rewrite_image(doc, xref, dpi, image_dpi=None, image_quality=None,
+                   grayscale_images=False):
+    """
+    Re-encode one image of doc as JPEG: downsampled to image_dpi if its
+    effective resolution dpi is far above it, converted to grayscale if asked.
+
+    Returns (xref, JPEG bytes, width, height, is_gray, old stream size), or
+    None if the result is not smaller than the image's current stream.
+    """
+    old_size = len(doc.xref_stream_raw(xref))
+    pix = fitz.Pixmap(doc, xref)
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if grayscale_images and pix.n > 1:
+        pix = fitz.Pixmap(fitz.csGRAY, pix)
+    elif pix.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)  # CMYK, DeviceN, ...
+    if image_dpi and dpi > image_dpi * IMAGE_DOWNSAMPLE_THRESHOLD:
+        scale = image_dpi / dpi
+        pix = fitz.Pixmap(pix, max(1, round(pix.width * scale)),
+                          max(1, round(pix.height * scale)), None)
+    data = pix.tobytes('jpg', jpg_quality=image_quality or DEFAULT_JPEG_QUALITY)
+    if len(data) >= old_size:
+        return None
+    return xref, data, pix.width, pix.height, pix.n == 1, old_size
+
+
+def _is_rewritable_image(doc, xref):
+    """False for image masks, images with a soft mask and 1-bit images (scanned text)."""
+    if doc.xref_get_key(xref, 'ImageMask')[1] == 'true':
+        return False
+    if doc.xref_get_key(xref, 'SMask')[0] != 'null':
+        return False
+    return doc.xref_get_key(xref, 'BitsPerComponent')[1] != '1'
+
+
+def _rewrite_images_in(doc, jobs, image_options):
+    """Re-encode images [(xref, dpi)] of doc; returns the _rewrite_image() results that shrank."""
+    results = []
+    for xref, dpi in jobs:
+        try:
+            result = _rewrite_image(doc, xref, dpi, **image_options)
+        except Exception:
+            result = None  # Undecodable or unusual image: keep it as is
+        if result is not None:
+            results.append(result)
+    return results
+
+
+def _rewrite_images_worker(source, jobs, image_options):
+    """
+    Worker entry point: re-encode images from a private handle on the source.
+
+    Returns (_rewrite_images_in() results, peak RSS of this worker, log records).
+    """
+    start_worker_log_capture()
+    reset_peak_rss()
+    src_doc = _open_source(source)
+    try:
+        results = _rewrite_images_in(src_doc, jobs, image_options)
+        return results, peak_rss_bytes(), finish_worker_log_capture()
+    finally:
+        src_doc.close()
+
+
+# Source document of a text extraction worker (see TextExtraction)
+_text_doc = None
+_text_source = None
+_text_max_memory = None
+
+
+def _init_text_worker(source, max_memory=None):
+    global _text_doc, _text_source, _text_max_memory
+    init_worker_logging()
+    _text_source = source
+    _text_max_memory = max_memory
+    reset_peak_rss()
+    _text_doc = _open_source(source)
+
+
+def _extract_pages_text(start, end):
+    """
+    Worker entry point: plain text of pages start..end (0-based, inclusive),
+    the peak RSS of this worker so far and its log records.
+    """
+    global _text_doc
+    start_worker_log_capture()
+    pages = [_text_doc[pno].get_text() for pno in range(start, end + 1)]
+    if _over_memory_limit(_text_max_memory) is not None:
+        _text_doc.close()
+        _text_doc = _open_source(_text_source)
+    return pages, peak_rss_bytes(), finish_worker_log_capture()
+
+
+class TextExtraction:
+    """
+    Extract the text of a plan's ranges in background processes while the
+    chunks are written.
+
+    Every range is submitted up front to a pool of `workers` processes, each
+    holding one handle on the source, so extraction overlaps with building
+    and saving chunks instead of adding to it.
+    """
+
+    def __init__(self, source, plan, workers=1, max_memory=None):
+        from concurrent.futures import ProcessPoolExecutor
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_text_worker,
+                                             initargs=(source, max_memory))
+        self._futures = [self._executor.submit(_extract_pages_text, r.start, r.end)
+                         for r in plan]
+        self.peak_rss_bytes = None  # Largest worker peak reported so far
+
+    def pages(self, index):
+        """Page texts of the plan's index-th range (waits for them if needed)."""
+        pages, peak, records = self._futures[index].result()
+        replay_log_records(records)
+        if peak is not None:
+            self.peak_rss_bytes = max(self.peak_rss_bytes or 0, peak)
+        return pages
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+def format_text_sidecar(start_page, pages):
+    """
+    Format a chunk's text sidecar: one JSON line per page with its 1-based
+    page number in the source, character offset into the chunk's text (the
+    page texts concatenated), character and token counts, and text.
+
+    Returns (sidecar text, (total chars, total tokens)).
+    """
+    lines = []
+    offset = 0
+    total_tokens = 0
+    for i, text in enumerate(pages):
+        tokens = count_tokens(text)
+        lines.append(json.dumps({'page': start_page + i, 'offset': offset, 'chars': len(text),
+                                 'tokens': tokens, 'text': text}, ensure_ascii=False))
+        offset += len(text)
+        total_tokens += tokens
+    return ''.join(line + '\n' for line in lines), (offset, total_tokens)
+
+
+def _partition_jobs(jobs, parts):
+    """
+    Partition jobs into at most `parts` contiguous groups of similar page count.
+
+    Jobs are (start, end, fpath) tuples; order is preserved within each group.
+    Each job goes to the group whose 1/parts slice of the total page count
+    holds its middle page, so groups are cut at the job boundaries nearest to
+    k * total / parts. No group is left empty while jobs remain for it.
+    """
+    total_pages = sum(end - start + 1 for start, end, _ in jobs)
+    groups = []
+    done = 0
+    for i, job in enumerate(jobs):
+        pages = job[1] - job[0] + 1
+        index = int((done + pages / 2) * parts / total_pages)
+        # Stay in the last group or open the next one, but open it early if
+        # the remaining jobs are needed to give every worker a group
+        lowest = max(len(groups) - 1, parts - (len(jobs) - i))
+        index = min(max(index, lowest), len(groups))
+        if index == len(groups):
+            groups.append([])
+        groups[index].append(job)
+        done += pages
+    return groups
+
+
+# PdfSplitter options that change the output files, with their defaults
+OUTPUT_OPTION_DEFAULTS = {
+    'optimize': 'none',
+    'subset_fonts': False,
+    'max_chunk_bytes': None,
+    'merge_pages': None,
+    'merge_bytes': None,
+    'archive': None,
+    'image_dpi': None,
+    'image_quality': None,
+    'grayscale_images': False,
+    'extract_text': False,
+}
+
+
+def _yaml_scalar(value):
+    """Format a YAML scalar, quoting strings with special characters."""
+    if isinstance(value, str) and any(c in value for c in ':#{}[]&*?|-<>=!%@\\'):
+        return f'"{value}"'
+    return f'{value}'
+
+
+def chunk_metadata(metadata, split_index, chapter_num, chapter_title, total_chapters,
+                   sections=(), start_page=None, end_page=None, text_stats=None):
+    """
+    Build the metadata of one chunk as an ordered dict (the YAML sidecar's content).
+
+    Book-level values are included only when set; split info is always included.
+    start_page/end_page are the chunk's 1-based, inclusive pages in the source;
+    text_stats is (characters, tokens) of its extracted text (--extract-text).
+    """
+    # Build metadata dict with only specified values
+    # Use ordered insertion for consistent output
+    lines = []
+
+    # parent_document: タイトル（APIから取得またはCLIで指定）
+    if metadata.get('parent_document'):
+        lines.append(('parent_document', metadata['parent_document']))
+
+    # isbn
+    if metadata.get('isbn'):
+        lines.append(('isbn', metadata['isbn']))
+
+    # author
+    if metadata.get('author'):
+        lines.append(('author', metadata['author']))
+
+    # publisher
+    if metadata.get('publisher'):
+        lines.append(('publisher', metadata['publisher']))
+
+    # published_date
+    if metadata.get('published_date'):
+        lines.append(('published_date', metadata['published_date']))
+
+    # description
+    if metadata.get('description'):
+        lines.append(('description', metadata['description']))
+
+    # language
+    if metadata.get('language'):
+        lines.append(('language', metadata['language']))
+
+    # genre
+    if metadata.get('genre'):
+        lines.append(('genre', metadata['genre']))
+
+    # Split info (always included)
+    lines.append(('chapter_number', chapter_num))
+    lines.append(('chapter_title', chapter_title))
+    lines.append(('total_chapters', total_chapters))
+    lines.append(('split_index', split_index))
+    if start_page is not None:
+        lines.append(('start_page', start_page))
+        lines.append(('end_page', end_page))
+    if text_stats is not None:
+        lines.append(('text_chars', text_stats[0]))
+        lines.append(('text_tokens', text_stats[1]))
+
+    # sections: titles of merged sections (only for merged chunks)
+    if sections:
+        lines.append(('sections', list(sections)))
+
+    return dict(lines)
+
+
+def format_metadata_yaml(data):
+    """Format a chunk_metadata() dict as a YAML document."""
+    # Write YAML manually (avoid PyYAML dependency)
+    out = ['---']
+    for key, value in data.items():
+        if isinstance(value, list):
+            out.append(f'{key}:')
+            out.extend(f'  - {_yaml_scalar(item)}' for item in value)
+        else:
+            out.append(f'{key}: {_yaml_scalar(value)}')
+    out.append('---')
+    return '\n'.join(out) + '\n'
+
+
+def archive_index(source_name, plan, names):
+    """
+    Index member of an output archive: every chunk's member names and page
+    ranges (1-based, inclusive). It is written first, before any member
+    offsets are known; with zip the members it names can then be read
+    directly through the central directory, while tar is read sequentially.
+    """
+    chunks = []
+    for r, name in zip(plan, names):
+        chunks.append({
+            'pdf': name,
+            'yaml': str(Path(name).with_suffix('.yaml')),
+            'start_page': r.start + 1,
+            'end_page': r.end + 1,
+            'title': r.title,
+            'chapter_number': r.chapter_num,
+            'chapter_title': r.chapter_title,
+            'sections': list(r.sections),
+        })
+    index = {
+        'version': ARCHIVE_INDEX_VERSION,
+        'source': source_name,
+        'total_chapters': plan.total_chapters,
+        'chunks': chunks,
+    }
+    return json.dumps(index, ensure_ascii=False, indent=1).encode('utf-8')
+
+
+def write_metadata_yaml(pdf_path, metadata, split_index, total_splits,
+                        chapter_num, chapter_title, total_chapters, sections=(),
+                        start_page=None, end_page=None, text_stats=None):
+    """Write YAML metadata file for a split PDF."""
+    yaml_path = pdf_path.with_suffix('.yaml')
+    data = chunk_metadata(metadata, split_index, chapter_num, chapter_title, total_chapters,
+                          sections, start_page, end_page, text_stats)
+
+    tmp_path = f"{yaml_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(format_metadata_yaml(data))
+    os.replace(tmp_path, yaml_path)
+
+    logging.info(f"Created metadata: {yaml_path.name}")
+
+
+class PdfSplitter:
+    """
+    Handles splitting large PDFs by bookmarks or page ranges.
+
+    The source is a path, or the PDF itself as bytes or a binary file-like
+    object (read into memory). For in-memory sources, `name` (default: the
+    file object's name, else 'document.pdf') is used in logs and metrics.
+    """
+
+    def __init__(self, pdf_path, metadata=None, workers=1, optimize='none',
+                 subset_fonts=False, report_savings=False, max_chunk_bytes=None,
+                 merge_pages=None, merge_bytes=None, plan_cache_dir=None, source_hash=None,
+                 metrics=None, max_memory=None, name=None, archive=None, image_dpi=None,
+                 image_quality=None, grayscale_images=False, extract_text=False, verify=True,
+                 checksums=False):
+        if optimize not in OPTIMIZE_PROFILES:
+            raise ValueError(f"Unknown optimize profile: {optimize}")
+        if archive not in (None,) + ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format: {archive}")
+        self._source_bytes = None
+        if isinstance(pdf_path, (bytes, bytearray, memoryview)):
+            self._source_bytes = bytes(pdf_path)
+            pdf_path = name or 'document.pdf'
+        elif hasattr(pdf_path, 'read'):
+            file_name = getattr(pdf_path, 'name', None)
+            self._source_bytes = pdf_path.read()
+            pdf_path = name or (Path(file_name).name if isinstance(file_name, str)
+                                else 'document.pdf')
+        self.pdf_path = Path(pdf_path)
+        self._doc = None
+        self.metadata = metadata or {}
+        self.workers = max(1, workers)
+        self.optimize = optimize
+        self.subset_fonts = subset_fonts
+        self.report_savings = report_savings
+        self.max_chunk_bytes = max_chunk_bytes
+        self.merge_pages = merge_pages
+        self.merge_bytes = merge_bytes
+        self.plan_cache_dir = Path(plan_cache_dir) if plan_cache_dir else None
+        self._source_hash = source_hash
+        # Bounded-memory mode: RSS ceiling (bytes) above which the source is reopened
+        self.max_memory = max_memory
+        # 'zip' or 'tar': write each book into one archive instead of separate files
+        self.archive = archive
+        # Image rewriting; see _rewrite_images()
+        self.image_dpi = image_dpi
+        self.image_quality = image_quality
+        self.grayscale_images = grayscale_images
+        self._rewritten_source = None  # Path of the rewritten copy, removed by close()
+        self._image_savings = None  # xref -> bytes saved
+        self._page_images = {}      # page number -> image xrefs
+        # Write a .jsonl text sidecar per chunk; (chars, tokens) of each chunk's text
+        self.extract_text = extract_text
+        self.text_stats = []
+        # Check plans and written chunks' page counts (see _verify_plan()); with
+        # checksums, also record each chunk's SHA-256 (chunk name -> hex digest)
+        self.verify = verify
+        self.record_checksums = checksums
+        self.checksums = {}
+        # Final RangePlan of the last _save_ranges() call
+        self.plan = None
+        self._page_sizes = {}
+        self._stream_sizes = {}
+        # Stage timings and per-chunk stats (see BookMetrics)
+        self.metrics = metrics or BookMetrics(self.pdf_path.name)
+
+    @property
+    def doc(self):
+        """The source document, opened on first use."""
+        if self._doc is None:
+            with self.metrics.stage('open'):
+                self._doc = _open_source(self._source)
+            self.metrics.pages = self._doc.page_count
+        return self._doc
+
+    @property
+    def source_hash(self):
+        """SHA-256 of the source file (computed on first use unless given)."""
+        if self._source_hash is None:
+            with self.metrics.stage('hash'):
+                if self._source_bytes is not None:
+                    self._source_hash = hashlib.sha256(self._source_bytes).hexdigest()
+                else:
+                    self._source_hash = sha256_file(self.pdf_path)
+        return self._source_hash
+
+    @property
+    def _source(self):
+        """
+        What _open_source() takes: the path of the source with rewritten
+        images, the in-memory PDF, or the path as a string.
+        """
+        if self._rewritten_source is not None:
+            return self._rewritten_source
+        return self._source_bytes if self._source_bytes is not None else str(self.pdf_path)
+
+    @property
+    def source_size(self):
+        if self._source_bytes is not None:
+            return len(self._source_bytes)
+        return self.pdf_path.stat().st_size
+
+    @property
+    def total_chapters(self):
+        return self.plan.total_chapters if self.plan else 0
+
+    @property
+    def output_options(self):
+        """Options that affect the output files (recorded in the manifest)."""
+        return {key: getattr(self, key) for key in OUTPUT_OPTION_DEFAULTS}
+
+    @property
+    def _write_options(self):
+        return {'optimize': self.optimize, 'subset_fonts': self.subset_fonts,
+                'measure_baseline': self.report_savings, 'verify': self.verify}
+
+    @property
+    def page_count(self):
+        return self.doc.page_count
+
+    def split_smart(self, output_dir):
+        """
+        Smart split based on document structure:
+        - L3 = Section (Primary split)
+        - L2 = Chapter (Fallback if no sections exist)
+
+        Returns list of paths to the split PDF files, or None if the
+        document has no usable bookmarks.
+        """
+        plan = self.plan_smart()
+        if plan is None:
+            return None
+        return self._save_ranges(plan, output_dir)
+
+    def plan_smart(self):
+        """
+        Plan a smart split (see RangePlan.from_toc), including merging and
+        --max-chunk-bytes sub-splitting.
+
+        With plan_cache_dir set, plans are cached on disk keyed by the source
+        file hash and the planning options, so re-runs that change only
+        output settings or metadata never re-read the TOC or re-plan.
+
+        Returns a RangePlan, or None if the document has no usable bookmarks.
+        """
+        cache_path = self._plan_cache_path()
+        if cache_path is not None:
+            with self.metrics.stage('plan'):
+                cached = load_json(cache_path)
+            if cached is not None:
+                if cached.get('empty'):
+                    return None
+                plan = RangePlan.from_dict(cached)
+                if plan is not None:
+                    logging.info(f"Using cached range plan ({len(plan)} chunks)")
+                    return plan
+
+        doc = self.doc
+        with self.metrics.stage('plan'):
+            plan = RangePlan.from_toc(doc.get_toc(), doc.page_count)
+            if plan is not None:
+                plan = self._finalize_plan(plan)
+
+            if cache_path is not None:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                write_json_atomic(cache_path, plan.to_dict() if plan else {'empty': True})
+        return plan
+
+    def _plan_cache_path(self):
+        """Plan cache file for this source and planning options, or None if disabled."""
+        if self.plan_cache_dir is None:
+            return None
+        options = json.dumps([RangePlan.VERSION, self.max_chunk_bytes,
+                              self.merge_pages, self.merge_bytes])
+        digest = hashlib.sha1(options.encode('utf-8')).hexdigest()[:12]
+        return self.plan_cache_dir / f"{self.source_hash}_{digest}.json"
+
+    def _finalize_plan(self, plan):
+        """Apply section merging and --max-chunk-bytes sub-splitting to a plan."""
+        ranges = plan.ranges
+        if self.merge_pages or self.merge_bytes:
+            ranges = self._merge_small_ranges(ranges)
+        if self.max_chunk_bytes:
+            ranges = self._enforce_max_chunk_bytes(ranges)
+        return plan.replace_ranges(ranges)
+
+    def _add_forced_splits(self, range_list, start, end, base_title, limit,
+                           chapter_num=None, chapter_title=None, by_bytes=False):
+        """
+        Force split large sections into smaller chunks.
+
+        limit is the maximum number of pages per part, or with by_bytes=True
+        the maximum estimated output bytes per part (see _estimate_page_bytes).
+        """
+        if by_bytes:
+            bounds = self._byte_bounded_parts(start, end, limit)
+        else:
+            bounds = []
+            current = start
+            while current <= end:
+                next_split = min(current + limit - 1, end)
+                bounds.append((current, next_split))
+                current = next_split + 1
+
+        for part, (part_start, part_end) in enumerate(bounds, 1):
+            title = f"{base_title}_part{part}"
+            if chapter_num is None:
+                range_list.append((part_start, part_end, title))
+            else:
+                range_list.append((part_start, part_end, title, chapter_num, chapter_title))
+
+    def _stream_bytes(self, xref):
+        """Return the stored (compressed) length of a stream object, cached."""
+        if xref not in self._stream_sizes:
+            size = 0
+            try:
+                kind, value = self.doc.xref_get_key(xref, "Length")
+                if kind == 'int':
+                    size = int(value)
+                elif kind == 'xref':
+                    size = int(self.doc.xref_object(int(value.split()[0])).strip())
+                else:
+                    size = len(self.doc.xref_stream_raw(xref) or b'')
+            except (ValueError, RuntimeError):
+                size = 0
+            self._stream_sizes[xref] = size
+        return self._stream_sizes[xref]
+
+    def _font_bytes(self, xref):
+        """Return the size of an embedded font program (0 if not embedded)."""
+        key = ('font', xref)
+        if key not in self._stream_sizes:
+            size = 0
+            font_xref = xref
+            kind, value = self.doc.xref_get_key(xref, "DescendantFonts")
+            if kind == 'array':
+                ref = value.strip('[] ').split()
+                if ref:
+                    font_xref = int(ref[0])
+            elif kind == 'xref':
+                font_xref = int(value.split()[0])
+            kind, value = self.doc.xref_get_key(font_xref, "FontDescriptor")
+            if kind == 'xref':
+                descriptor = int(value.split()[0])
+                for file_key in ("FontFile", "FontFile2", "FontFile3"):
+                    kind, value = self.doc.xref_get_key(descriptor, file_key)
+                    if kind == 'xref':
+                        size = self._stream_bytes(int(value.split()[0]))
+                        break
+            self._stream_sizes[key] = size
+        return self._stream_sizes[key]
+
+    def _estimate_page_bytes(self, pno):
+        """
+        Estimate the output size contribution of a page without writing it.
+
+        Returns (own_bytes, shared) where own_bytes covers the page's content
+        streams and object overhead, and shared maps resource keys (images,
+        soft masks, fonts) to their sizes. Shared resources are copied once
+        per chunk, so they count once no matter how many pages use them.
+        """
+        if pno not in self._page_sizes:
+            page = self.doc[pno]
+            own = PAGE_OVERHEAD_BYTES + sum(self._stream_bytes(x) for x in page.get_contents())
+            shared = {}
+            for img in page.get_images(full=True):
+                for xref in (img[0], img[1]):
+                    if xref:
+                        shared[xref] = self._stream_bytes(xref)
+            for font in page.get_fonts(full=True):
+                shared[('font', font[0])] = self._font_bytes(font[0])
+            self._page_sizes[pno] = (own, shared)
+        return self._page_sizes[pno]
+
+    def _byte_bounded_parts(self, start, end, limit):
+        """
+        Greedily cut pages start..end into parts of at most `limit` estimated bytes.
+
+        Single pass over the pages: a page is added to the current part unless
+        that would push the estimate over the limit, in which case a new part
+        starts. A single page larger than the limit becomes its own part.
+        """
+        bounds = []
+        part_start = start
+        part_bytes = CHUNK_OVERHEAD_BYTES
+        seen = set()
+        for pno in range(start, end + 1):
+            added = self._added_bytes(pno, pno, seen)
+            if pno > part_start and part_bytes + added > limit:
+                bounds.append((part_start, pno - 1))
+                part_start = pno
+                part_bytes = CHUNK_OVERHEAD_BYTES
+                seen = set()
+                added = self._added_bytes(pno, pno, seen)
+            part_bytes += added
+            seen.update(self._estimate_page_bytes(pno)[1])
+            if pno == part_start and part_bytes > limit:
+                logging.warning(f"Page {pno + 1} alone is estimated at {part_bytes} bytes, "
+                                f"over the {limit}-byte chunk limit")
+        bounds.append((part_start, end))
+        return bounds
+
+    def _added_bytes(self, start, end, seen):
+        """
+        Estimate the bytes pages start..end add to a chunk that already holds
+        the shared resources in `seen` (not modified).
+        """
+        total = 0
+        new = {}
+        for pno in range(start, end + 1):
+            own, shared = self._estimate_page_bytes(pno)
+            total += own
+            new.update((key, size) for key, size in shared.items() if key not in seen)
+        return total + sum(new.values())
+
+    def estimate_range_bytes(self, start, end):
+        """Estimate the unoptimized output size of pages start..end."""
+        total = CHUNK_OVERHEAD_BYTES
+        seen = {}
+        for pno in range(start, end + 1):
+            own, shared = self._estimate_page_bytes(pno)
+            total += own
+            seen.update(shared)
+        return total + sum(seen.values())
+
+    def _enforce_max_chunk_bytes(self, ranges):
+        """Sub-split any range whose estimated size exceeds max_chunk_bytes."""
+        result = []
+        for r in ranges:
+            if self.estimate_range_bytes(r.start, r.end) <= self.max_chunk_bytes:
+                result.append(r)
+            else:
+                parts = []
+                self._add_forced_splits(parts, r.start, r.end, r.title, self.max_chunk_bytes,
+                                        r.chapter_num, r.chapter_title, by_bytes=True)
+                result.extend(SplitRange(*part) for part in parts)
+                logging.info(f"Range '{r.title}' (Pages {r.start + 1}-{r.end + 1}) exceeds "
+                             f"{self.max_chunk_bytes} bytes; split into {len(parts)} parts")
+        return result
+
+    def _merge_small_ranges(self, ranges):
+        """
+        Merge neighbouring ranges of the same chapter into balanced chunks.
+
+        Linear packing pass: consecutive ranges are added to the current group
+        as long as it stays within merge_pages pages and merge_bytes estimated
+        bytes; a range that would push it past either target starts a new
+        group (a range over the target on its own stays a chunk by itself).
+        A range is never merged across a chapter boundary, across a page gap,
+        or if the merged chunk would exceed max_chunk_bytes.
+        """
+        def close_group(group):
+            if len(group) == 1:
+                merged.append(group[0])
+                return
+            first, last = group[0], group[-1]
+            merged.append(SplitRange(
+                first.start, last.end, f"{first.title}~{last.title}",
+                first.chapter_num, first.chapter_title,
+                tuple(t for r in group for t in (r.sections or (r.title,)))))
+
+        def exceeds_target(pages, size):
+            return ((self.merge_pages and pages > self.merge_pages) or
+                    (self.merge_bytes and size > self.merge_bytes))
+
+        track_bytes = bool(self.merge_bytes or self.max_chunk_bytes)
+        merged = []
+        group = []
+        group_bytes = 0
+        seen = set()
+        for r in ranges:
+            if group:
+                prev = group[-1]
+                pages = r.end - group[0].start + 1
+                added = self._added_bytes(r.start, r.end, seen) if track_bytes else 0
+                can_merge = (r.chapter_num == prev.chapter_num and r.start == prev.end + 1
+                             and not exceeds_target(pages, group_bytes + added)
+                             and not (self.max_chunk_bytes
+                                      and group_bytes + added > self.max_chunk_bytes))
+                if can_merge:
+                    group.append(r)
+                    group_bytes += added
+                    if track_bytes:
+                        seen.update(*(self._estimate_page_bytes(p)[1]
+                                      for p in range(r.start, r.end + 1)))
+                    continue
+                close_group(group)
+
+            group = [r]
+            seen = set()
+            group_bytes = CHUNK_OVERHEAD_BYTES
+            if track_bytes:
+                group_bytes += self._added_bytes(r.start, r.end, seen)
+                seen.update(*(self._estimate_page_bytes(p)[1]
+                              for p in range(r.start, r.end + 1)))
+        if group:
+            close_group(group)
+
+        if len(merged) < len(ranges):
+            logging.info(f"Merged {len(ranges)} ranges into {len(merged)} chunks")
+        return merged
 
     def split_by_bookmarks(self, output_dir):
         """Split PDF by bookmarks (alias for split_smart)."""
@@ -171,7 +1403,8 @@ class PdfSplitter:
             ranges.append((start - 1, end - 1, f"Part_{start}-{end}", part_num, f"Part {start}-{end}"))
 
         total_parts = len(ranges)
-        return self._save_ranges(ranges, output_dir, total_parts)
+        # Manual ranges may leave pages out or repeat them on purpose
+        return self._save_ranges(ranges, output_dir, total_parts, partial=True)
 
     def split_by_pages(self, pages_per_chunk, output_dir):
         """
@@ -195,108 +1428,593 @@ class PdfSplitter:
         total_parts = len(ranges)
         return self._save_ranges(ranges, output_dir, total_parts)
 
-    def _save_ranges(self, ranges, output_dir, total_chapters=0):
-        """Save page ranges as separate PDF files with YAML metadata."""
-        files = []
+    def iter_chunks(self, ranges=None, total_chapters=0):
+        """
+        Yield (SplitRange, metadata dict, PDF bytes) for each chunk, in order.
+
+        Nothing is written to disk and only one chunk's bytes are built at a
+        time, so chunks can be streamed straight to object storage. The
+        metadata dict holds what the YAML sidecar would (see chunk_metadata())
+        and the bytes are identical to the files _save_ranges() writes.
+
+        ranges is a RangePlan or a list of range tuples (as for _save_ranges();
+        given ranges need not cover every page); by default the smart plan is
+        used, and nothing is yielded if the document has no usable bookmarks.
+        """
+        if ranges is None:
+            plan = self.plan_smart()
+            if plan is None:
+                return
+        elif isinstance(ranges, RangePlan):
+            plan = ranges
+        else:
+            plan = self._finalize_plan(RangePlan(ranges, total_chapters, self.page_count))
+        self._verify_plan(plan, partial=ranges is not None)
+        self.plan = plan
+
+        for i, r, name, data, stats in self._iter_chunk_bytes(plan):
+            metadata = chunk_metadata(self.metadata, i + 1, r.chapter_num, r.chapter_title,
+                                      plan.total_chapters, r.sections, r.start + 1, r.end + 1)
+            yield r, metadata, data
+
+    def _iter_chunk_bytes(self, plan):
+        """
+        Yield (index, SplitRange, file name, PDF bytes, ChunkStats) for each range of plan.
+
+        With record_checksums, self.checksums is complete once the generator
+        is exhausted.
+        """
+        self._rewrite_images()  # Rewritten copy in the system temp directory
+        self.checksums = {}
+        hasher = BackgroundHasher() if self.record_checksums else None
+        try:
+            for i, r in enumerate(plan.ranges):
+                name = _chunk_filename(i + 1, r.title)
+                data, stats = _chunk_bytes(self.doc, r.start, r.end, name, **self._write_options)
+                rss = _over_memory_limit(self.max_memory)
+                if rss is not None:
+                    self._close_doc()  # Reopened lazily by the next chunk
+                    stats = stats._replace(reopened_at=rss)
+                self._record_chunk(name, r, stats)
+                if hasher is not None:
+                    hasher.add(name, data=data)
+                yield i, r, name, data, stats
+            self._collect_checksums(hasher)
+        finally:
+            if hasher is not None:
+                hasher.close()
+
+    def _record_chunk(self, name, r, stats):
+        """Add a written chunk to the metrics (and its checksum, if a worker computed it)."""
+        self.metrics.add_chunk(name, r.end - r.start + 1, stats.size,
+                               stats.insert_seconds, stats.save_seconds)
+        if self.verify or stats.sha256 is not None:
+            self.metrics.add_stage('verify', stats.verify_seconds)
+        if stats.sha256 is not None:
+            self.checksums[name] = stats.sha256
+
+    def _collect_checksums(self, hasher):
+        """Wait for a BackgroundHasher and add its checksums; the wait counts as 'verify'."""
+        if hasher is not None:
+            with self.metrics.stage('verify'):
+                self.checksums.update(hasher.results())
+
+    def _verify_plan(self, plan, partial=False):
+        """
+        Check that plan's ranges lie within the document and tile its pages
+        0..page_count-1 with no gaps or overlaps (out-of-order or dangling
+        bookmarks would otherwise drop or repeat pages silently). With
+        partial (user-given ranges), gaps and overlaps are only logged.
+
+        Raises SplitVerificationError; no-op unless verify is set.
+        """
+        if not self.verify:
+            return
+        with self.metrics.stage('verify'):
+            problems = plan.range_problems()
+            tiling = plan.tiling_problems()
+        if partial:
+            for problem in tiling:
+                logging.warning(f"Split ranges: {problem}")
+        else:
+            problems += tiling
+        if problems:
+            shown = "; ".join(problems[:5])
+            more = f" (and {len(problems) - 5} more)" if len(problems) > 5 else ""
+            raise SplitVerificationError(f"Range plan does not cover the {plan.page_count} "
+                                         f"page(s) exactly: {shown}{more}")
+
+    def _save_ranges(self, ranges, output_dir, total_chapters=0, partial=False):
+        """
+        Save page ranges as separate PDF files with YAML metadata.
+
+        ranges is either a finalized RangePlan or a list of range tuples,
+        which is merged/sub-split according to the splitter's options first.
+        With verify, the plan must tile the document's pages exactly (unless
+        partial, for user-given ranges) and every chunk's page count is
+        checked as it is written (see _verify_plan() and _verify_chunk()).
+
+        With workers > 1 the ranges are partitioned across worker processes,
+        each writing its share from its own handle on the source. Filenames,
+        numbering, sidecars and PDF bytes are identical to the serial path.
+
+        With extract_text, each range's text is extracted in background
+        processes while the chunks are written (see TextExtraction).
+        """
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
 
+        if isinstance(ranges, RangePlan):
+            plan = ranges
+        else:
+            plan = self._finalize_plan(RangePlan(ranges, total_chapters, self.page_count))
+        self._verify_plan(plan, partial)
+        self.plan = plan
+        self._rewrite_images(output_dir)
+
+        self.text_stats = []
+        text = None
+        if self.extract_text:
+            text = TextExtraction(self._source, plan, self.workers, self.max_memory)
+        try:
+            if self.archive:
+                return [self._save_archive(plan, output_dir, text)]
+            return self._save_files(plan, output_dir, text)
+        finally:
+            if text is not None:
+                text.close()
+                self.metrics.add_worker_peak(text.peak_rss_bytes)
+
+    def _write_text_sidecar(self, text, i, r, write):
+        """Format the i-th chunk's text sidecar and pass it to write(); returns (chars, tokens)."""
+        with self.metrics.stage('text'):
+            sidecar, text_stats = format_text_sidecar(r.start + 1, text.pages(i))
+            write(sidecar)
+        self.text_stats.append(list(text_stats))
+        return text_stats
+
+    def _save_files(self, plan, output_dir, text=None):
+        """
+        Write each range of plan as a chunk PDF with its sidecars; returns the PDF paths.
+
+        With record_checksums, chunk workers hash their own chunks; serially,
+        each chunk is hashed in a background thread while the next is written.
+        """
+        files = []
+        ranges = plan.ranges
+        total_chapters = plan.total_chapters
         total_splits = len(ranges)
 
-        for i, range_data in enumerate(ranges):
-            # Unpack range data (backward compatible)
-            if len(range_data) == 3:
-                start, end, title = range_data
-                chapter_num, chapter_title = i + 1, title
-            else:
-                start, end, title, chapter_num, chapter_title = range_data
+        paths = []
+        for i, r in enumerate(ranges):
+            paths.append(output_dir / _chunk_filename(i + 1, r.title))
+
+        parallel = self.workers > 1 and len(ranges) > 1
+        if parallel:
+            results = self._write_chunks_parallel(
+                [(r.start, r.end, fpath) for r, fpath in zip(ranges, paths)])
+
+        total_bytes = 0
+        baseline_bytes = 0
+        reopened = []
+        self.checksums = {}
+        hasher = BackgroundHasher() if self.record_checksums and not parallel else None
+        try:
+            for i, (r, fpath) in enumerate(zip(ranges, paths)):
+                if parallel:
+                    stats = results[i]
+                else:
+                    stats = _write_chunk(self.doc, r.start, r.end, fpath, **self._write_options)
+                    rss = _over_memory_limit(self.max_memory)
+                    if rss is not None:
+                        self._close_doc()  # Reopened lazily by the next chunk
+                        stats = stats._replace(reopened_at=rss)
+                    if hasher is not None:
+                        hasher.add(fpath.name, path=fpath)
+                if stats.reopened_at is not None:
+                    reopened.append(stats.reopened_at)
+                total_bytes += stats.size
+                baseline_bytes += stats.baseline or 0
+                files.append(fpath)
+                self._record_chunk(fpath.name, r, stats)
+
+                text_stats = None
+                if text is not None:
+                    text_stats = self._write_text_sidecar(
+                        text, i, r,
+                        lambda data: write_text_atomic(fpath.with_suffix('.jsonl'), data))
+
+                # Generate YAML metadata file
+                with self.metrics.stage('yaml'):
+                    self._write_metadata_yaml(
+                        fpath, i + 1, total_splits, r.chapter_num, r.chapter_title,
+                        total_chapters, sections=r.sections, start_page=r.start + 1,
+                        end_page=r.end + 1, text_stats=text_stats
+                    )
+
+                logging.info(f"Created chunk: {fpath.name} (Pages {r.start + 1}-{r.end + 1}"
+                             f"{self._image_savings_note(r, stats.size)})")
+            self._collect_checksums(hasher)
+        finally:
+            if hasher is not None:
+                hasher.close()
+
+        self._log_reopens(reopened)
+        self._log_output_size(total_bytes, baseline_bytes)
+        return files
 
-            new_doc = fitz.open()
-            new_doc.insert_pdf(self.doc, from_page=start, to_page=end)
+    def _save_archive(self, plan, output_dir, text=None):
+        """
+        Stream every chunk and sidecar of plan into output_dir/<stem>.<zip|tar>.
 
-            safe_title = clean_filename(title)[:50]
-            fname = f"{i+1:03d}_{safe_title}.pdf"
-            fpath = output_dir / fname
+        The index member (see archive_index()) is written first, then each
+        chunk PDF followed by its text sidecar (with a TextExtraction) and
+        YAML sidecar as it is produced. Chunks are
+        built one at a time in this process (chunk workers are not used).
 
-            new_doc.save(fpath)
-            new_doc.close()
-            files.append(fpath)
+        Returns the archive path.
+        """
+        archive_path = output_dir / f"{self.pdf_path.stem}.{self.archive}"
+        names = [_chunk_filename(i + 1, r.title) for i, r in enumerate(plan)]
+        if self.workers > 1:
+            logging.info("Writing archive serially; --chunk-workers is not used with --archive")
+
+        total_bytes = 0
+        baseline_bytes = 0
+        reopened = []
+        writer = ArchiveWriter(archive_path, self.archive)
+        try:
+            writer.add(ARCHIVE_INDEX, archive_index(self.pdf_path.name, plan, names))
+            for i, r, name, data, stats in self._iter_chunk_bytes(plan):
+                writer.add(name, data)
+                total_bytes += stats.size
+                baseline_bytes += stats.baseline or 0
+                if stats.reopened_at is not None:
+                    reopened.append(stats.reopened_at)
+                text_stats = None
+                if text is not None:
+                    text_name = str(Path(name).with_suffix('.jsonl'))
+                    text_stats = self._write_text_sidecar(
+                        text, i, r, lambda data: writer.add(text_name, data.encode('utf-8')))
+                with self.metrics.stage('yaml'):
+                    metadata = chunk_metadata(self.metadata, i + 1, r.chapter_num,
+                                              r.chapter_title, plan.total_chapters, r.sections,
+                                              r.start + 1, r.end + 1, text_stats)
+                    writer.add(str(Path(name).with_suffix('.yaml')),
+                               format_metadata_yaml(metadata).encode('utf-8'))
+                logging.info(f"Added chunk: {name} (Pages {r.start + 1}-{r.end + 1}"
+                             f"{self._image_savings_note(r, stats.size)})")
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+
+        logging.info(f"Created archive: {archive_path.name} ({len(names)} chunk(s))")
+        self._log_reopens(reopened)
+        self._log_output_size(total_bytes, baseline_bytes)
+        return archive_path
+
+    def _log_reopens(self, reopened):
+        """Log how often bounded-memory mode reopened the source."""
+        if reopened:
+            logging.info(f"Reopened source {len(reopened)} time(s) to stay under --max-memory "
+                         f"(peak RSS before reopening: {max(reopened) / 1024 / 1024:.0f} MB)")
+
+    def _log_output_size(self, total_bytes, baseline_bytes):
+        """Log total output size, amplification and (optionally) bytes saved."""
+        source_bytes = self.source_size
+        amplification = total_bytes / source_bytes if source_bytes else 0
+        msg = (f"Output size: {total_bytes / 1024 / 1024:.2f} MB "
+               f"({amplification:.2f}x source, profile '{self.optimize}')")
+        if self.report_savings and baseline_bytes:
+            saved = baseline_bytes - total_bytes
+            msg += (f". Saved {saved / 1024 / 1024:.2f} MB "
+                    f"({saved / baseline_bytes * 100:.1f}%) vs. unoptimized output")
+        logging.info(msg)
+
+    def _write_chunks_parallel(self, jobs):
+        """
+        Write chunk PDFs in worker processes, one contiguous share each.
 
-            # Generate YAML metadata file
-            self._write_metadata_yaml(
-                fpath, i + 1, total_splits, chapter_num, chapter_title, total_chapters
-            )
+        Returns the ChunkStats from _write_chunk() in job order.
+        """
+        groups = _partition_jobs(jobs, self.workers)
+        logging.info(f"Writing {len(jobs)} chunks with {len(groups)} workers")
+        results = []
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=len(groups),
+                                 initializer=init_worker_logging) as executor:
+            futures = [executor.submit(_write_chunks_worker, self._source, group,
+                                       self._write_options, self.max_memory,
+                                       self.record_checksums)
+                       for group in groups]
+            for future in futures:
+                chunk_results, peak, records = future.result()
+                replay_log_records(records)
+                results.extend(chunk_results)
+                self.metrics.add_worker_peak(peak)
+        return results
 
-            logging.info(f"Created chunk: {fname} (Pages {start + 1}-{end + 1})")
+    @property
+    def _rewrites_images(self):
+        return bool(self.image_dpi or self.image_quality or self.grayscale_images)
 
-        return files
+    def _rewrite_images(self, work_dir=None):
+        """
+        Re-encode the source's images once per book, before any chunk is built.
+
+        Every page's image placements are scanned for each image xref's highest
+        effective resolution; each unique xref is then re-encoded once (by
+        `workers` processes in parallel) and replaced in the source, which is
+        saved to a temp file in work_dir (default: the system temp directory)
+        so chunk workers and bounded-memory reopens see the rewritten images
+        without holding the book in memory. close() removes the file. No-op
+        unless an image option is set.
+        """
+        if not self._rewrites_images or self._image_savings is not None:
+            return
+        doc = self.doc
+        with self.metrics.stage('images'):
+            dpis = {}
+            for pno in range(doc.page_count):
+                xrefs = set()
+                page = doc[pno]
+                # get_image_bbox() only parses the content stream; get_image_info()
+                # would decode every image
+                for item in page.get_images(full=True):
+                    xref, width, height = item[0], item[2], item[3]
+                    bbox = page.get_image_bbox(item)
+                    if bbox.is_empty or bbox.is_infinite:
+                        continue  # not placed on this page
+                    dpi = max(width * 72 / bbox.width, height * 72 / bbox.height)
+                    dpis[xref] = max(dpis.get(xref, 0), dpi)
+                    xrefs.add(xref)
+                self._page_images[pno] = xrefs
+            jobs = [(xref, dpi) for xref, dpi in dpis.items() if _is_rewritable_image(doc, xref)]
+
+            image_options = {'image_dpi': self.image_dpi, 'image_quality': self.image_quality,
+                             'grayscale_images': self.grayscale_images}
+            parts = min(self.workers, len(jobs))
+            if parts > 1:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=parts,
+                                         initializer=init_worker_logging) as executor:
+                    futures = [executor.submit(_rewrite_images_worker, self._source,
+                                               jobs[i::parts], image_options)
+                               for i in range(parts)]
+                    results = []
+                    for future in futures:
+                        worker_results, peak, records = future.result()
+                        replay_log_records(records)
+                        results.extend(worker_results)
+                        self.metrics.add_worker_peak(peak)
+            else:
+                results = _rewrite_images_in(doc, jobs, image_options)
+
+            self._image_savings = {}
+            for xref, data, width, height, gray, old_size in results:
+                doc.update_stream(xref, data, compress=0)
+                doc.xref_set_key(xref, 'Filter', '/DCTDecode')
+                doc.xref_set_key(xref, 'DecodeParms', 'null')
+                doc.xref_set_key(xref, 'Decode', 'null')
+                doc.xref_set_key(xref, 'Width', str(width))
+                doc.xref_set_key(xref, 'Height', str(height))
+                doc.xref_set_key(xref, 'ColorSpace', '/DeviceGray' if gray else '/DeviceRGB')
+                doc.xref_set_key(xref, 'BitsPerComponent', '8')
+                self._image_savings[xref] = old_size - len(data)
+            if results:
+                fd, path = tempfile.mkstemp(prefix=REWRITTEN_SOURCE_PREFIX, suffix='.tmp',
+                                            dir=work_dir)
+                os.close(fd)
+                try:
+                    doc.save(path)
+                except BaseException:
+                    os.remove(path)
+                    raise
+                self._rewritten_source = path
+                self._close_doc()  # Reopened from the rewritten copy on next use
+
+        saved = sum(self._image_savings.values())
+        logging.info(f"Rewrote {len(results)} of {len(dpis)} image(s) "
+                     f"({saved / 1024 / 1024:.2f} MB saved)")
+
+    def _image_savings_note(self, r, size):
+        """Size reduction from image rewriting for a chunk's log line ('' if none)."""
+        if not self._image_savings:
+            return ''
+        xrefs = set().union(*(self._page_images.get(pno, ()) for pno in range(r.start, r.end + 1)))
+        saved = sum(self._image_savings.get(xref, 0) for xref in xrefs)
+        if not saved:
+            return ''
+        before = size + saved
+        return (f"; {before / 1024 / 1024:.2f} -> {size / 1024 / 1024:.2f} MB, "
+                f"-{saved / before * 100:.0f}% from images")
 
     def _write_metadata_yaml(self, pdf_path, split_index, total_splits,
-                              chapter_num, chapter_title, total_chapters):
+                              chapter_num, chapter_title, total_chapters, sections=(),
+                              start_page=None, end_page=None, text_stats=None):
         """Write YAML metadata file for a split PDF."""
-        yaml_path = pdf_path.with_suffix('.yaml')
-
-        # Build metadata dict with only specified values
-        # Use ordered insertion for consistent output
-        lines = []
-
-        # parent_document: タイトル（APIから取得またはCLIで指定）
-        if self.metadata.get('parent_document'):
-            lines.append(('parent_document', self.metadata['parent_document']))
-
-        # isbn
-        if self.metadata.get('isbn'):
-            lines.append(('isbn', self.metadata['isbn']))
-
-        # author
-        if self.metadata.get('author'):
-            lines.append(('author', self.metadata['author']))
-
-        # publisher
-        if self.metadata.get('publisher'):
-            lines.append(('publisher', self.metadata['publisher']))
-
-        # published_date
-        if self.metadata.get('published_date'):
-            lines.append(('published_date', self.metadata['published_date']))
-
-        # description
-        if self.metadata.get('description'):
-            lines.append(('description', self.metadata['description']))
-
-        # language
-        if self.metadata.get('language'):
-            lines.append(('language', self.metadata['language']))
-
-        # genre
-        if self.metadata.get('genre'):
-            lines.append(('genre', self.metadata['genre']))
-
-        # Split info (always included)
-        lines.append(('chapter_number', chapter_num))
-        lines.append(('chapter_title', chapter_title))
-        lines.append(('total_chapters', total_chapters))
-        lines.append(('split_index', split_index))
-
-        # Write YAML manually (avoid PyYAML dependency)
-        with open(yaml_path, 'w', encoding='utf-8') as f:
-            f.write('---\n')
-            for key, value in lines:
-                # Handle special characters in values
-                if isinstance(value, str) and any(c in value for c in ':#{}[]&*?|-<>=!%@\\'):
-                    f.write(f'{key}: "{value}"\n')
-                else:
-                    f.write(f'{key}: {value}\n')
-            f.write('---\n')
+        write_metadata_yaml(pdf_path, self.metadata, split_index, total_splits,
+                            chapter_num, chapter_title, total_chapters, sections,
+                            start_page, end_page, text_stats)
 
-        logging.info(f"Created metadata: {yaml_path.name}")
+    def _close_doc(self):
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
 
     def close(self):
-        """Close the PDF document."""
-        self.doc.close()
+        """Close the PDF document and remove the source copy with rewritten images."""
+        self._close_doc()
+        if self._rewritten_source is not None:
+            try:
+                os.remove(self._rewritten_source)
+            except FileNotFoundError:
+                pass
+            # Images are rewritten again if the splitter is used after closing
+            self._rewritten_source = None
+            self._image_savings = None
+
+
+def _known_source_hash(manifest, pdf_path):
+    """Source SHA-256 from a previous manifest if the file is unchanged, else None."""
+    source = (manifest or {}).get('source', {})
+    stat = pdf_path.stat()
+    if source.get('size') == stat.st_size and source.get('mtime_ns') == stat.st_mtime_ns:
+        return source.get('sha256')
+    return None
 
 
-def split_pdf(pdf_path, output_dir, background_mode=False, no_split=False, metadata=None):
+def _manifest_files(manifest):
+    """
+    The output files a completed manifest lists in its book folder: chunks
+    and sidecars, or the archive (not the manifest and page index).
+    """
+    if manifest.get('options', {}).get('archive'):
+        names = list(manifest['outputs'])
+    else:
+        suffixes = ('.yaml', '.jsonl') if manifest['options'].get('extract_text') else ('.yaml',)
+        names = [name for output in manifest['outputs']
+                 for name in [output] + [str(Path(output).with_suffix(s)) for s in suffixes]]
+    return names
+
+
+def _missing_outputs(book_dir, manifest):
+    """Output files of a completed manifest that are gone from book_dir."""
+    try:
+        present = {entry.name for entry in os.scandir(book_dir)}
+    except FileNotFoundError:
+        present = set()
+    # A missing page index is rewritten from the manifest, not re-split
+    return [name for name in _manifest_files(manifest) if name not in present]
+
+
+def _manifest_mismatch(manifest, pdf_path, options, book_dir):
+    """
+    Why book_dir's manifest does not record a completed split of this exact
+    source and options whose outputs are all still there (a short reason
+    for the log), or None if it does.
+    """
+    if not manifest or not manifest.get('complete'):
+        return "incomplete previous run"
+    if manifest.get('version') != MANIFEST_VERSION:
+        return "split by an older version"
+    stat = pdf_path.stat()
+    source = manifest.get('source', {})
+    if source.get('size') != stat.st_size or source.get('mtime_ns') != stat.st_mtime_ns:
+        return "source file changed"
+    # Options added after the manifest was written count as their defaults
+    recorded = dict(OUTPUT_OPTION_DEFAULTS, **manifest.get('options', {}))
+    changed = sorted(key for key in recorded.keys() | options.keys()
+                     if recorded.get(key) != options.get(key))
+    if changed:
+        return f"options changed: {', '.join(changed)}"
+    missing = _missing_outputs(book_dir, manifest)
+    if missing:
+        return f"{len(missing)} output file(s) missing, e.g. {missing[0]}"
+    return None
+
+
+def _manifest_matches(manifest, pdf_path, options, book_dir):
+    """True if book_dir's manifest records a completed, intact split of this source and options."""
+    return _manifest_mismatch(manifest, pdf_path, options, book_dir) is None
+
+
+def _changed_metadata_keys(manifest, metadata):
+    """Metadata fields that differ from those a split book's sidecars were written with."""
+    recorded = manifest.get('metadata') or {}
+    current = json.loads(json.dumps(metadata or {}, ensure_ascii=False))
+    return sorted(key for key in recorded.keys() | current.keys()
+                  if recorded.get(key) != current.get(key))
+
+
+def _clean_output_dir(output_dir, reason="incomplete previous run"):
+    """
+    Remove chunk files, archives, temp files and the manifest left by a
+    previous run; reason says why, for the log.
+    """
+    removed = 0
+    for entry in os.scandir(output_dir):
+        if entry.is_file() and (CHUNK_FILE_PATTERN.match(entry.name)
+                                or ARCHIVE_FILE_PATTERN.match(entry.name)
+                                or BOOK_INDEX_FILE_PATTERN.match(entry.name)
+                                or REWRITTEN_SOURCE_PATTERN.match(entry.name)):
+            os.remove(entry.path)
+            removed += 1
+    if removed:
+        logging.info(f"Removed {removed} file(s) of a previous run in {output_dir} ({reason})")
+
+
+def _write_page_index(book_dir, manifest):
+    """Write a book's page_index.json from the plan and outputs in its manifest."""
+    archive = manifest['outputs'][0] if manifest['options'].get('archive') else None
+    index = PageIndex.from_plan(RangePlan.from_dict(manifest['plan']),
+                                manifest['source']['name'], archive)
+    index.save(book_dir)
+
+
+def _write_manifest(output_dir, pdf_path, splitter, files):
+    """
+    Record the source fingerprint, range plan, options and outputs of a
+    finished split, after writing the book's page index.
+    """
+    stat = pdf_path.stat()
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'complete': True,
+        'source': {
+            'name': pdf_path.name,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': splitter.source_hash,
+        },
+        'options': splitter.output_options,
+        'metadata': splitter.metadata,
+        'plan': splitter.plan.to_dict(),
+        'outputs': [f.name for f in files],
+    }
+    if splitter.extract_text:
+        manifest['text'] = splitter.text_stats  # [chars, tokens] per chunk, for refreshes
+    if splitter.checksums:
+        manifest['checksums'] = splitter.checksums  # Chunk PDF name -> SHA-256
+    _write_page_index(output_dir, manifest)
+    write_json_atomic(output_dir / MANIFEST_FILE, manifest)
+
+
+def _ask_split_ranges(pdf_name, page_count):
+    """
+    Ask for split ranges in a Tk dialog.
+
+    tkinter is imported only here, so headless hosts without it (or without
+    a display) can run everything else; there the prompt is skipped.
+
+    Returns the entered range string, or None.
+    """
+    try:
+        import tkinter as tk
+        from tkinter import simpledialog
+    except ImportError as e:
+        logging.warning(f"GUI prompt unavailable ({e}); use --background or --no-split")
+        return None
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        logging.warning(f"GUI prompt unavailable ({e}); use --background or --no-split")
+        return None
+    root.withdraw()
+    range_str = simpledialog.askstring(
+        "Large PDF Split",
+        f"'{pdf_name}' has no bookmarks.\n"
+        f"Total Pages: {page_count}\n\n"
+        f"Enter split ranges (e.g. '1-50, 51-100, 101-end'):"
+    )
+    root.destroy()
+    return range_str
+
+
+def split_pdf(pdf_path, output_dir, background_mode=False, no_split=False, metadata=None,
+              resume=True, metrics=None, **splitter_options):
     """
     Split a single PDF file.
 
@@ -306,23 +2024,57 @@ def split_pdf(pdf_path, output_dir, background_mode=False, no_split=False, metad
         background_mode: If True, skip GUI prompts
         no_split: If True, skip files without bookmarks
         metadata: Optional dict with book metadata (title, isbn, author, etc.)
+        resume: If True, skip the PDF when output_dir holds a manifest of a
+                completed split of the same source with the same options
+        metrics: Optional BookMetrics receiving stage timings, chunk stats and
+                 the outcome ('small', 'resumed', 'split', 'skipped', 'failed')
+        **splitter_options: Keyword options for PdfSplitter (workers, optimize,
+                            subset_fonts, report_savings, max_chunk_bytes,
+                            merge_pages, merge_bytes, plan_cache_dir, max_memory,
+                            archive, image_dpi, image_quality, grayscale_images,
+                            extract_text, verify, checksums)
 
     Returns:
-        List of paths to split PDF files, or None if skipped
+        List of paths to split PDF files, or None if skipped or failed
+        (metrics.status tells which)
     """
     pdf_path = Path(pdf_path)
     output_dir = Path(output_dir)
-    output_dir.mkdir(parents=True, exist_ok=True)
 
     file_size = pdf_path.stat().st_size
+    metrics = metrics or BookMetrics(pdf_path.name, file_size)
 
     if file_size < LARGE_FILE_THRESHOLD:
         logging.info(f"File {pdf_path.name} is small ({file_size / 1024 / 1024:.2f} MB). No split needed.")
+        metrics.status = 'small'
         return [pdf_path]
 
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_json(output_dir / MANIFEST_FILE)
+
+    options = {key: splitter_options.get(key, default)
+               for key, default in OUTPUT_OPTION_DEFAULTS.items()}
+    mismatch = _manifest_mismatch(manifest, pdf_path, options, output_dir)
+    if resume and mismatch is None:
+        logging.info(f"Already split: {pdf_path.name} ({len(manifest['outputs'])} chunk(s)). Skipping.")
+        if PageIndex.load(output_dir) is None:
+            _write_page_index(output_dir, manifest)  # split before page indexes existed
+        # Metadata is not part of the resume check: sidecars are rewritten by
+        # --refresh-metadata without splitting again
+        changed = _changed_metadata_keys(manifest, metadata) if metadata is not None else []
+        if changed:
+            logging.warning(f"Metadata of {pdf_path.name} differs from its split output "
+                            f"({', '.join(changed)}); run with --refresh-metadata to "
+                            f"update the YAML sidecars")
+        metrics.status = 'resumed'
+        return [output_dir / name for name in manifest['outputs']]
+    _clean_output_dir(output_dir, mismatch or "re-split requested with --force")
+
     logging.info(f"File {pdf_path.name} is {file_size / 1024 / 1024:.2f} MB. Initiating split...")
 
-    splitter = PdfSplitter(pdf_path, metadata)
+    splitter_options.setdefault('source_hash', _known_source_hash(manifest, pdf_path))
+    splitter = PdfSplitter(pdf_path, metadata, metrics=metrics, **splitter_options)
+    metrics.status = 'skipped'
     try:
         chunks = splitter.split_by_bookmarks(output_dir)
         if not chunks:
@@ -331,32 +2083,890 @@ def split_pdf(pdf_path, output_dir, background_mode=False, no_split=False, metad
                 logging.warning(f"Skipping '{pdf_path.name}' - no bookmarks available.")
                 return None
             else:
-                root = tk.Tk()
-                root.withdraw()
-                page_count = splitter.page_count
-                range_str = simpledialog.askstring(
-                    "Large PDF Split",
-                    f"'{pdf_path.name}' has no bookmarks.\n"
-                    f"Total Pages: {page_count}\n\n"
-                    f"Enter split ranges (e.g. '1-50, 51-100, 101-end'):"
-                )
-                root.destroy()
+                range_str = _ask_split_ranges(pdf_path.name, splitter.page_count)
                 if range_str:
                     chunks = splitter.split_manually(range_str, output_dir)
                 else:
                     logging.warning(f"Skipping '{pdf_path.name}' - no ranges specified.")
                     return None
+        with metrics.stage('manifest'):
+            _write_manifest(output_dir, pdf_path, splitter, chunks)
+        metrics.status = 'split'
+    except SplitVerificationError as e:
+        # No manifest is written, so the chunks are cleaned up and redone next run
+        metrics.status = 'failed'
+        logging.error(f"Verification failed for {pdf_path.name}: {e}")
+        chunks = None
     except Exception as e:
+        metrics.status = 'failed'
         logging.error(f"Split failed: {e}")
         import traceback
         logging.error(traceback.format_exc())
-        chunks = [pdf_path]
+        chunks = None
     finally:
         splitter.close()
 
     return chunks
 
 
+def _load_completed_manifest(book_dir):
+    """Load a book's manifest if it records a completed split, else None."""
+    manifest = load_json(Path(book_dir) / MANIFEST_FILE)
+    if not manifest or not manifest.get('complete') or manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def refresh_metadata(book_dir, metadata, manifest=None):
+    """
+    Rewrite the YAML sidecars of an already split book with new metadata.
+
+    Uses the range plan and output list stored in the book's manifest; the
+    source PDF and the chunk PDFs are never opened.
+
+    Returns:
+        Number of sidecars written, or None if there is no completed manifest
+    """
+    book_dir = Path(book_dir)
+    manifest = manifest or _load_completed_manifest(book_dir)
+    if manifest is None:
+        logging.warning(f"No completed manifest in {book_dir}; skipping metadata refresh.")
+        return None
+
+    plan = RangePlan.from_dict(manifest['plan'])
+    total_splits = len(plan)
+    text_stats = manifest.get('text') or [None] * total_splits
+    if manifest.get('options', {}).get('archive'):
+        _refresh_archive(book_dir / manifest['outputs'][0], metadata, plan, text_stats)
+    else:
+        for i, (r, name) in enumerate(zip(plan, manifest['outputs'])):
+            write_metadata_yaml(book_dir / name, metadata, i + 1, total_splits,
+                                r.chapter_num, r.chapter_title, plan.total_chapters, r.sections,
+                                r.start + 1, r.end + 1, text_stats[i])
+    if PageIndex.load(book_dir) is None:
+        _write_page_index(book_dir, manifest)
+
+    manifest['metadata'] = metadata
+    write_json_atomic(book_dir / MANIFEST_FILE, manifest)
+    logging.info(f"Refreshed metadata for {book_dir.name}: {total_splits} sidecar(s)")
+    return total_splits
+
+
+def _refresh_archive(archive_path, metadata, plan, text_stats):
+    """
+    Rewrite an output archive with new YAML sidecars.
+
+    Members are copied one at a time into a new archive of the same format;
+    the sidecar members are regenerated from the plan.
+    """
+    fmt = 'zip' if archive_path.suffix == '.zip' else 'tar'
+    sidecars = {}
+    for i, r in enumerate(plan):
+        name = str(Path(_chunk_filename(i + 1, r.title)).with_suffix('.yaml'))
+        data = chunk_metadata(metadata, i + 1, r.chapter_num, r.chapter_title,
+                              plan.total_chapters, r.sections, r.start + 1, r.end + 1,
+                              text_stats[i])
+        sidecars[name] = format_metadata_yaml(data).encode('utf-8')
+
+    writer = ArchiveWriter(archive_path, fmt)
+    try:
+        for name, data in iter_archive_members(archive_path):
+            writer.add(name, sidecars.get(name, data))
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def run_refresh(output_dir, args, prefetcher):
+    """
+    Refresh the sidecars of every split book under output_dir (or only the
+    book of args.pdf), looking up metadata for all of them concurrently.
+    """
+    if args.pdf:
+        book_dirs = [output_dir / Path(args.pdf).stem]
+    else:
+        book_dirs = sorted(entry.path for entry in os.scandir(output_dir)
+                           if entry.is_dir() and not entry.name.startswith('.'))
+
+    books = []
+    for book_dir in map(Path, book_dirs):
+        manifest = _load_completed_manifest(book_dir)
+        if manifest is None:
+            logging.warning(f"No completed manifest in {book_dir}; skipping metadata refresh.")
+            continue
+        isbn = resolve_isbn(Path(manifest['source']['name']), args)
+        if isbn:
+            prefetcher.submit(isbn)
+        books.append((book_dir, manifest, isbn))
+
+    for book_dir, manifest, isbn in books:
+        api_metadata = prefetcher.get(isbn) if isbn else None
+        refresh_metadata(book_dir, build_metadata(isbn, args, api_metadata), manifest)
+
+
+def read_input_list(path):
+    """Paths listed in a file ('-' for stdin), one per line; blank lines and # comments are skipped."""
+    f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def discover_inputs(args, output_dir):
+    """
+    Find the input PDFs of a batch run and their sizes.
+
+    PDFs come from args.input_list, or from one os.scandir walk of INPUT_DIR
+    (into subfolders with args.recursive, skipping the --watch done/failed
+    folders and the output directory), filtered by FileFilter. Each file is
+    stat'ed once here; later stages use the recorded sizes.
+
+    Output folders are named after the PDF's stem, so of several PDFs with
+    the same stem in different folders only one is kept: the shallowest
+    (then the first by path), so a top-level PDF keeps its output folder when
+    a subfolder gains a PDF of the same name.
+
+    Returns:
+        list of (pdf Path, size in bytes), largest first
+    """
+    file_filter = FileFilter(args.include, args.exclude, args.min_size, args.max_size,
+                             args.modified_since)
+    if args.input_list:
+        found = []
+        for name in read_input_list(args.input_list):
+            rel_path = Path(name).as_posix()
+            if not file_filter.match_name(rel_path):
+                continue
+            try:
+                stat = os.stat(name)
+            except OSError as e:
+                logging.warning(f"Listed input not found: {name} ({e.strerror})")
+                continue
+            if file_filter.match_stat(stat):
+                found.append((Path(name), stat.st_size))
+    else:
+        input_path = Path(INPUT_DIR)
+        if not input_path.exists():
+            input_path.mkdir(exist_ok=True)
+            logging.info(f"Created input directory: {input_path}")
+        found = list(scan_files(input_path, file_filter, recursive=args.recursive,
+                                skip_dirs=(args.done_dir, args.failed_dir, output_dir)))
+
+    by_stem = {}
+    for pdf, size in sorted(found, key=lambda item: (len(item[0].parts), item[0])):
+        if pdf.stem in by_stem:
+            logging.warning(f"Skipping {pdf}: its output folder {pdf.stem}/ is already "
+                            f"used by {by_stem[pdf.stem][0]}")
+        else:
+            by_stem[pdf.stem] = (pdf, size)
+    return sorted(by_stem.values(), key=lambda item: (-item[1], item[0]))
+
+
+def resolve_small_inputs(pdfs, sizes, args, prefetcher, writer):
+    """
+    Settle every PDF below LARGE_FILE_THRESHOLD in one pass.
+
+    Small files need no split, so they are recorded with status 'small'
+    without being opened or handed to a worker; with --fetch-small their
+    metadata lookups are still queued (to fill the cache).
+
+    Returns:
+        The PDFs that need splitting, in their original order
+    """
+    small = [pdf for pdf in pdfs if sizes[pdf] < LARGE_FILE_THRESHOLD]
+    if not small:
+        return pdfs
+    for pdf in small:
+        metrics = BookMetrics(pdf.name, sizes[pdf])
+        metrics.status = 'small'
+        if args.fetch_small:
+            with metrics.stage('isbn'):
+                isbn = resolve_isbn(pdf, args)
+            if isbn:
+                prefetcher.submit(isbn)
+        writer.record(metrics)
+    logging.info(f"{len(small)} PDF(s) below the split threshold "
+                 f"({sum(sizes[pdf] for pdf in small) / 1024 / 1024:.2f} MB in total); "
+                 f"no split needed")
+    small = set(small)
+    return [pdf for pdf in pdfs if pdf not in small]
+
+
+def _has_filename_isbn(pdf):
+    try:
+        return extract_isbn_from_filename(pdf.name) is not None
+    except ValueError:
+        return False
+
+
+def find_duplicate_inputs(pdfs, sizes=None):
+    """
+    Find input PDFs with identical content (see find_duplicate_files()).
+
+    Within a group of copies, a file whose name carries an ISBN is kept as
+    the original (then the first by name), so metadata can still be looked up.
+
+    Returns:
+        dict: duplicate PDF -> original PDF
+    """
+    ordered = sorted(pdfs, key=lambda p: (not _has_filename_isbn(p), p.name))
+    duplicates = find_duplicate_files(ordered, sizes)
+    for pdf, original in sorted(duplicates.items()):
+        logging.info(f"Duplicate input: {pdf.name} has the same content as {original.name}")
+    return duplicates
+
+
+def link_duplicate_output(pdf, original, output_dir):
+    """
+    Give a duplicate input PDF the output of its original without splitting it.
+
+    output_dir/<pdf stem>/ is filled with hard links to the original's chunks,
+    sidecars (or archive), plus its own manifest and page index recording the
+    duplicate's source (with 'duplicate_of' in the manifest), so later runs see
+    it as already split and page lookups name the duplicate. Files are copied
+    where hard links are not supported.
+
+    The links are refreshed on every run, so they follow a re-split original.
+
+    Returns:
+        Number of files linked or copied, or None if the original has no
+        completed split (small, skipped or failed books)
+    """
+    source_dir = output_dir / original.stem
+    manifest = _load_completed_manifest(source_dir)
+    if manifest is None:
+        return None
+
+    book_dir = output_dir / pdf.stem
+    book_dir.mkdir(parents=True, exist_ok=True)
+    _clean_output_dir(book_dir, f"replaced with the output of {original.name}")
+
+    names = _manifest_files(manifest)
+    for name in names:
+        try:
+            hardlink_replace(source_dir / name, book_dir / name)
+        except OSError:
+            shutil.copy2(source_dir / name, book_dir / name)
+
+    stat = pdf.stat()
+    manifest['source'] = dict(manifest['source'], name=pdf.name, size=stat.st_size,
+                              mtime_ns=stat.st_mtime_ns)
+    manifest['duplicate_of'] = original.name
+    _write_page_index(book_dir, manifest)
+    write_json_atomic(book_dir / MANIFEST_FILE, manifest)
+    return len(names)
+
+
+def handle_duplicate_inputs(duplicates, output_dir, args, writer):
+    """Skip or link (args.dedup_inputs) every duplicate input after the originals ran."""
+    for pdf, original in sorted(duplicates.items()):
+        metrics = BookMetrics(pdf.name, pdf.stat().st_size)
+        metrics.status = 'duplicate'
+        if args.dedup_inputs == 'link':
+            linked = link_duplicate_output(pdf, original, output_dir)
+            if linked is None:
+                logging.info(f"Skipped duplicate: {pdf.name} ({original.name} was not split)")
+            else:
+                logging.info(f"Linked duplicate: {pdf.name} -> {original.stem}/ "
+                             f"({linked} file(s))")
+        else:
+            logging.info(f"Skipped duplicate: {pdf.name} (same content as {original.name})")
+        writer.record(metrics)
+
+
+class ChunkDeduplicator:
+    """
+    Replace chunk PDFs that are byte-identical to another chunk in the output
+    directory with hard links to it.
+
+    Candidates are found by file size first; only chunks whose size collides
+    with another chunk are hashed, and each file at most once. The index is
+    seeded from the book folders already in output_dir, so chunks are shared
+    across runs as well as within and across books of this run.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = Path(output_dir)
+        self._by_size = {}   # size -> [path]
+        self._hashes = {}    # path -> sha256
+        self.linked = 0
+        self.saved_bytes = 0
+        if self.output_dir.is_dir():
+            for book in os.scandir(self.output_dir):
+                if book.is_dir() and not book.name.startswith('.'):
+                    for entry in os.scandir(book.path):
+                        if (entry.is_file() and entry.name.endswith('.pdf')
+                                and CHUNK_FILE_PATTERN.match(entry.name)):
+                            self._add(Path(entry.path), entry.stat().st_size)
+
+    def _add(self, path, size):
+        paths = self._by_size.setdefault(size, [])
+        if path not in paths:
+            paths.append(path)
+
+    def _hash(self, path):
+        if path not in self._hashes:
+            self._hashes[path] = sha256_file(path)
+        return self._hashes[path]
+
+    def _find_identical(self, path, size):
+        for other in self._by_size.get(size, ()):
+            if other == path:
+                continue
+            try:
+                if os.path.samefile(other, path) or self._hash(other) == self._hash(path):
+                    return other
+            except OSError:
+                continue  # removed since it was indexed
+        return None
+
+    def dedupe_book(self, book_dir):
+        """
+        Link the chunks of a freshly split book and record them in its manifest
+        under 'links' (chunk name -> path of the identical chunk, relative to
+        the output directory).
+
+        Returns:
+            Number of chunks linked
+        """
+        book_dir = Path(book_dir)
+        manifest = _load_completed_manifest(book_dir)
+        if manifest is None or manifest.get('options', {}).get('archive'):
+            return 0
+
+        links = {}
+        saved = 0
+        for name in manifest['outputs']:
+            path = book_dir / name
+            self._hashes.pop(path, None)  # rewritten by this split
+            size = path.stat().st_size
+            other = self._find_identical(path, size)
+            if other is not None:
+                if not os.path.samefile(other, path):
+                    try:
+                        hardlink_replace(other, path)
+                    except OSError as e:
+                        logging.warning(f"Could not link {name} to {other}: {e}")
+                        self._add(path, size)
+                        continue
+                    saved += size
+                links[name] = other.relative_to(self.output_dir).as_posix()
+            self._add(path, size)
+
+        if links:
+            manifest['links'] = links
+            write_json_atomic(book_dir / MANIFEST_FILE, manifest)
+            self.linked += len(links)
+            self.saved_bytes += saved
+            logging.info(f"Linked {len(links)} identical chunk(s) in {book_dir.name} "
+                         f"({saved / 1024 / 1024:.2f} MB saved)")
+        return len(links)
+
+
+def open_metadata_cache(args, output_dir):
+    """Open the persistent metadata cache, or return None if disabled."""
+    if args.no_cache:
+        return None
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return MetadataCache(output_dir / METADATA_CACHE_FILE, ttl=args.cache_ttl * 24 * 3600)
+
+
+def resolve_isbn(pdf, args):
+    """Return the ISBN for a PDF (CLI override or extracted from filename), or None."""
+    isbn = args.isbn
+    if not isbn:
+        try:
+            isbn = extract_isbn_from_filename(pdf.name)
+            if isbn:
+                logging.info(f"Extracted ISBN from filename: {isbn} ({pdf.name})")
+        except ValueError as e:
+            logging.error(f"ISBN extraction error: {e}")
+            isbn = None
+    return isbn
+
+
+def needs_metadata(size, args):
+    """Only PDFs that will be split get YAML sidecars, so only they need metadata."""
+    return args.fetch_small or size >= LARGE_FILE_THRESHOLD
+
+
+def start_prefetch(pdfs, args, prefetcher, book_metrics):
+    """
+    Extract every ISBN up front and queue Google Books lookups in processing order.
+
+    ISBN extraction time is added to each book's BookMetrics.
+
+    Returns:
+        dict: pdf -> (ISBN or None, whether metadata is looked up)
+    """
+    isbns = {}
+    for pdf in pdfs:
+        with book_metrics[pdf].stage('isbn'):
+            isbn = resolve_isbn(pdf, args)
+        lookup = bool(isbn) and needs_metadata(book_metrics[pdf].bytes_in, args)
+        if lookup:
+            prefetcher.submit(isbn)
+        elif isbn:
+            logging.info(f"Skipping metadata lookup for {pdf.name} (below split threshold)")
+        isbns[pdf] = (isbn, lookup)
+    return isbns
+
+
+def build_metadata(isbn, args, api_metadata=None):
+    """
+    Build the metadata dict for a PDF.
+
+    Combines the ISBN, Google Books metadata (if fetched) and CLI overrides.
+    """
+    metadata = {}
+
+    if isbn:
+        metadata['isbn'] = isbn
+        metadata.update(api_metadata or {})
+
+    # Apply CLI overrides
+    if args.title:
+        metadata['parent_document'] = args.title
+    if args.author:
+        metadata['author'] = args.author
+    if args.publisher:
+        metadata['publisher'] = args.publisher
+    if args.published_date:
+        metadata['published_date'] = args.published_date
+    if args.genre:
+        metadata['genre'] = args.genre
+    if args.description:
+        metadata['description'] = args.description
+    if args.language:
+        metadata['language'] = args.language
+
+    return metadata
+
+
+def book_metadata(pdf, isbns, args, prefetcher, metrics):
+    """
+    Build metadata for a PDF, waiting for its prefetched lookup if needed.
+
+    The wait is recorded as the 'metadata' stage: with prefetching it is only
+    the part of the lookup that did not overlap earlier work.
+    """
+    isbn, lookup = isbns[pdf]
+    with metrics.stage('metadata'):
+        api_metadata = prefetcher.get(isbn) if lookup else None
+    return build_metadata(isbn, args, api_metadata)
+
+
+def splitter_options(args, output_dir):
+    """PdfSplitter keyword options from parsed CLI arguments."""
+    return {
+        'plan_cache_dir': output_dir / PLAN_CACHE_DIR,
+        'workers': args.chunk_workers,
+        'optimize': args.optimize,
+        'subset_fonts': args.subset_fonts,
+        'report_savings': args.report_savings,
+        'max_chunk_bytes': args.max_chunk_bytes,
+        'merge_pages': args.merge_pages,
+        'merge_bytes': args.merge_bytes,
+        'max_memory': args.max_memory,
+        'archive': args.archive,
+        'image_dpi': args.image_dpi,
+        'image_quality': args.image_quality,
+        'grayscale_images': args.grayscale_images,
+        'extract_text': args.extract_text,
+        'verify': args.verify != 'off',
+        'checksums': args.verify == 'full',
+    }
+
+
+def process_pdf(pdf, output_dir, args, metadata, metrics):
+    """Split a single PDF into output_dir/<stem>/ with the given metadata."""
+    logging.info(f"Processing: {pdf.name}")
+
+    pdf_output_dir = output_dir / pdf.stem
+    reset_peak_rss()  # peak_rss_bytes of this book only, also in long-lived pool workers
+    chunks = split_pdf(pdf, pdf_output_dir, args.background, args.no_split, metadata,
+                       resume=not args.force, metrics=metrics,
+                       **splitter_options(args, output_dir))
+    metrics.peak_rss_bytes = peak_rss_bytes()
+
+    if metrics.status == 'failed':
+        logging.error(f"Failed: {pdf.name}")
+    elif chunks is None:
+        logging.info(f"Skipped: {pdf.name}")
+    else:
+        logging.info(f"Split into {len(chunks)} chunk(s)")
+    logging.info(f"Stage timings: {metrics.summary()}")
+    return chunks
+
+
+def _process_pdf_in_worker(pdf, output_dir, args, metadata, metrics):
+    """Pool entry point: process one PDF and return its metrics and buffered log records."""
+    start_worker_log_capture()
+    try:
+        chunks = process_pdf(pdf, output_dir, args, metadata, metrics)
+    except Exception as e:
+        logging.error(f"Processing failed for {pdf.name}: {e}")
+        metrics.status = 'failed'
+        chunks = None
+    return chunks, metrics, finish_worker_log_capture()
+
+
+# Outcomes that took (almost) no work; left out of the size-weighted ETA
+NO_WORK_STATUSES = ('small', 'resumed', 'duplicate')
+
+
+def dedupe_book_chunks(chunk_dedup, pdf, output_dir, metrics):
+    """Link identical chunks of a freshly split book (no-op without --dedup-chunks)."""
+    if chunk_dedup is not None and metrics.status == 'split':
+        with metrics.stage('dedup'):
+            chunk_dedup.dedupe_book(output_dir / pdf.stem)
+
+
+class BatchProgress:
+    """Track finished books, record their metrics and log a size-weighted ETA."""
+
+    def __init__(self, sizes, writer, workers=1):
+        sizes = list(sizes)
+        self.writer = writer
+        self.workers = workers
+        self.start_time = time.time()
+        self.total_count = len(sizes)
+        self.total_bytes = sum(sizes)
+        self.processed_count = 0
+        self.processed_bytes = 0
+
+    def book_done(self, metrics):
+        self.writer.record(metrics)
+        self.processed_count += 1
+        if metrics.status in NO_WORK_STATUSES:
+            self.total_bytes -= metrics.bytes_in
+        else:
+            self.processed_bytes += metrics.bytes_in
+        estimate_time(self.start_time, self.processed_bytes, self.total_bytes,
+                      self.processed_count, self.total_count, self.workers)
+
+
+def run_batch(pdfs, output_dir, args, isbns, prefetcher, book_metrics, writer,
+              chunk_dedup=None):
+    """
+    Process PDFs concurrently in a process pool.
+
+    Files are scheduled largest first so a single huge book does not finish
+    last. A book is submitted as soon as its metadata has resolved, so lookups
+    for later books overlap with splitting earlier ones. Each worker buffers
+    its log output per book and the parent emits the whole block when the
+    book completes, so log lines never interleave.
+    """
+    workers = args.workers
+    if not (args.background or args.no_split):
+        logging.warning("GUI prompts are disabled with --workers; "
+                        "PDFs without bookmarks will be skipped.")
+        args = argparse.Namespace(**vars(args))
+        args.no_split = True
+
+    pdfs = sorted(pdfs, key=lambda p: book_metrics[p].bytes_in, reverse=True)
+    progress = BatchProgress([book_metrics[pdf].bytes_in for pdf in pdfs], writer, workers)
+
+    logging.info(f"Processing {len(pdfs)} PDF(s) with {workers} workers")
+
+    def handle(future):
+        pdf = futures.pop(future)
+        try:
+            _, metrics, records = future.result()
+        except Exception as e:
+            logging.error(f"Worker failed for {pdf.name}: {e}")
+            metrics = book_metrics[pdf]
+            metrics.status = 'failed'
+        else:
+            replay_log_records(records)
+            dedupe_book_chunks(chunk_dedup, pdf, output_dir, metrics)
+        progress.book_done(metrics)
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker_logging) as executor:
+        futures = {}
+        for pdf in pdfs:
+            metadata = book_metadata(pdf, isbns, args, prefetcher, book_metrics[pdf])
+            futures[executor.submit(_process_pdf_in_worker, pdf, output_dir, args, metadata,
+                                    book_metrics[pdf])] = pdf
+            for future in [f for f in futures if f.done()]:
+                handle(future)
+        for future in as_completed(list(futures)):
+            handle(future)
+
+
+# Columns of a CSV --plan report (one row per chunk; books without chunks get one row)
+PLAN_REPORT_COLUMNS = ['file', 'status', 'source_bytes', 'pages', 'already_split',
+                       'chunk_index', 'chunk_file', 'start_page', 'end_page', 'chunk_pages',
+                       'title', 'chapter_number', 'chapter_title', 'estimated_bytes']
+
+
+def plan_pdf(pdf, output_dir, args):
+    """
+    Plan one PDF the way split_smart() would, without writing any chunks.
+
+    Returns a report dict with the book's status ('small', 'no_toc',
+    'planned' or 'error') and, when planned, every chunk's page range
+    (1-based), titles and estimated unoptimized size. A plan that would
+    fail verification (see PdfSplitter._verify_plan()) is reported as an
+    error.
+
+    The plan cache is keyed by the source's SHA-256, which would mean
+    reading every input in full. It is only used for books whose hash the
+    manifest of an earlier split already records (same size and mtime);
+    other books are planned from their TOC alone.
+    """
+    size = pdf.stat().st_size
+    options = splitter_options(args, output_dir)
+    book_dir = output_dir / pdf.stem
+    manifest = load_json(book_dir / MANIFEST_FILE)
+    report = {'file': pdf.name, 'source_bytes': size, 'pages': None, 'status': None,
+              'already_split': _manifest_matches(manifest, pdf,
+                                                 {key: options.get(key, default) for key, default
+                                                  in OUTPUT_OPTION_DEFAULTS.items()},
+                                                 book_dir),
+              'chunk_count': 0, 'estimated_bytes': 0, 'chunks': []}
+    if size < LARGE_FILE_THRESHOLD:
+        report['status'] = 'small'
+        return report
+
+    options['source_hash'] = _known_source_hash(manifest, pdf)
+    if options['source_hash'] is None:
+        options['plan_cache_dir'] = None
+    splitter = PdfSplitter(pdf, **options)
+    try:
+        report['pages'] = splitter.page_count
+        plan = splitter.plan_smart()
+        if plan is None:
+            report['status'] = 'no_toc'
+            return report
+        splitter._verify_plan(plan)
+        for i, r in enumerate(plan):
+            estimate = splitter.estimate_range_bytes(r.start, r.end)
+            report['chunks'].append({
+                'chunk_index': i + 1,
+                'chunk_file': _chunk_filename(i + 1, r.title),
+                'start_page': r.start + 1,
+                'end_page': r.end + 1,
+                'chunk_pages': r.end - r.start + 1,
+                'title': r.title,
+                'chapter_number': r.chapter_num,
+                'chapter_title': r.chapter_title,
+                'sections': list(r.sections),
+                'estimated_bytes': estimate,
+            })
+            report['estimated_bytes'] += estimate
+        report['chunk_count'] = len(plan)
+        report['status'] = 'planned'
+    except Exception as e:
+        logging.error(f"Planning failed for {pdf.name}: {e}")
+        report['status'] = 'error'
+        report['error'] = str(e)
+    finally:
+        splitter.close()
+    return report
+
+
+def _plan_pdf_in_worker(pdf, output_dir, args):
+    """Pool entry point: plan one PDF and return its report and buffered log records."""
+    start_worker_log_capture()
+    return plan_pdf(pdf, output_dir, args), finish_worker_log_capture()
+
+
+def write_plan_report(path, reports):
+    """Write --plan reports as CSV (if path ends in .csv) or JSON."""
+    path = Path(path)
+    if path.suffix.lower() != '.csv':
+        totals = {
+            'books': len(reports),
+            'chunks': sum(r['chunk_count'] for r in reports),
+            'source_bytes': sum(r['source_bytes'] for r in reports),
+            'estimated_bytes': sum(r['estimated_bytes'] for r in reports),
+        }
+        for status in ('planned', 'small', 'no_toc', 'error'):
+            totals[status] = sum(1 for r in reports if r['status'] == status)
+        write_json_atomic(path, {'threshold_bytes': LARGE_FILE_THRESHOLD,
+                                 'totals': totals, 'books': reports})
+        return
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=PLAN_REPORT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for report in reports:
+            for chunk in report['chunks'] or [{}]:
+                writer.writerow(dict(report, **chunk))
+    os.replace(tmp_path, path)
+
+
+def run_plan(pdfs, output_dir, args):
+    """
+    Dry run: plan every PDF (in parallel with --workers) and write a report.
+
+    Nothing but the plan cache is written; no metadata is looked up.
+    """
+    logging.info(f"Planning {len(pdfs)} PDF(s); report: {args.plan}")
+    if args.workers > 1 and len(pdfs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        reports = []
+        with ProcessPoolExecutor(max_workers=args.workers,
+                                 initializer=init_worker_logging) as executor:
+            futures = [executor.submit(_plan_pdf_in_worker, pdf, output_dir, args)
+                       for pdf in sorted(pdfs, key=lambda p: p.stat().st_size, reverse=True)]
+            for future in as_completed(futures):
+                report, records = future.result()
+                replay_log_records(records)
+                reports.append(report)
+    else:
+        reports = [plan_pdf(pdf, output_dir, args) for pdf in pdfs]
+    reports.sort(key=lambda r: r['file'])
+
+    for r in reports:
+        if r['status'] == 'planned':
+            logging.info(f"{r['file']}: {r['chunk_count']} chunk(s), "
+                         f"~{r['estimated_bytes'] / 1024 / 1024:.1f} MB"
+                         f"{' (already split)' if r['already_split'] else ''}")
+        else:
+            logging.info(f"{r['file']}: {r['status']}")
+
+    write_plan_report(args.plan, reports)
+    planned = [r for r in reports if r['status'] == 'planned']
+    logging.info(f"Plan: {len(planned)} of {len(reports)} book(s) would be split into "
+                 f"{sum(r['chunk_count'] for r in planned)} chunk(s), "
+                 f"~{sum(r['estimated_bytes'] for r in planned) / 1024 / 1024:.1f} MB estimated; "
+                 f"{sum(1 for r in reports if r['status'] == 'small')} below threshold, "
+                 f"{sum(1 for r in reports if r['status'] == 'no_toc')} without bookmarks")
+
+
+def _init_watch_worker():
+    """
+    Pool initializer for --watch: buffer logs and leave Ctrl+C and SIGTERM to
+    the parent, which lets running books finish before it shuts the pool down.
+    Workers are forked after the parent's SIGTERM handler is installed, so it
+    must be reset here.
+    """
+    init_worker_logging()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _move_input(pdf, folder):
+    """Move a processed input PDF into folder, keeping both files on a name clash."""
+    folder.mkdir(parents=True, exist_ok=True)
+    target = folder / pdf.name
+    if target.exists():
+        target = folder / f"{pdf.stem}_{time.strftime('%Y%m%d%H%M%S')}{pdf.suffix}"
+    shutil.move(str(pdf), str(target))
+    return target
+
+
+def run_watch(input_dir, output_dir, args, prefetcher, writer, chunk_dedup=None):
+    """
+    Watch input_dir and process each PDF once it has finished arriving.
+
+    Books run in a pool of args.workers long-lived processes, at most that
+    many at a time; the rest wait in arrival order. Finished PDFs are moved to
+    args.done_dir, or args.failed_dir if they failed or were skipped. Runs until
+    interrupted (Ctrl+C or SIGTERM), then waits for the books already running;
+    queued books stay in input_dir for the next run, as do books whose worker
+    died or was interrupted (the pool is then broken and watching stops).
+    """
+    if not (args.background or args.no_split):
+        logging.warning("GUI prompts are disabled with --watch; "
+                        "PDFs without bookmarks will be skipped.")
+        args = argparse.Namespace(**vars(args))
+        args.no_split = True
+
+    done_dir = Path(args.done_dir)
+    failed_dir = Path(args.failed_dir)
+    watcher = FolderWatcher(input_dir, settle_time=args.settle_time,
+                            poll_interval=args.poll_interval, polling=args.watch_polling)
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    logging.info(f"Watching {input_dir} ({watcher.mode}) with {args.workers} worker(s); "
+                 f"Ctrl+C to stop")
+
+    isbns = {}
+    queue = deque()
+    running = {}
+    pool_broken = False
+
+    def finish(future):
+        nonlocal pool_broken
+        pdf, metrics = running.pop(future)
+        try:
+            chunks, metrics, records = future.result()
+        except (BrokenProcessPool, KeyboardInterrupt, SystemExit) as e:
+            # Not the book's fault: leave it in input_dir for the next run
+            logging.error(f"Worker stopped while splitting {pdf.name} "
+                          f"({type(e).__name__}); left in {input_dir}")
+            pool_broken = pool_broken or isinstance(e, BrokenProcessPool)
+            metrics.status = 'failed'
+            writer.record(metrics)
+            watcher.forget(pdf)
+            return
+        except Exception as e:
+            logging.error(f"Worker failed for {pdf.name}: {e}")
+            chunks = None
+            metrics.status = 'failed'
+        else:
+            replay_log_records(records)
+            dedupe_book_chunks(chunk_dedup, pdf, output_dir, metrics)
+        writer.record(metrics)
+
+        ok = chunks is not None and metrics.status != 'failed'
+        try:
+            target = _move_input(pdf, done_dir if ok else failed_dir)
+        except OSError as e:
+            logging.error(f"Could not move {pdf.name}: {e}")
+        else:
+            logging.info(f"{'Done' if ok else 'Failed'}: {pdf.name} -> {target}")
+        watcher.forget(pdf)
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             initializer=_init_watch_worker) as executor:
+        try:
+            while not pool_broken:
+                for pdf in watcher.poll():
+                    logging.info(f"New PDF: {pdf.name}")
+                    metrics = BookMetrics(pdf.name, pdf.stat().st_size)
+                    isbns.update(start_prefetch([pdf], args, prefetcher, {pdf: metrics}))
+                    queue.append((pdf, metrics))
+
+                while queue and len(running) < args.workers:
+                    pdf, metrics = queue.popleft()
+                    metadata = book_metadata(pdf, isbns, args, prefetcher, metrics)
+                    future = executor.submit(_process_pdf_in_worker, pdf, output_dir, args,
+                                             metadata, metrics)
+                    running[future] = (pdf, metrics)
+
+                for future in [f for f in running if f.done()]:
+                    finish(future)
+        except KeyboardInterrupt:
+            logging.info(f"Stopping watch; waiting for {len(running)} running book(s)")
+        except BrokenProcessPool:
+            pool_broken = True
+        finally:
+            if pool_broken:
+                logging.error("A worker process died; stopping watch")
+                # The broken pool stops its other workers with SIGTERM, which they ignore
+                for process in multiprocessing.active_children():
+                    process.kill()
+            for future in as_completed(list(running)):
+                finish(future)
+            watcher.close()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="PDF Splitter - Split large PDFs by bookmarks or page ranges. "
@@ -368,6 +2978,8 @@ Examples:
   python pdf-split-by-contents.py 978-xxx_book.pdf     Split a single PDF (ISBN auto-extracted)
   python pdf-split-by-contents.py -o output_folder     Specify output directory
   python pdf-split-by-contents.py --background         Run without GUI prompts
+  python pdf-split-by-contents.py --background --workers 8
+                                                       Process 8 PDFs in parallel
   python pdf-split-by-contents.py --genre "法律"       Override/add genre (API取得が粗いため推奨)
 
 Filename format for auto ISBN extraction:
@@ -383,6 +2995,143 @@ Filename format for auto ISBN extraction:
                         help="Run in background mode (no GUI prompts, skip if no bookmarks)")
     parser.add_argument("--no-split", action="store_true",
                         help="Skip PDFs without bookmarks instead of prompting")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of PDFs to process in parallel (default: 1; "
+                             "disables GUI prompts when > 1)")
+    parser.add_argument("--chunk-workers", type=int, default=1,
+                        help="Number of processes writing chunks of a single PDF (default: 1)")
+    parser.add_argument("--refresh-metadata", action="store_true",
+                        help="Only rewrite the YAML sidecars of already split books "
+                             "(from manifest.json) with current metadata; PDFs are not opened")
+    parser.add_argument("--archive", choices=ARCHIVE_FORMATS,
+                        help="Write each book's chunks and YAML sidecars into one archive "
+                             "(<stem>.zip, stored, or <stem>.tar) with an index.json member "
+                             "listing page ranges, instead of separate files")
+    parser.add_argument("--extract-text", action="store_true",
+                        help="Also write each chunk's text as a .jsonl sidecar (one line per "
+                             "page with offsets and character/token counts), extracted in "
+                             "background processes while the chunks are written")
+    parser.add_argument("--watch", action="store_true",
+                        help=f"Keep running and process PDFs as they arrive in {INPUT_DIR}/ "
+                             "(inotify if inotify_simple is installed, else polling)")
+    parser.add_argument("--plan", metavar="REPORT",
+                        help="Dry run: only plan the split of every input PDF and write the "
+                             "chunks, page ranges and estimated sizes to REPORT "
+                             "(.json, or .csv for one row per chunk)")
+    parser.add_argument("--dedup-inputs", choices=("skip", "link"),
+                        help="Split input PDFs with identical content only once (found by "
+                             "size, a partial hash, then a full hash); the other copies are "
+                             "skipped, or get hard links to the original's output folder")
+    parser.add_argument("--dedup-chunks", action="store_true",
+                        help="Replace chunk PDFs that are byte-identical to another chunk in "
+                             "the output directory with hard links (recorded in manifest.json)")
+    parser.add_argument("--verify", choices=("full", "pages", "off"), default="pages",
+                        help="Check that the range plan covers every page exactly once and "
+                             "each written chunk has the right page count ('pages', the "
+                             "default), and also record chunk SHA-256 checksums in "
+                             f"{MANIFEST_FILE} ('full'; hashed in a background thread)")
+    parser.add_argument("--force", action="store_true",
+                        help=f"Re-split PDFs even if {MANIFEST_FILE} shows they are already done")
+
+    # Input discovery options (batch runs over input_pdf/ or --input-list)
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help=f"Also find PDFs in subfolders of {INPUT_DIR}/ (the --watch done "
+                             f"and failed folders are skipped)")
+    parser.add_argument("--include", action="append", metavar="GLOB",
+                        help="Only process PDFs matching this glob (repeatable); patterns "
+                             "with '/' match the relative path, others the file name")
+    parser.add_argument("--exclude", action="append", metavar="GLOB",
+                        help="Skip PDFs and folders matching this glob (repeatable)")
+    parser.add_argument("--min-size", type=parse_size, metavar="SIZE",
+                        help="Skip PDFs smaller than this (e.g. 45MB)")
+    parser.add_argument("--max-size", type=parse_size, metavar="SIZE",
+                        help="Skip PDFs larger than this (e.g. 2GB)")
+    parser.add_argument("--modified-since", type=parse_since, metavar="WHEN",
+                        help="Skip PDFs last modified before WHEN: a date or datetime "
+                             "(2024-04-01, 2024-04-01T09:00) or an age (7d, 12h, 30m)")
+    parser.add_argument("--input-list", metavar="FILE",
+                        help=f"Process the PDFs listed in FILE (one path per line, '-' for "
+                             f"stdin) instead of scanning {INPUT_DIR}/")
+
+    parser.add_argument("--max-chunk-bytes", type=parse_size,
+                        help="Sub-split any range whose estimated output size exceeds this "
+                             "(e.g. 45MB, 500KB, 1048576) into _partN chunks")
+    parser.add_argument("--merge-pages", type=int,
+                        help="Merge neighbouring sections of the same chapter until a chunk "
+                             "has at least this many pages")
+    parser.add_argument("--merge-bytes", type=parse_size,
+                        help="Merge neighbouring sections of the same chapter until a chunk "
+                             "reaches this estimated size (e.g. 5MB)")
+    parser.add_argument("--max-memory", type=parse_size,
+                        help="Bounded-memory mode for very large books: empty MuPDF's cache "
+                             "after every chunk and reopen the source whenever a process's "
+                             "resident memory exceeds this (e.g. 1GB)")
+
+    # Output optimization options
+    parser.add_argument("--optimize", choices=sorted(OPTIMIZE_PROFILES), default="none",
+                        help="Output optimization profile: none, compact "
+                             "(garbage collection, deflate, duplicate-object elimination) "
+                             "or max (also dedup streams, compress images/fonts) (default: none)")
+    parser.add_argument("--subset-fonts", action="store_true",
+                        help="Subset embedded fonts in each chunk")
+    parser.add_argument("--image-dpi", type=int,
+                        help="Downsample images placed at more than 1.5x this resolution "
+                             "to it and re-encode them as JPEG (e.g. 150 for 600-dpi scans)")
+    parser.add_argument("--image-quality", type=int, choices=range(1, 101), metavar="1-100",
+                        help=f"JPEG quality of re-encoded images (default: "
+                             f"{DEFAULT_JPEG_QUALITY}); on its own, re-encodes images "
+                             f"without downsampling")
+    parser.add_argument("--grayscale-images", action="store_true",
+                        help="Convert images to grayscale (re-encoded as JPEG)")
+    parser.add_argument("--report-savings", action="store_true",
+                        help="Log bytes saved per book vs. unoptimized output "
+                             "(serializes each chunk twice)")
+
+    # Watch mode options
+    parser.add_argument("--settle-time", type=float, default=5.0,
+                        help="--watch: seconds a file's size must stay unchanged before "
+                             "it is processed (default: 5)")
+    parser.add_argument("--poll-interval", type=float, default=2.0,
+                        help="--watch: seconds between directory scans/checks (default: 2)")
+    parser.add_argument("--watch-polling", action="store_true",
+                        help="--watch: poll instead of using inotify (needed on network "
+                             "filesystems, where inotify misses writes from other hosts)")
+    parser.add_argument("--done-dir", default=os.path.join(INPUT_DIR, "done"),
+                        help=f"--watch: where processed PDFs are moved "
+                             f"(default: {os.path.join(INPUT_DIR, 'done')})")
+    parser.add_argument("--failed-dir", default=os.path.join(INPUT_DIR, "failed"),
+                        help=f"--watch: where failed or skipped PDFs are moved "
+                             f"(default: {os.path.join(INPUT_DIR, 'failed')})")
+
+    # Metadata cache options
+    parser.add_argument("--cache-ttl", type=float, default=30,
+                        help="Days before cached Google Books metadata expires (default: 30)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"Do not use the metadata cache ({METADATA_CACHE_FILE} in the output directory)")
+    parser.add_argument("--offline", action="store_true",
+                        help="Never call Google Books; use cached metadata only (expired entries allowed)")
+
+    # Metadata prefetch options
+    parser.add_argument("--fetch-workers", type=int, default=4,
+                        help="Concurrent Google Books lookups (default: 4)")
+    parser.add_argument("--fetch-rate", type=float, default=5.0,
+                        help="Maximum Google Books requests per second (default: 5)")
+    parser.add_argument("--fetch-retries", type=int, default=3,
+                        help="Retries with exponential backoff for failed lookups (default: 3)")
+    parser.add_argument("--fetch-small", action="store_true",
+                        help="Also look up metadata for PDFs below the split threshold")
+    parser.add_argument("--metadata-url", default=GOOGLE_BOOKS_API_URL,
+                        help="Google Books volumes query URL with an {isbn} placeholder, e.g. "
+                             "a local google_books_stub.py (default: $GOOGLE_BOOKS_API_URL "
+                             "or the public API)")
+
+    # Metrics options
+    parser.add_argument("--metrics-file",
+                        help="Append per-book stage timings, bytes in/out, chunk stats and "
+                             "peak memory to this file as JSON lines")
+    parser.add_argument("--prometheus-file",
+                        help="Write run totals to this file in Prometheus text format "
+                             "(for node_exporter's textfile collector)")
 
     # Metadata override options (override API-fetched values)
     parser.add_argument("--title", help="Book title (overrides API-fetched value)")
@@ -395,78 +3144,108 @@ Filename format for auto ISBN extraction:
     parser.add_argument("--language", help="Language code (overrides API, e.g., ja, en)")
 
     args = parser.parse_args()
+    if args.watch and (args.pdf or args.refresh_metadata):
+        parser.error("--watch cannot be combined with a PDF argument or --refresh-metadata")
+    if args.plan and (args.watch or args.refresh_metadata):
+        parser.error("--plan cannot be combined with --watch or --refresh-metadata")
+    discovery = [option for option, value in (
+        ("--recursive", args.recursive), ("--include", args.include),
+        ("--exclude", args.exclude), ("--min-size", args.min_size is not None),
+        ("--max-size", args.max_size is not None),
+        ("--modified-since", args.modified_since is not None),
+        ("--input-list", args.input_list)) if value]
+    if discovery and (args.pdf or args.watch or args.refresh_metadata):
+        parser.error(f"{', '.join(discovery)} cannot be combined with a PDF argument, "
+                     f"--watch or --refresh-metadata")
+    try:
+        client = GoogleBooksClient(args.metadata_url)
+    except ValueError as e:
+        parser.error(str(e))
 
     setup_logging(args.background)
     logging.info("=== PDF Splitter Started ===")
 
     output_dir = Path(args.output)
 
-    if args.pdf:
-        pdfs = [Path(args.pdf)]
-    else:
+    if args.watch:
         input_path = Path(INPUT_DIR)
-        if not input_path.exists():
-            input_path.mkdir(exist_ok=True)
-            logging.info(f"Created input directory: {input_path}")
-        pdfs = list(input_path.glob("*.pdf"))
+        input_path.mkdir(exist_ok=True)
+    elif not args.refresh_metadata:
+        if args.pdf:
+            pdf = Path(args.pdf)
+            if not pdf.is_file():
+                logging.error(f"PDF not found: {pdf}")
+                return
+            found = [(pdf, pdf.stat().st_size)]
+        else:
+            found = discover_inputs(args, output_dir)
 
-    if not pdfs:
-        logging.warning(f"No PDFs found. Place PDF files in '{INPUT_DIR}/' folder.")
+        if not found:
+            if args.input_list:
+                logging.warning(f"No PDFs to process in '{args.input_list}'.")
+            else:
+                logging.warning(f"No PDFs found. Place PDF files in '{INPUT_DIR}/' folder.")
+            return
+        sizes = dict(found)
+        pdfs = [pdf for pdf, _ in found]
+        logging.info(f"Found {len(pdfs)} PDF(s), {sum(sizes.values()) / 1024 / 1024:.2f} MB "
+                     f"in total")
+
+        if args.plan:
+            run_plan(pdfs, output_dir, args)
+            logging.info("=== PDF Splitter Completed ===")
+            return
+
+        duplicates = {}
+        if args.dedup_inputs:
+            duplicates = find_duplicate_inputs(pdfs, sizes)
+            pdfs = [pdf for pdf in pdfs if pdf not in duplicates]
+    elif not output_dir.is_dir():
+        logging.warning(f"Output directory '{output_dir}' does not exist; nothing to refresh.")
         return
 
-    start_time = time.time()
-    processed_count = 0
-    total_count = len(pdfs)
-
-    for pdf in pdfs:
-        logging.info(f"Processing: {pdf.name}")
-
-        # Build metadata for this PDF
-        metadata = {}
-
-        # Step 1: Extract ISBN from filename (if not overridden)
-        isbn = args.isbn
-        if not isbn:
-            try:
-                isbn = extract_isbn_from_filename(pdf.name)
-                if isbn:
-                    logging.info(f"Extracted ISBN from filename: {isbn}")
-            except ValueError as e:
-                logging.error(f"ISBN extraction error: {e}")
-                isbn = None
-
-        if isbn:
-            metadata['isbn'] = isbn
-
-            # Step 2: Fetch metadata from Google Books API
-            api_metadata = fetch_metadata_from_google_books(isbn)
-            metadata.update(api_metadata)
-
-        # Step 3: Apply CLI overrides
-        if args.title:
-            metadata['parent_document'] = args.title
-        if args.author:
-            metadata['author'] = args.author
-        if args.publisher:
-            metadata['publisher'] = args.publisher
-        if args.published_date:
-            metadata['published_date'] = args.published_date
-        if args.genre:
-            metadata['genre'] = args.genre
-        if args.description:
-            metadata['description'] = args.description
-        if args.language:
-            metadata['language'] = args.language
-
-        pdf_output_dir = output_dir / pdf.stem
-        chunks = split_pdf(pdf, pdf_output_dir, args.background, args.no_split, metadata)
-
-        if chunks is None:
-            logging.info(f"Skipped: {pdf.name}")
+    cache = open_metadata_cache(args, output_dir)
+    prefetcher = MetadataPrefetcher(cache, offline=args.offline, max_workers=args.fetch_workers,
+                                    rate=args.fetch_rate, retries=args.fetch_retries,
+                                    client=client)
+    writer = MetricsWriter(args.metrics_file, args.prometheus_file)
+    chunk_dedup = None
+    if args.dedup_chunks and not (args.refresh_metadata or args.archive):
+        chunk_dedup = ChunkDeduplicator(output_dir)
+    try:
+        if args.refresh_metadata:
+            run_refresh(output_dir, args, prefetcher)
+        elif args.watch:
+            run_watch(input_path, output_dir, args, prefetcher, writer, chunk_dedup)
         else:
-            logging.info(f"Split into {len(chunks)} chunk(s)")
-        processed_count += 1
-        estimate_time(start_time, processed_count, total_count)
+            # Small files are settled here in bulk; the rest run largest first,
+            # with metadata looked up in that order
+            pdfs = resolve_small_inputs(pdfs, sizes, args, prefetcher, writer)
+            book_metrics = {pdf: BookMetrics(pdf.name, sizes[pdf]) for pdf in pdfs}
+            isbns = start_prefetch(pdfs, args, prefetcher, book_metrics)
+            if args.workers > 1 and len(pdfs) > 1:
+                run_batch(pdfs, output_dir, args, isbns, prefetcher, book_metrics, writer,
+                          chunk_dedup)
+            else:
+                progress = BatchProgress([sizes[pdf] for pdf in pdfs], writer)
+                for pdf in pdfs:
+                    metrics = book_metrics[pdf]
+                    metadata = book_metadata(pdf, isbns, args, prefetcher, metrics)
+                    process_pdf(pdf, output_dir, args, metadata, metrics)
+                    dedupe_book_chunks(chunk_dedup, pdf, output_dir, metrics)
+                    progress.book_done(metrics)
+            handle_duplicate_inputs(duplicates, output_dir, args, writer)
+    finally:
+        prefetcher.shutdown()
+        writer.close()
+
+    if chunk_dedup is not None and chunk_dedup.linked:
+        logging.info(f"Chunk dedup: linked {chunk_dedup.linked} chunk(s), "
+                     f"{chunk_dedup.saved_bytes / 1024 / 1024:.2f} MB saved")
+    client.log_stats()
+    if cache is not None:
+        logging.info(f"Metadata cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+        cache.close()
 
     logging.info("=== PDF Splitter Completed ===")
 
@@ -0,0 +1,150 @@
+"""Tests for common.py utilities."""
+
+import os
+import sys
+import logging
+import tempfile
+import unittest
+from unittest import mock
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import google_books_stub
+from common import (
+    GoogleBooksClient, MetadataPrefetcher, percentile, init_worker_logging, start_worker_log_capture, finish_worker_log_capture,
+    replay_log_records, write_text_atomic
+)
+
+
+class PercentileTest(unittest.TestCase):
+    def test_nearest_rank(self):
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 50), 3)
+        self.assertEqual(percentile(list(range(1, 10)), 50), 5)
+        self.assertEqual(percentile([4, 1, 3, 2], 50), 2)
+        self.assertEqual(percentile(list(range(1, 101)), 7), 7)
+        self.assertEqual(percentile(list(range(1, 21)), 95), 19)
+        self.assertEqual(percentile(list(range(1, 21)), 99), 20)
+
+    def test_bounds(self):
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(percentile([5, 9], 0), 5)
+        self.assertEqual(percentile([5, 9], 100), 9)
+        self.assertEqual(percentile([7], 99), 7)
+
+
+class WriteTextAtomicTest(unittest.TestCase):
+    def test_replaces_file_via_unique_temp_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "001_a.jsonl")
+            temp_paths = []
+            replace = os.replace
+
+            def record_replace(source, target):
+                temp_paths.append(source)
+                replace(source, target)
+
+            with mock.patch('os.replace', record_replace):
+                write_text_atomic(path, "first\n")
+                write_text_atomic(path, "二\n")
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(f.read(), "二\n")
+            self.assertEqual(len(set(temp_paths)), 2)
+            self.assertTrue(all(os.path.basename(p).startswith("001_a.jsonl.") for p in temp_paths))
+            self.assertEqual(os.listdir(directory), ["001_a.jsonl"])
+
+    @unittest.skipUnless(os.name == 'posix', "POSIX file modes")
+    def test_file_mode_follows_umask(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "a.jsonl")
+            umask = os.umask(0o027)
+            try:
+                write_text_atomic(path, "text")
+            finally:
+                os.umask(umask)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+
+    def test_temp_file_is_removed_on_failure(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch('os.replace', side_effect=OSError("disk full")):
+                with self.assertRaises(OSError):
+                    write_text_atomic(os.path.join(directory, "a.jsonl"), "text")
+            self.assertEqual(os.listdir(directory), [])
+
+
+class MetadataRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.config = google_books_stub.StubConfig(error_rate=1.0)
+        self.server, self.url = google_books_stub.start_in_thread(self.config)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch(self, status):
+        """Requests the stub got for one lookup answered only with status."""
+        self.config.error_status = status
+        self.config.requests = 0
+        prefetcher = MetadataPrefetcher(max_workers=1, rate=0, retries=2, backoff=0.01,
+                                        client=GoogleBooksClient(self.url))
+        try:
+            with self.assertLogs(level='WARNING'):
+                self.assertEqual(prefetcher.get("9784000000001"), {})
+        finally:
+            prefetcher.shutdown()
+        return self.config.requests
+
+    def test_permanent_errors_are_not_retried(self):
+        for status in (400, 403, 404):
+            self.assertEqual(self.fetch(status), 1, status)
+
+    def test_transient_errors_are_retried(self):
+        for status in (429, 500, 503):
+            self.assertEqual(self.fetch(status), 3, status)
+
+
+class GoogleBooksStubTest(unittest.TestCase):
+    def test_any_query_gets_a_book(self):
+        server, url = google_books_stub.start_in_thread(google_books_stub.StubConfig())
+        client = GoogleBooksClient(url)
+        try:
+            for isbn in ("9784000000001", "400000000X", "unknown"):
+                data = client.request(isbn)
+                self.assertEqual(data['items'][0]['volumeInfo']['title'], f"Stub Book {isbn}")
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+
+
+def _log_in_nested_worker(message):
+    start_worker_log_capture()
+    logging.info(message)
+    return finish_worker_log_capture()
+
+
+def _log_in_worker_with_nested_pool(message):
+    start_worker_log_capture()
+    logging.info("outer")
+    with ProcessPoolExecutor(max_workers=1, initializer=init_worker_logging) as executor:
+        replay_log_records(executor.submit(_log_in_nested_worker, message).result())
+    return finish_worker_log_capture()
+
+
+class WorkerLoggingTest(unittest.TestCase):
+    def test_nested_pool_records_reach_the_parent(self):
+        with ProcessPoolExecutor(max_workers=1, initializer=init_worker_logging) as executor:
+            records = executor.submit(_log_in_worker_with_nested_pool, "per chunk").result()
+        with self.assertLogs(level='INFO') as logs:
+            replay_log_records(records)
+        self.assertEqual(len(logs.records), 2)
+        outer, nested = (record.getMessage() for record in logs.records)
+        self.assertRegex(outer, r"^\[[^\]]+\] outer$")
+        # Prefixed once, with the nested worker's own process name
+        self.assertRegex(nested, r"^\[[^\]]+\] per chunk$")
+        self.assertNotEqual(outer.split()[0], nested.split()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
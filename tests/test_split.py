@@ -0,0 +1,542 @@
+"""
+Tests for split planning and verification.
+
+Run from the repository root with `python -m pytest tests` (or
+`python -m unittest discover tests`).
+"""
+
+import os
+import sys
+import json
+import shutil
+import zipfile
+import tempfile
+import unittest
+import importlib.util
+from pathlib import Path
+from unittest import mock
+
+import fitz
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# The script's file name is not importable as a module name
+_spec = importlib.util.spec_from_file_location('pdf_split', ROOT / 'pdf-split-by-contents.py')
+pdf_split = importlib.util.module_from_spec(_spec)
+sys.modules['pdf_split'] = pdf_split
+_spec.loader.exec_module(pdf_split)
+
+
+def make_book(path, page_count, toc):
+    """Write a PDF of page_count numbered pages with the given TOC."""
+    doc = fitz.open()
+    for pno in range(page_count):
+        doc.new_page().insert_text((72, 72), f"Page {pno + 1}")
+    doc.set_toc(toc)
+    doc.save(str(path))
+    doc.close()
+
+
+class FromTocTest(unittest.TestCase):
+    # Sections 1.1 and 1.2 share page 3; chapter 2 has no sections
+    TOC = [[1, "Book", 1], [2, "Chapter 1", 2], [3, "1.1", 3], [3, "1.2", 3],
+           [3, "1.3", 5], [2, "Chapter 2", 8]]
+
+    def test_sections_on_one_page_are_merged(self):
+        plan = pdf_split.RangePlan.from_toc(self.TOC, 10)
+        self.assertEqual(plan.range_problems(), [])
+        self.assertEqual(plan.tiling_problems(), [])
+        self.assertEqual([(r.start, r.end, r.title) for r in plan],
+                         [(0, 0, "00_Contents"), (1, 1, "Chapter 1_Intro"),
+                          (2, 3, "1.1~1.2"), (4, 6, "1.3"), (7, 9, "Chapter 2")])
+        self.assertEqual(plan[2].sections, ("1.1", "1.2"))
+
+    def test_chapters_on_one_page_are_merged(self):
+        toc = [[1, "A", 1], [1, "B", 3], [1, "C", 3]]
+        plan = pdf_split.RangePlan.from_toc(toc, 5)
+        self.assertEqual(plan.tiling_problems(), [])
+        self.assertEqual([(r.start, r.end, r.title, r.chapter_num) for r in plan],
+                         [(0, 1, "A", 1), (2, 4, "B~C", 3)])
+
+    def test_out_of_order_bookmarks_still_fail(self):
+        toc = [[1, "Book", 1], [2, "Chapter 1", 1], [3, "1.1", 6], [3, "1.2", 2]]
+        plan = pdf_split.RangePlan.from_toc(toc, 8)
+        self.assertNotEqual(plan.range_problems() + plan.tiling_problems(), [])
+
+
+class EnforceMaxChunkBytesTest(unittest.TestCase):
+    TOC = [[1, "Book", 1], [2, "Ch1", 1], [2, "Ch2", 3]]
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self.source = self.tmp / "book.pdf"
+        make_book(self.source, 20, self.TOC)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_chunks_stay_under_limit(self):
+        splitter = pdf_split.PdfSplitter(self.source, {})
+        try:
+            limit = splitter.estimate_range_bytes(2, 8)
+        finally:
+            splitter.close()
+
+        splitter = pdf_split.PdfSplitter(self.source, {}, max_chunk_bytes=limit)
+        try:
+            with self.assertLogs(level='INFO'):
+                chunks = splitter.split_by_bookmarks(self.tmp / "out")
+            estimates = [splitter.estimate_range_bytes(r.start, r.end) for r in splitter.plan]
+        finally:
+            splitter.close()
+
+        self.assertEqual([r.title for r in splitter.plan],
+                         ["Ch1", "Ch2_part1", "Ch2_part2", "Ch2_part3"])
+        self.assertEqual([c.name for c in chunks],
+                         ["001_Ch1.pdf", "002_Ch2_part1.pdf", "003_Ch2_part2.pdf",
+                          "004_Ch2_part3.pdf"])
+        self.assertEqual(splitter.plan.tiling_problems(), [])
+        self.assertTrue(all(r.chapter_title == "Ch2" for r in splitter.plan[1:]))
+        self.assertTrue(all(size <= limit for size in estimates))
+        self.assertTrue(all(c.stat().st_size <= limit for c in chunks))
+
+    def test_page_over_limit_is_its_own_part(self):
+        splitter = pdf_split.PdfSplitter(self.source, {}, max_chunk_bytes=1)
+        try:
+            with self.assertLogs(level='WARNING'):
+                ranges = splitter._enforce_max_chunk_bytes(
+                    [pdf_split.SplitRange(2, 4, "Ch2", 2, "Ch2")])
+        finally:
+            splitter.close()
+        self.assertEqual([(r.start, r.end, r.title) for r in ranges],
+                         [(2, 2, "Ch2_part1"), (3, 3, "Ch2_part2"), (4, 4, "Ch2_part3")])
+
+
+class MergeSmallRangesTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.source = Path(self._tmp.name) / "book.pdf"
+        make_book(self.source, 20, [[1, "Book", 1]])
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    @staticmethod
+    def sections(*pages):
+        ranges = []
+        start = 0
+        for i, count in enumerate(pages):
+            ranges.append(pdf_split.SplitRange(start, start + count - 1, f"1.{i + 1}", 1, "Ch"))
+            start += count
+        return ranges
+
+    def merge(self, ranges, **options):
+        splitter = pdf_split.PdfSplitter(self.source, {}, **options)
+        try:
+            merged = splitter._merge_small_ranges(ranges)
+            sizes = [splitter.estimate_range_bytes(r.start, r.end) for r in merged]
+        finally:
+            splitter.close()
+        return [r.end - r.start + 1 for r in merged], sizes
+
+    def test_page_target(self):
+        # 3+4 lands exactly on the target; 3+5 would pass it
+        pages, _ = self.merge(self.sections(3, 4, 3, 5, 2), merge_pages=7)
+        self.assertEqual(pages, [7, 3, 7])
+
+    def test_section_over_page_target_stays_alone(self):
+        pages, _ = self.merge(self.sections(2, 9, 2, 2), merge_pages=5)
+        self.assertEqual(pages, [2, 9, 4])
+
+    def test_byte_target(self):
+        ranges = self.sections(2, 2, 2, 2, 2, 2)
+        splitter = pdf_split.PdfSplitter(self.source, {})
+        try:
+            # Exactly the estimate of the first two sections together
+            target = splitter.estimate_range_bytes(0, 3)
+        finally:
+            splitter.close()
+        pages, sizes = self.merge(ranges, merge_bytes=target)
+        self.assertEqual(pages[0], 4)
+        self.assertTrue(all(size <= target for size in sizes))
+        self.assertEqual(sum(pages), 12)
+
+        pages, sizes = self.merge(ranges, merge_bytes=target - 1)
+        self.assertEqual(pages[0], 2)
+
+
+class PageIndexTest(unittest.TestCase):
+    # Front matter, a chapter intro, two sections on one page and a title
+    # that is not a valid file name
+    TOC = [[1, "Book", 1], [2, "Chapter 1", 2], [3, "1.1", 3], [3, "1.2", 3],
+           [3, "1.3: Q/A", 5], [2, "Chapter 2", 8]]
+
+    def test_lookup_returns_chunk_and_toc_titles(self):
+        plan = pdf_split.RangePlan.from_toc(self.TOC, 10)
+        index = pdf_split.PageIndex.from_plan(plan, "book.pdf")
+        self.assertEqual(index.lookup(1), ("001_00_Contents.pdf", []))
+        self.assertEqual(index.lookup(2), ("002_Chapter 1_Intro.pdf", ["Chapter 1"]))
+        self.assertEqual(index.lookup(3), ("003_1.1~1.2.pdf", ["Chapter 1", "1.2"]))
+        self.assertEqual(index.lookup(4), ("003_1.1~1.2.pdf", ["Chapter 1", "1.2"]))
+        self.assertEqual(index.lookup(5), ("004_1.3 QA.pdf", ["Chapter 1", "1.3: Q/A"]))
+        self.assertEqual(index.lookup(7), ("004_1.3 QA.pdf", ["Chapter 1", "1.3: Q/A"]))
+        self.assertEqual(index.lookup(10), ("005_Chapter 2.pdf", ["Chapter 2"]))
+        self.assertIsNone(index.lookup(0))
+        self.assertIsNone(index.lookup(11))
+
+    def test_merged_and_sub_split_chunks_keep_toc_titles(self):
+        plan = pdf_split.RangePlan.from_toc(self.TOC, 10)
+        ranges = [pdf_split.SplitRange(0, 0, "00_Contents", 0, "Contents"),
+                  pdf_split.SplitRange(1, 4, "Chapter 1_Intro~1.3 QA", 1, "Chapter 1",
+                                       ("Chapter 1_Intro", "1.1~1.2", "1.3 QA")),
+                  pdf_split.SplitRange(5, 6, "1.3 QA_part2", 1, "Chapter 1"),
+                  pdf_split.SplitRange(7, 9, "Chapter 2", 2, "Chapter 2")]
+        index = pdf_split.PageIndex.from_plan(plan.replace_ranges(ranges))
+        merged = "002_Chapter 1_Intro~1.3 QA.pdf"
+        self.assertEqual(index.lookup(2), (merged, ["Chapter 1"]))
+        self.assertEqual(index.lookup(3), (merged, ["Chapter 1", "1.2"]))
+        self.assertEqual(index.lookup(5), (merged, ["Chapter 1", "1.3: Q/A"]))
+        self.assertEqual(index.lookup(7), ("003_1.3 QA_part2.pdf", ["Chapter 1", "1.3: Q/A"]))
+
+    def test_round_trip(self):
+        plan = pdf_split.RangePlan.from_dict(pdf_split.RangePlan.from_toc(self.TOC, 10).to_dict())
+        index = pdf_split.PageIndex.from_plan(plan, "book.pdf")
+        with tempfile.TemporaryDirectory() as book_dir:
+            index.save(book_dir)
+            loaded = pdf_split.PageIndex.load(book_dir)
+        self.assertEqual(loaded.to_dict(), index.to_dict())
+        self.assertEqual(loaded.lookup(5), ("004_1.3 QA.pdf", ["Chapter 1", "1.3: Q/A"]))
+
+    def test_plan_without_bookmarks_uses_chapter_titles(self):
+        plan = pdf_split.RangePlan([(0, 4, "Part A"), (5, 9, "Part B")], 2, 10)
+        index = pdf_split.PageIndex.from_plan(plan)
+        self.assertEqual(index.lookup(6), ("002_Part B.pdf", ["Part B"]))
+
+
+class PartitionJobsTest(unittest.TestCase):
+    @staticmethod
+    def group_pages(pages, parts):
+        jobs = []
+        start = 0
+        for count in pages:
+            jobs.append((start, start + count - 1, f"{start}.pdf"))
+            start += count
+        groups = pdf_split._partition_jobs(jobs, parts)
+        # Contiguous and in order
+        assert [job for group in groups for job in group] == jobs
+        return [sum(end - start + 1 for start, end, _ in group) for group in groups]
+
+    def test_every_worker_gets_a_share(self):
+        self.assertEqual(self.group_pages([9, 10, 5, 6], 3), [9, 10, 11])
+        self.assertEqual(self.group_pages([5] * 12, 4), [15, 15, 15, 15])
+        self.assertEqual(self.group_pages([8, 2, 2, 2, 2, 2, 2], 2), [10, 10])
+
+    def test_large_jobs(self):
+        self.assertEqual(self.group_pages([100, 1, 1], 3), [100, 1, 1])
+        self.assertEqual(self.group_pages([1, 1, 100, 1, 1], 3), [2, 100, 2])
+
+    def test_fewer_jobs_than_parts(self):
+        self.assertEqual(self.group_pages([3, 7], 4), [3, 7])
+        self.assertEqual(self.group_pages([], 2), [])
+
+
+class DiscoverInputsTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.input_dir = Path(self._tmp.name) / "input_pdf"
+        self._input_dir, pdf_split.INPUT_DIR = pdf_split.INPUT_DIR, str(self.input_dir)
+
+    def tearDown(self):
+        pdf_split.INPUT_DIR = self._input_dir
+        self._tmp.cleanup()
+
+    def discover(self, **options):
+        args = pdf_split.argparse.Namespace(
+            include=None, exclude=None, min_size=None, max_size=None, modified_since=None,
+            input_list=None, recursive=True, done_dir=str(self.input_dir / "done"),
+            failed_dir=str(self.input_dir / "failed"))
+        vars(args).update(options)
+        return pdf_split.discover_inputs(args, Path(self._tmp.name) / "output")
+
+    def test_same_stem_keeps_shallowest(self):
+        for rel_path in ("x.pdf", "a/x.pdf", "pubB/deeper/x.pdf", "pubB/y.pdf"):
+            path = self.input_dir / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"%PDF-1.4 " + rel_path.encode())
+        with self.assertLogs(level='WARNING') as logs:
+            found = self.discover()
+        self.assertEqual(sorted(pdf.relative_to(self.input_dir).as_posix() for pdf, _ in found),
+                         ["pubB/y.pdf", "x.pdf"])
+        self.assertEqual(len(logs.records), 2)
+
+
+class SplitPdfTestCase(unittest.TestCase):
+    """Runs split_pdf() on small generated books (the size threshold is lifted)."""
+
+    TOC = [[1, "Book", 1], [2, "Chapter 1", 1], [2, "Chapter 2", 4], [2, "Chapter 3", 7]]
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self.source = self.tmp / "9784000000001_book.pdf"
+        make_book(self.source, 10, self.TOC)
+        self.output_dir = self.tmp / "out"
+        self._threshold, pdf_split.LARGE_FILE_THRESHOLD = pdf_split.LARGE_FILE_THRESHOLD, 0
+
+    def tearDown(self):
+        pdf_split.LARGE_FILE_THRESHOLD = self._threshold
+        self._tmp.cleanup()
+
+    def split(self, source=None, metadata=None, **options):
+        source = source or self.source
+        metrics = pdf_split.BookMetrics(source.name)
+        options.setdefault('background_mode', True)
+        with self.assertLogs(level='INFO') as logs:
+            chunks = pdf_split.split_pdf(source, self.output_dir / source.stem,
+                                         metadata=metadata, metrics=metrics, **options)
+        self.logs = '\n'.join(logs.output)
+        return chunks, metrics.status
+
+
+class ResumeTest(SplitPdfTestCase):
+    def test_unchanged_book_is_skipped(self):
+        chunks, status = self.split()
+        self.assertEqual(status, 'split')
+        mtimes = [c.stat().st_mtime_ns for c in chunks]
+
+        resumed, status = self.split()
+        self.assertEqual(status, 'resumed')
+        self.assertEqual(resumed, chunks)
+        self.assertEqual([c.stat().st_mtime_ns for c in chunks], mtimes)
+
+    def test_changed_options_are_re_split(self):
+        self.split()
+        _, status = self.split(optimize='compact')
+        self.assertEqual(status, 'split')
+        self.assertIn("options changed: optimize", self.logs)
+
+    def test_changed_source_is_re_split(self):
+        self.split()
+        make_book(self.source, 10, self.TOC[:3])
+        chunks, status = self.split()
+        self.assertEqual(status, 'split')
+        self.assertIn("source file changed", self.logs)
+        self.assertEqual(len(chunks), 2)
+
+    def test_missing_output_is_re_split(self):
+        chunks, _ = self.split()
+        chunks[1].unlink()
+        _, status = self.split()
+        self.assertEqual(status, 'split')
+        self.assertIn(f"output file(s) missing, e.g. {chunks[1].name}", self.logs)
+        self.assertTrue(chunks[1].exists())
+
+    def test_missing_page_index_is_rewritten_without_splitting(self):
+        self.split()
+        (self.output_dir / self.source.stem / pdf_split.PAGE_INDEX_FILE).unlink()
+        _, status = self.split()
+        self.assertEqual(status, 'resumed')
+        self.assertIsNotNone(pdf_split.PageIndex.load(self.output_dir / self.source.stem))
+
+
+class RefreshMetadataTest(SplitPdfTestCase):
+    def test_sidecars_are_rewritten_without_opening_pdfs(self):
+        chunks, _ = self.split(metadata={'genre': "法律"})
+        book_dir = self.output_dir / self.source.stem
+        self.source.unlink()
+
+        with mock.patch.object(pdf_split, 'fitz') as fitz_module, self.assertLogs(level='INFO'):
+            written = pdf_split.refresh_metadata(book_dir, {'genre': "経済", 'isbn': "9784000000001"})
+        fitz_module.open.assert_not_called()
+
+        self.assertEqual(written, 3)
+        for i, chunk in enumerate(chunks):
+            yaml = chunk.with_suffix('.yaml').read_text(encoding='utf-8')
+            self.assertIn("genre: 経済", yaml)
+            self.assertIn("isbn: 9784000000001", yaml)
+            self.assertIn(f"split_index: {i + 1}", yaml)
+        manifest = pdf_split.load_json(book_dir / pdf_split.MANIFEST_FILE)
+        self.assertEqual(manifest['metadata']['genre'], "経済")
+
+    def test_book_without_manifest_is_skipped(self):
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(pdf_split.refresh_metadata(self.tmp / "missing", {}))
+
+
+class TextSidecarTest(SplitPdfTestCase):
+    def test_one_line_per_page(self):
+        chunks, status = self.split(extract_text=True)
+        self.assertEqual(status, 'split')
+        manifest = pdf_split.load_json(self.output_dir / self.source.stem / pdf_split.MANIFEST_FILE)
+
+        for chunk, (start, end), stats in zip(chunks, [(1, 3), (4, 6), (7, 10)], manifest['text']):
+            lines = [json.loads(line) for line in
+                     chunk.with_suffix('.jsonl').read_text(encoding='utf-8').splitlines()]
+            self.assertEqual([line['page'] for line in lines], list(range(start, end + 1)))
+            offset = 0
+            for line in lines:
+                self.assertEqual(line['text'].strip(), f"Page {line['page']}")
+                self.assertEqual(line['offset'], offset)
+                self.assertEqual(line['chars'], len(line['text']))
+                self.assertEqual(line['tokens'], pdf_split.count_tokens(line['text']))
+                offset += line['chars']
+            self.assertEqual(stats, [offset, sum(line['tokens'] for line in lines)])
+            yaml = chunk.with_suffix('.yaml').read_text(encoding='utf-8')
+            self.assertIn(f"text_chars: {offset}", yaml)
+        self.assertEqual(list(chunks[0].parent.glob("*.tmp")), [])
+
+
+class DuplicateInputTest(SplitPdfTestCase):
+    def test_duplicate_links_chunks_and_gets_its_own_index(self):
+        chunks, _ = self.split()
+        copy = self.tmp / "copy.pdf"
+        shutil.copyfile(self.source, copy)
+        with self.assertLogs(level='INFO'):
+            duplicates = pdf_split.find_duplicate_inputs([copy, self.source])
+        self.assertEqual(duplicates, {copy: self.source})
+
+        linked = pdf_split.link_duplicate_output(copy, self.source, self.output_dir)
+        self.assertEqual(linked, 6)  # 3 chunks and their sidecars
+        book_dir = self.output_dir / "copy"
+        for chunk in chunks:
+            for original in (chunk, chunk.with_suffix('.yaml')):
+                self.assertTrue(os.path.samefile(original, book_dir / original.name))
+
+        original_dir = self.output_dir / self.source.stem
+        self.assertFalse(os.path.samefile(original_dir / pdf_split.PAGE_INDEX_FILE,
+                                          book_dir / pdf_split.PAGE_INDEX_FILE))
+        index = pdf_split.PageIndex.load(book_dir)
+        self.assertEqual(index.source, "copy.pdf")
+        self.assertEqual(index.lookup(5), ("002_Chapter 2.pdf", ["Chapter 2"]))
+        self.assertEqual(pdf_split.PageIndex.load(original_dir).source, self.source.name)
+        manifest = pdf_split.load_json(book_dir / pdf_split.MANIFEST_FILE)
+        self.assertEqual(manifest['source']['name'], "copy.pdf")
+        self.assertEqual(manifest['duplicate_of'], self.source.name)
+
+        _, status = self.split(copy)
+        self.assertEqual(status, 'resumed')
+
+    def test_original_without_split_is_not_linked(self):
+        copy = self.tmp / "copy.pdf"
+        shutil.copyfile(self.source, copy)
+        self.assertIsNone(pdf_split.link_duplicate_output(copy, self.source, self.output_dir))
+        self.assertFalse((self.output_dir / "copy").exists())
+
+
+class PlanTest(SplitPdfTestCase):
+    def plan(self):
+        args = pdf_split.argparse.Namespace(
+            chunk_workers=1, optimize='none', subset_fonts=False, report_savings=False,
+            max_chunk_bytes=None, merge_pages=None, merge_bytes=None, max_memory=None,
+            archive=None, image_dpi=None, image_quality=None, grayscale_images=False,
+            extract_text=False, verify='pages')
+        with mock.patch.object(pdf_split, 'sha256_file', wraps=pdf_split.sha256_file) as hashed:
+            report = pdf_split.plan_pdf(self.source, self.output_dir, args)
+        return report, hashed.call_count
+
+    def test_unsplit_book_is_not_hashed(self):
+        report, hashed = self.plan()
+        self.assertEqual((report['status'], report['chunk_count'], hashed), ('planned', 3, 0))
+        self.assertFalse(report['already_split'])
+        self.assertFalse((self.output_dir / pdf_split.PLAN_CACHE_DIR).exists())
+
+    def test_split_book_reuses_manifest_hash(self):
+        self.split(plan_cache_dir=self.output_dir / pdf_split.PLAN_CACHE_DIR)
+        with self.assertLogs(level='INFO') as logs:
+            report, hashed = self.plan()
+        self.assertEqual((report['status'], report['chunk_count'], hashed), ('planned', 3, 0))
+        self.assertTrue(report['already_split'])
+        self.assertIn("Using cached range plan", '\n'.join(logs.output))
+
+
+class ArchiveTest(SplitPdfTestCase):
+    def check_archive(self, fmt):
+        chunks, status = self.split(archive=fmt)
+        self.assertEqual(status, 'split')
+        self.assertEqual([c.name for c in chunks], [f"{self.source.stem}.{fmt}"])
+
+        members = list(pdf_split.iter_archive_members(chunks[0]))
+        self.assertEqual(members[0][0], pdf_split.ARCHIVE_INDEX)
+        index = json.loads(members[0][1])
+        self.assertEqual(index['source'], self.source.name)
+        self.assertEqual(index['total_chapters'], 3)
+        self.assertEqual([(c['pdf'], c['yaml'], c['start_page'], c['end_page'])
+                          for c in index['chunks']],
+                         [("001_Chapter 1.pdf", "001_Chapter 1.yaml", 1, 3),
+                          ("002_Chapter 2.pdf", "002_Chapter 2.yaml", 4, 6),
+                          ("003_Chapter 3.pdf", "003_Chapter 3.yaml", 7, 10)])
+        return chunks[0], dict(members), index
+
+    def test_zip_members_are_read_directly(self):
+        path, _, index = self.check_archive('zip')
+        with zipfile.ZipFile(path) as archive:
+            for entry in index['chunks']:
+                with fitz.open(stream=archive.read(entry['pdf']), filetype='pdf') as doc:
+                    self.assertEqual(doc.page_count, entry['end_page'] - entry['start_page'] + 1)
+                self.assertIn(f"start_page: {entry['start_page']}",
+                              archive.read(entry['yaml']).decode('utf-8'))
+
+    def test_tar_holds_every_indexed_member(self):
+        _, members, index = self.check_archive('tar')
+        for entry in index['chunks']:
+            with fitz.open(stream=members[entry['pdf']], filetype='pdf') as doc:
+                self.assertEqual(doc.page_count, entry['end_page'] - entry['start_page'] + 1)
+            self.assertIn(entry['yaml'], members)
+
+
+class SplitVerificationTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_split_with_sections_on_one_page(self):
+        source = self.tmp / "book.pdf"
+        make_book(source, 10, FromTocTest.TOC)
+        splitter = pdf_split.PdfSplitter(source, {}, verify=True, checksums=True)
+        try:
+            chunks = splitter.split_by_bookmarks(self.tmp / "out")
+        finally:
+            splitter.close()
+
+        self.assertEqual(len(chunks), 5)
+        page_counts = []
+        for chunk in chunks:
+            with fitz.open(chunk) as doc:
+                page_counts.append(doc.page_count)
+        self.assertEqual(page_counts, [1, 1, 2, 3, 3])
+        self.assertEqual(len(splitter.checksums), 5)
+
+    def test_out_of_order_bookmarks_fail_before_writing(self):
+        source = self.tmp / "book.pdf"
+        make_book(source, 8, [[1, "Book", 1], [2, "Chapter 1", 1], [3, "1.1", 6], [3, "1.2", 2]])
+        splitter = pdf_split.PdfSplitter(source, {}, verify=True)
+        try:
+            with self.assertRaises(pdf_split.SplitVerificationError):
+                splitter.split_by_bookmarks(self.tmp / "out")
+        finally:
+            splitter.close()
+        self.assertEqual(list((self.tmp / "out").glob("*.pdf")), [])
+
+
+    def test_failed_verification_is_reported_as_failure(self):
+        source = self.tmp / "book.pdf"
+        make_book(source, 8, [[1, "Book", 1], [2, "Chapter 1", 1], [3, "1.1", 6], [3, "1.2", 2]])
+        metrics = pdf_split.BookMetrics(source.name)
+        threshold, pdf_split.LARGE_FILE_THRESHOLD = pdf_split.LARGE_FILE_THRESHOLD, 0
+        try:
+            with self.assertLogs(level='ERROR'):
+                chunks = pdf_split.split_pdf(source, self.tmp / "out", no_split=True,
+                                             metrics=metrics)
+        finally:
+            pdf_split.LARGE_FILE_THRESHOLD = threshold
+        self.assertIsNone(chunks)
+        self.assertEqual(metrics.status, 'failed')
+        self.assertFalse((self.tmp / "out" / pdf_split.MANIFEST_FILE).exists())
+
+if __name__ == '__main__':
+    unittest.main()